@@ -14,8 +14,15 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import asyncio
+import select
 import socket
-from ssh2.session import Session
+from ssh2.error_codes import LIBSSH2_ERROR_EAGAIN
+from ssh2.session import (
+    Session,
+    LIBSSH2_SESSION_BLOCK_INBOUND,
+    LIBSSH2_SESSION_BLOCK_OUTBOUND,
+)
 from ssh2.utils import handle_error_codes
 from enum import Enum
 
@@ -24,6 +31,16 @@ CHANNEL_TYPE_SESSION = "session"
 CHANNEL_TYPE_SFTP = "sftp"
 CHANNEL_TYPES = [CHANNEL_TYPE_SESSION, CHANNEL_TYPE_SFTP]
 
+STREAM_STDOUT = "stdout"
+STREAM_STDERR = "stderr"
+# The amount of bytes that a command reads or writes at a time
+# when its channel is used without blocking
+CHANNEL_CHUNK_SIZE = 64 * 1024
+# The data of a channel can be received while another channel of the session
+# reads from the socket, so the waiting channels also check their buffers
+# at this interval in seconds
+CHANNEL_POLL_INTERVAL = 0.1
+
 
 class SSHClientResultCode(Enum):
 
@@ -60,6 +77,16 @@ class SSHClient:
         self.channel = None
         self.sftp_channel = None
         self._is_session_connected = False
+        # The async commands that are running on the session
+        self._async_commands = 0
+        # The channels of abandoned async commands, which are closed once
+        # the session is blocking again
+        self._abandoned_channels = []
+        # The futures that wait for the socket in each libssh2 block direction
+        self._socket_waiters = {
+            LIBSSH2_SESSION_BLOCK_INBOUND: [],
+            LIBSSH2_SESSION_BLOCK_OUTBOUND: [],
+        }
 
     def __del__(self):
         self.disconnect()
@@ -193,7 +220,15 @@ class SSHClient:
         if self.is_socket_connected():
             self._close_socket()
 
-    def exec_command(self, command, channel=None):
+    def exec_command(self, command, channel=None, stdin=None):
+        """
+        :param command: the command to execute
+        :param channel: optional channel that the command is executed on
+        :param stdin: optional bytes, str, file object or iterator of chunks that
+        are written to the standard input of the command in chunks, while the
+        output is read, after which the standard input is closed
+        :return: (SSHClientResultCode, dict) with the exit_code and output
+        """
         if not channel:
             if not self.open_channel():
                 return (
@@ -207,12 +242,16 @@ class SSHClient:
         channel_return_code = handle_error_codes(channel.execute(command))
         if channel_return_code != 0:
             # An unkown error occurred
+            return_dict = {}
             return_dict["channel_error_code"] = channel_return_code
             return_dict["output"] = (
                 f"An unknown error code was returned from executing the command: {command}"
             )
             return (SSHClientResultCode.CHANNEL_EXECUTE_ERROR, return_dict)
 
+        if stdin is not None:
+            return self._communicate(command, channel, stdin)
+
         stderr_success, stderr_response = read_channel_response_stderr(channel)
         exit_code = read_channel_exit_status(channel)
         return_dict = {"exit_code": exit_code}
@@ -236,6 +275,199 @@ class SSHClient:
         return_dict["output"] = stdout_response
         return SSHClientResultCode.SUCCESS, return_dict
 
+    def _communicate(self, command, channel, stdin):
+        """Write stdin to the executed command while its output is read, where the
+        session is used without blocking such that neither end waits for the other
+        to drain its side of the channel
+        :return: (SSHClientResultCode, dict) as returned by exec_command
+        """
+        output = {STREAM_STDOUT: [], STREAM_STDERR: []}
+        pump = ChannelPump(channel, stdin=stdin)
+        # The session stays non-blocking while async commands are running on it
+        self._enter_async()
+        try:
+            try:
+                while not pump.done:
+                    progress, chunks = pump.step()
+                    for stream, chunk in chunks:
+                        output[stream].append(chunk)
+                    if not progress and not pump.done:
+                        self._select_socket()
+            except Exception:
+                return (
+                    SSHClientResultCode.CHANNEL_READ_ERROR,
+                    {
+                        "output": f"Failed to communicate with the command: {command}",
+                    },
+                )
+            finally:
+                self._retry_select(channel.close)
+                self._retry_select(channel.wait_closed)
+        finally:
+            self._exit_async()
+        return command_result(command, read_channel_exit_status(channel), output)
+
+    def _retry_select(self, function, *args):
+        """Call a non-blocking libssh2 function until it does not return EAGAIN,
+        where the socket is waited for in between
+        :return: the result of function
+        """
+        while True:
+            result = function(*args)
+            code = result[0] if isinstance(result, tuple) else result
+            if not isinstance(code, int) or code != LIBSSH2_ERROR_EAGAIN:
+                return result
+            self._select_socket()
+
+    def _select_socket(self):
+        """Wait until the socket is ready in the directions that
+        the non-blocking session is blocked on
+        """
+        directions = self.session.block_directions()
+        readers, writers = [], []
+        if directions & LIBSSH2_SESSION_BLOCK_INBOUND:
+            readers.append(self.socket)
+        if directions & LIBSSH2_SESSION_BLOCK_OUTBOUND:
+            writers.append(self.socket)
+        if readers or writers:
+            select.select(readers, writers, [], CHANNEL_POLL_INTERVAL)
+
+    def exec_stream(self, command, stdin=None):
+        """Execute a command from an asyncio event loop, where the output is
+        received as it is produced:
+
+            command = client.exec_stream("make")
+            async for stream, chunk in command:
+                ...
+            exit_code = command.exit_code
+
+        :param command: the command to execute
+        :param stdin: optional bytes, str, file object or iterator of chunks that
+        are sent to the standard input, where a file object is read on the loop
+        :return: AsyncCommand
+        """
+        return AsyncCommand(self, command, stdin=stdin)
+
+    async def exec(self, command, stdin=None):
+        """Execute a command from an asyncio event loop, where many commands
+        can run at the same time on the channels of the session.
+        The session is in non-blocking mode while async commands are running,
+        during which it should not be used by the blocking methods.
+        :param command: the command to execute
+        :param stdin: optional input of the command as accepted by exec_stream
+        :return: (SSHClientResultCode, dict) as returned by exec_command
+        """
+        async_command = self.exec_stream(command, stdin=stdin)
+        result_code = await async_command.start()
+        if result_code == SSHClientResultCode.CHANNEL_OPEN_ERROR:
+            return (
+                result_code,
+                {
+                    "output": (
+                        f"Failed to open a channel to execute the command: {command}"
+                    ),
+                },
+            )
+        if result_code != SSHClientResultCode.SUCCESS:
+            return (
+                result_code,
+                {
+                    "channel_error_code": async_command.error_code,
+                    "output": (
+                        "An unknown error code was returned from executing "
+                        f"the command: {command}"
+                    ),
+                },
+            )
+
+        output = {STREAM_STDOUT: [], STREAM_STDERR: []}
+        try:
+            async for stream, chunk in async_command:
+                output[stream].append(chunk)
+        except OSError:
+            return (
+                SSHClientResultCode.CHANNEL_READ_ERROR,
+                {
+                    "exit_code": async_command.exit_code,
+                    "output": (
+                        f"Failed to read the channel output of the command: {command}"
+                    ),
+                },
+            )
+
+        return command_result(command, async_command.exit_code, output)
+
+    def _enter_async(self):
+        if not self._async_commands:
+            self.session.set_blocking(False)
+        self._async_commands += 1
+
+    def _exit_async(self):
+        self._async_commands -= 1
+        if not self._async_commands and self.session:
+            self.session.set_blocking(True)
+            channels, self._abandoned_channels = self._abandoned_channels, []
+            for channel in channels:
+                try:
+                    channel.close()
+                except Exception:
+                    pass
+
+    async def _retry(self, function, *args):
+        """Call a non-blocking libssh2 function until it does not return EAGAIN
+        :return: the result of function
+        """
+        while True:
+            result = function(*args)
+            code = result[0] if isinstance(result, tuple) else result
+            if not isinstance(code, int) or code != LIBSSH2_ERROR_EAGAIN:
+                self._wake_socket_waiters()
+                return result
+            await self._wait_socket()
+
+    async def _wait_socket(self):
+        """Wait until the socket is ready in the directions that the session
+        is blocked on, or until another channel of the session has made progress
+        """
+        directions = self.session.block_directions()
+        if not directions:
+            await asyncio.sleep(0)
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        for direction, watch in (
+            (LIBSSH2_SESSION_BLOCK_INBOUND, loop.add_reader),
+            (LIBSSH2_SESSION_BLOCK_OUTBOUND, loop.add_writer),
+        ):
+            if directions & direction:
+                waiters = self._socket_waiters[direction]
+                if not waiters:
+                    watch(self.socket.fileno(), self._wake_socket_waiters)
+                waiters.append(future)
+        try:
+            await asyncio.wait([future], timeout=CHANNEL_POLL_INTERVAL)
+        finally:
+            for waiters in self._socket_waiters.values():
+                if future in waiters:
+                    waiters.remove(future)
+            self._unwatch_socket(loop)
+
+    def _wake_socket_waiters(self):
+        for direction, waiters in self._socket_waiters.items():
+            self._socket_waiters[direction] = []
+            for future in waiters:
+                if not future.done():
+                    future.set_result(None)
+        self._unwatch_socket(asyncio.get_running_loop())
+
+    def _unwatch_socket(self, loop):
+        if not self.socket:
+            return
+        if not self._socket_waiters[LIBSSH2_SESSION_BLOCK_INBOUND]:
+            loop.remove_reader(self.socket.fileno())
+        if not self._socket_waiters[LIBSSH2_SESSION_BLOCK_OUTBOUND]:
+            loop.remove_writer(self.socket.fileno())
+
     def run_single_command(self, command):
         with self as _client:
             if not _client.connect():
@@ -290,6 +522,216 @@ class SSHClient:
         return responses
 
 
+class AsyncCommand:
+    def __init__(self, client, command, stdin=None):
+        """A command that is executed on a channel of a non-blocking session
+        :param client: the connected SSHClient
+        :param command: the command to execute
+        :param stdin: optional bytes, str, file object or iterator of chunks
+        that are sent to the standard input
+        """
+        self.client = client
+        self.command = command
+        self.stdin = stdin
+        self.channel = None
+        self.error_code = None
+        self.exit_code = None
+        self._started = None
+        self._consumed = False
+
+    async def start(self):
+        """Open a channel and execute the command
+        :return: SSHClientResultCode
+        """
+        if self._started is not None:
+            return self._started
+        client = self.client
+        if not client.is_session_connected():
+            self._started = SSHClientResultCode.CHANNEL_OPEN_ERROR
+            return self._started
+        client._enter_async()
+        result_code = SSHClientResultCode.CHANNEL_EXECUTE_ERROR
+        try:
+            channel = await client._retry(client.session.open_session)
+            if isinstance(channel, int):
+                self.error_code = channel
+                result_code = SSHClientResultCode.CHANNEL_OPEN_ERROR
+                return result_code
+            self.channel = channel
+            return_code = await client._retry(channel.execute, self.command)
+            if return_code != 0:
+                self.error_code = return_code
+                return result_code
+            result_code = SSHClientResultCode.SUCCESS
+        except Exception:
+            pass
+        finally:
+            # Also when the task is cancelled, the session is made blocking again
+            # once no other command is running
+            if result_code != SSHClientResultCode.SUCCESS:
+                self._close()
+            self._started = result_code
+        return result_code
+
+    def __aiter__(self):
+        return self._output()
+
+    async def _output(self):
+        """
+        :return: async generator of (STREAM_STDOUT or STREAM_STDERR, bytes)
+        """
+        if self._consumed:
+            raise RuntimeError("The output of a command can only be read once")
+        self._consumed = True
+        if await self.start() != SSHClientResultCode.SUCCESS:
+            raise ConnectionError(
+                "Failed to execute the command: {} - error_code: {}".format(
+                    self.command, self.error_code
+                )
+            )
+        client, channel = self.client, self.channel
+        pump = ChannelPump(channel, stdin=self.stdin)
+        try:
+            while not pump.done:
+                progress, chunks = pump.step()
+                for output in chunks:
+                    yield output
+                if progress:
+                    client._wake_socket_waiters()
+                elif not pump.done:
+                    await client._wait_socket()
+            await client._retry(channel.close)
+            await client._retry(channel.wait_closed)
+            self.exit_code = channel.get_exit_status()
+        finally:
+            self._close()
+
+    def _close(self):
+        if self.channel is not None and self.exit_code is None:
+            # The output was not read to the end, where closing the channel
+            # of the non-blocking session might return EAGAIN before it is done
+            self.client._abandoned_channels.append(self.channel)
+        self.channel = None
+        self.client._exit_async()
+
+    async def wait(self):
+        """Discard the output that has not been read and wait for the command
+        :return: the exit code of the command
+        """
+        if not self._consumed:
+            async for _ in self:
+                pass
+        return self.exit_code
+
+
+class ChannelPump:
+    def __init__(self, channel, stdin=None, chunk_size=CHANNEL_CHUNK_SIZE):
+        """Moves the standard input and output of an executed command through
+        a channel of a non-blocking session, where the next chunk of stdin is only
+        taken once the previous has been accepted by the channel window,
+        such that a slow remote command holds back the source of stdin
+        :param channel: the channel that the command has been executed on
+        :param stdin: optional bytes, str, file object or iterator of chunks
+        :param chunk_size: the amount of bytes that are written or read at a time
+        """
+        self.channel = channel
+        self.chunk_size = chunk_size
+        self._chunks = None
+        if stdin is not None:
+            self._chunks = iter_stdin_chunks(stdin, chunk_size)
+        self._pending = b""
+        self.done = False
+
+    def _write(self):
+        """
+        :return: whether any of stdin was written or closed
+        """
+        while not self._pending:
+            self._pending = next(self._chunks, None)
+            if self._pending is None:
+                if self.channel.send_eof() == LIBSSH2_ERROR_EAGAIN:
+                    self._pending = b""
+                    return False
+                self._chunks = None
+                return True
+        _, written = self.channel.write(self._pending)
+        self._pending = self._pending[written:]
+        return written > 0
+
+    def step(self):
+        """Write and read what the channel accepts without blocking
+        :return: (progress, output), where output is a list of
+        (STREAM_STDOUT or STREAM_STDERR, bytes) and progress is False
+        when the session has to wait for the socket
+        """
+        progress = False
+        if self._chunks is not None:
+            progress = self._write()
+        output = []
+        for stream, read in (
+            (STREAM_STDOUT, self.channel.read),
+            (STREAM_STDERR, self.channel.read_stderr),
+        ):
+            size, data = read(self.chunk_size)
+            if size > 0:
+                progress = True
+                output.append((stream, data))
+            elif size < 0 and size != LIBSSH2_ERROR_EAGAIN:
+                raise OSError(
+                    "Failed to read the {} of the channel - error_code: {}".format(
+                        stream, size
+                    )
+                )
+        if not progress and self._chunks is None and self.channel.eof():
+            self.done = True
+        return progress, output
+
+
+def iter_stdin_chunks(stdin, chunk_size=CHANNEL_CHUNK_SIZE):
+    """
+    :param stdin: bytes, str, file object or iterator of bytes or str chunks
+    :return: generator of the bytes chunks of stdin
+    """
+    if isinstance(stdin, str):
+        stdin = stdin.encode("utf-8")
+    if isinstance(stdin, (bytes, bytearray, memoryview)):
+        view = memoryview(stdin)
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset : offset + chunk_size])
+        return
+    chunks = stdin
+    if hasattr(stdin, "read"):
+        # The file is read until it returns an empty bytes or str
+        chunks = iter(lambda: stdin.read(chunk_size), stdin.read(0))
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        if chunk:
+            yield bytes(chunk)
+
+
+def command_result(command, exit_code, output):
+    """
+    :param command: the command that has been executed
+    :param exit_code: the exit code of the command
+    :param output: dict of the list of bytes chunks of each stream
+    :return: (SSHClientResultCode, dict) as returned by SSHClient.exec_command
+    """
+    return_dict = {"exit_code": exit_code}
+    stderr_response = decode_bytes_to_string(b"".join(output[STREAM_STDERR]))
+    stdout_response = decode_bytes_to_string(b"".join(output[STREAM_STDOUT]))
+    if stderr_response is False or stdout_response is False:
+        return_dict["output"] = (
+            f"Failed to read the channel output of the command: {command}"
+        )
+        return SSHClientResultCode.CHANNEL_READ_ERROR, return_dict
+    if stderr_response:
+        return_dict["output"] = stderr_response
+        return SSHClientResultCode.STDERR_RESPONSE, return_dict
+    return_dict["output"] = stdout_response
+    return SSHClientResultCode.SUCCESS, return_dict
+
+
 def read_channel_response_stdout(channel):
     response = ""
     size, data = channel.read()
@@ -314,6 +756,17 @@ def read_channel_response_stderr(channel):
     return True, response
 
 
+def read_channel_stdout_chunks(channel, chunk_size=CHANNEL_CHUNK_SIZE):
+    """
+    :param chunk_size: the maximum amount of bytes that are read at a time
+    :return: generator of the bytes written to stdout, as they are received
+    """
+    size, data = channel.read(chunk_size)
+    while size > 0:
+        yield data
+        size, data = channel.read(chunk_size)
+
+
 def read_channel_exit_status(channel):
     return channel.get_exit_status()
 
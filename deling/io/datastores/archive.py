@@ -0,0 +1,124 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import io
+import os
+import shlex
+import tarfile
+
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+# The tar options that compress the archive on the remote end, such that
+# the exit status of the command is that of tar itself
+TAR_COMPRESSION_OPTIONS = {
+    COMPRESSION_GZIP: "-z",
+    COMPRESSION_ZSTD: "--zstd",
+}
+
+
+def import_zstandard():
+    try:
+        import zstandard
+
+        return zstandard
+    except ImportError as err:
+        raise ImportError(
+            "zstandard is required for zstd compressed archives, "
+            "install it with: pip install deling[zstd]"
+        ) from err
+
+
+def tar_command(path, compression=None):
+    """
+    :param path: the remote directory that is archived
+    :param compression: optional key of TAR_COMPRESSION_OPTIONS
+    :return: the command that writes the archive of the content of path to stdout
+    """
+    if compression is not None:
+        return "tar -C {} {} -cf - .".format(
+            shlex.quote(path), TAR_COMPRESSION_OPTIONS[compression]
+        )
+    return "tar -C {} -cf - .".format(shlex.quote(path))
+
+
+class ChunkStream(io.RawIOBase):
+    def __init__(self, chunks):
+        """A readable file object over an iterator of bytes chunks,
+        such as the output of a remote command as it is received
+        :param chunks: iterator of bytes
+        """
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = memoryview(chunk)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _check_member(member, local_path):
+    """Reject the members that would be extracted outside of local_path,
+    for the Python versions without tarfile extraction filters
+    """
+    root = os.path.realpath(local_path)
+    target = os.path.realpath(os.path.join(root, member.name))
+    paths = [target]
+    if member.issym():
+        paths.append(
+            os.path.realpath(os.path.join(os.path.dirname(target), member.linkname))
+        )
+    elif member.islnk():
+        paths.append(os.path.realpath(os.path.join(root, member.linkname)))
+    for path in paths:
+        if os.path.commonpath([root, path]) != root:
+            raise tarfile.ExtractError(
+                "The member {} is outside of {}".format(member.name, local_path)
+            )
+    if member.isdev():
+        raise tarfile.ExtractError("The member {} is a device".format(member.name))
+
+
+def extract_tar_stream(fileobj, local_path, compression=None):
+    """Extract a tar archive while it is being read, where the members
+    that would be placed outside of local_path are rejected
+    :param fileobj: readable file object of the archive
+    :param local_path: the local directory that the archive is extracted into
+    :param compression: optional key of TAR_COMPRESSION_OPTIONS
+    :return: the amount of members that were extracted
+    """
+    if compression == COMPRESSION_ZSTD:
+        fileobj = import_zstandard().ZstdDecompressor().stream_reader(fileobj)
+    mode = "r|gz" if compression == COMPRESSION_GZIP else "r|"
+    extracted = 0
+    with tarfile.open(fileobj=fileobj, mode=mode) as archive:
+        for member in archive:
+            if hasattr(tarfile, "data_filter"):
+                archive.extract(member, local_path, filter="data")
+            else:
+                _check_member(member, local_path)
+                archive.extract(member, local_path)
+            extracted += 1
+    return extracted
@@ -0,0 +1,275 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import ast
+import itertools
+import math
+import struct
+
+NPY_MAGIC = b"\x93NUMPY"
+
+
+def import_numpy():
+    try:
+        import numpy
+
+        return numpy
+    except ImportError as err:
+        raise ImportError(
+            "numpy is required for remote arrays, "
+            "install it with: pip install deling[array]"
+        ) from err
+
+
+def read_npy_header(file_handle):
+    """
+    :param file_handle: binary SFTPFileHandle positioned at the start of a .npy file
+    :return: tuple of (dtype descr, fortran_order, shape, data offset)
+    """
+    preamble = file_handle.read(8)
+    if preamble[:6] != NPY_MAGIC:
+        raise ValueError("{} is not a .npy file".format(file_handle.name))
+
+    major_version = preamble[6]
+    if major_version == 1:
+        (header_length,) = struct.unpack("<H", file_handle.read(2))
+        header_start = 10
+    elif major_version in (2, 3):
+        (header_length,) = struct.unpack("<I", file_handle.read(4))
+        header_start = 12
+    else:
+        raise ValueError("Unsupported .npy format version: {}".format(major_version))
+
+    header_encoding = "utf-8" if major_version == 3 else "latin1"
+    header = ast.literal_eval(file_handle.read(header_length).decode(header_encoding))
+    return (
+        header["descr"],
+        header["fortran_order"],
+        tuple(header["shape"]),
+        header_start + header_length,
+    )
+
+
+class RemoteArray:
+    def __init__(self, file_handle, dtype, shape, offset=0, order="C"):
+        """A lazy array view over a remote file, where indexing only
+        reads the byte ranges that are required by the selection.
+        :param file_handle: binary SFTPFileHandle of the file that holds the array
+        :param dtype: the numpy dtype of the array elements
+        :param shape: the shape of the array
+        :param offset: the byte offset in the file where the array data starts
+        :param order: the memory layout of the array, either 'C' or 'F'
+        """
+        if order not in ("C", "F"):
+            raise ValueError("order must be either 'C' or 'F', is: {}".format(order))
+        self._numpy = import_numpy()
+        self.file_handle = file_handle
+        self.dtype = self._numpy.dtype(dtype)
+        self.shape = tuple(int(dimension) for dimension in shape)
+        self.offset = offset
+        self.order = order
+        # A Fortran ordered array is laid out as a C ordered array
+        # with the axes reversed
+        if order == "C":
+            self._layout_shape = self.shape
+        else:
+            self._layout_shape = self.shape[::-1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        if not self.shape:
+            raise TypeError("len() of unsized object")
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.read()
+        if dtype is not None:
+            return array.astype(dtype)
+        return array
+
+    def __getitem__(self, index):
+        index = self._expand_index(index)
+        if self.order == "F":
+            return self._read_index(index[::-1]).T
+        return self._read_index(index)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return math.prod(self.shape)
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def close(self):
+        self.file_handle.close()
+
+    def read(self):
+        """
+        :return: the entire array as a numpy.ndarray
+        """
+        return self[...]
+
+    def _expand_index(self, index):
+        """
+        :param index: the index passed to __getitem__
+        :return: tuple with one int, slice or list of ints per axis
+        """
+        if not isinstance(index, tuple):
+            index = (index,)
+        # Compared by identity, since == is elementwise for array indexes
+        ellipses = [
+            position
+            for position, axis_index in enumerate(index)
+            if axis_index is Ellipsis
+        ]
+        if len(ellipses) > 1:
+            raise IndexError("an index can only have a single ellipsis ('...')")
+        if ellipses:
+            position = ellipses[0]
+            before, after = index[:position], index[position:][1:]
+            missing = self.ndim - (len(index) - 1)
+            index = before + (slice(None),) * missing + after
+        if len(index) > self.ndim:
+            raise IndexError(
+                "too many indices for array: array is {}-dimensional, "
+                "but {} were indexed".format(self.ndim, len(index))
+            )
+        index = index + (slice(None),) * (self.ndim - len(index))
+
+        np = self._numpy
+        expanded, sequences = [], 0
+        for axis, axis_index in enumerate(index):
+            if isinstance(axis_index, slice):
+                expanded.append(axis_index)
+            elif isinstance(axis_index, (bool, np.bool_)):
+                raise IndexError("boolean scalar indexes are not supported")
+            elif isinstance(axis_index, (int, np.integer)):
+                expanded.append(int(axis_index))
+            else:
+                sequences += 1
+                values = np.asarray(axis_index)
+                if values.dtype == bool:
+                    # A mask selects the indexes where it is True
+                    if values.shape != (self.shape[axis],):
+                        raise IndexError(
+                            "boolean index did not match axis {} with size {}".format(
+                                axis, self.shape[axis]
+                            )
+                        )
+                    values = np.flatnonzero(values)
+                expanded.append([int(value) for value in values])
+        if sequences > 1:
+            raise IndexError("only a single integer sequence index is supported")
+        return tuple(expanded)
+
+    def _read_index(self, index):
+        """
+        :param index: expanded index in the C ordered layout of the file
+        :return: numpy.ndarray with the selected elements
+        """
+        np = self._numpy
+        shape = self._layout_shape
+        selections = []
+        for axis, (axis_index, dimension) in enumerate(zip(index, shape)):
+            if isinstance(axis_index, int):
+                if not -dimension <= axis_index < dimension:
+                    raise IndexError(
+                        "index {} is out of bounds for axis {} with size {}".format(
+                            axis_index, axis, dimension
+                        )
+                    )
+                selections.append(np.array([axis_index % dimension]))
+            else:
+                selections.append(np.arange(dimension)[axis_index])
+
+        # Drop the length of the integer indexed axes from the result
+        squeeze = tuple(
+            0 if isinstance(axis_index, int) else slice(None) for axis_index in index
+        )
+        if any(len(selection) == 0 for selection in selections):
+            empty_shape = [len(selection) for selection in selections]
+            return np.empty(empty_shape, dtype=self.dtype)[squeeze]
+
+        # The axes after the last partially selected axis are read in full,
+        # such that every run of consecutive indexes of that axis is a single
+        # contiguous range of the file
+        last_axis = -1
+        for axis, (selection, dimension) in enumerate(zip(selections, shape)):
+            if len(selection) != dimension or np.any(selection != np.arange(dimension)):
+                last_axis = axis
+
+        # The amount of elements between consecutive indexes of each axis
+        strides = [math.prod(shape[axis:][1:]) for axis in range(len(shape))]
+        if last_axis == -1:
+            runs = [(0, max(math.prod(shape), 1))]
+            outer_selections = []
+        else:
+            # Strided and scattered indexes are read as separate ranges,
+            # which read_ranges joins when they are close to each other
+            selection = selections[last_axis]
+            breaks = np.flatnonzero(np.diff(selection) != 1) + 1
+            bounds = [0] + breaks.tolist() + [len(selection)]
+            runs = [
+                (
+                    int(selection[start]) * strides[last_axis],
+                    (stop - start) * strides[last_axis],
+                )
+                for start, stop in zip(bounds, bounds[1:])
+            ]
+            outer_selections = selections[:last_axis]
+
+        itemsize = self.dtype.itemsize
+        ranges = []
+        for outer_index in itertools.product(*outer_selections):
+            element_offset = sum(
+                int(value) * strides[axis] for axis, value in enumerate(outer_index)
+            )
+            for run_offset, run_length in runs:
+                ranges.append(
+                    (
+                        self.offset + (element_offset + run_offset) * itemsize,
+                        run_length * itemsize,
+                    )
+                )
+
+        data = bytearray()
+        for (_, range_length), chunk in zip(
+            ranges, self.file_handle.read_ranges(ranges)
+        ):
+            if len(chunk) != range_length:
+                raise EOFError(
+                    "{} ended before the requested array data".format(
+                        self.file_handle.name
+                    )
+                )
+            data += chunk
+
+        if last_axis == -1:
+            return np.frombuffer(data, dtype=self.dtype).reshape(shape)[squeeze]
+
+        read_shape = [len(selection) for selection in selections[: last_axis + 1]]
+        read_shape.extend(shape[last_axis:][1:])
+        return np.frombuffer(data, dtype=self.dtype).reshape(read_shape)[squeeze]
@@ -0,0 +1,230 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import stat
+
+OPERATION_MKDIR = "mkdir"
+OPERATION_RENAME = "rename"
+OPERATION_REMOVE = "remove"
+OPERATION_SETSTAT = "setstat"
+OPERATIONS = (OPERATION_MKDIR, OPERATION_RENAME, OPERATION_REMOVE, OPERATION_SETSTAT)
+
+
+def _failed(sftp_channel, action, path):
+    return OSError(
+        "Failed to {} path: {} - error_code: {}".format(
+            action, path, sftp_channel.last_error()
+        )
+    )
+
+
+def _mkdir(sftp_channel, path, mode):
+    try:
+        sftp_channel.mkdir(path, mode)
+    except Exception as err:
+        error = _failed(sftp_channel, "create directory", path)
+        # The server might report an existing directory as a generic failure
+        try:
+            attributes = sftp_channel.stat(path)
+        except Exception:
+            raise error from err
+        if not stat.S_ISDIR(attributes.permissions):
+            raise error from err
+    return True
+
+
+def _rename(sftp_channel, old_path, new_path):
+    try:
+        sftp_channel.rename(old_path, new_path)
+    except Exception as err:
+        raise _failed(sftp_channel, "rename", old_path) from err
+    return True
+
+
+def _remove(sftp_channel, path):
+    try:
+        sftp_channel.unlink(path)
+    except Exception as err:
+        raise _failed(sftp_channel, "remove", path) from err
+    return True
+
+
+def _setstat(sftp_channel, path, attributes):
+    try:
+        sftp_channel.setstat(path, attributes)
+    except Exception as err:
+        raise _failed(sftp_channel, "setstat", path) from err
+    return True
+
+
+_functions = {
+    OPERATION_MKDIR: _mkdir,
+    OPERATION_RENAME: _rename,
+    OPERATION_REMOVE: _remove,
+    OPERATION_SETSTAT: _setstat,
+}
+
+
+class BatchOperation:
+    __slots__ = ("name", "args", "result", "error", "done")
+
+    def __init__(self, name, *args):
+        """An operation that has been recorded in a Batch
+        :param name: one of OPERATIONS
+        :param args: the arguments of the operation, where the paths come first
+        """
+        self.name = name
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = False
+
+    def __repr__(self):
+        return "{}({!r}, {})".format(
+            type(self).__name__, self.name, ", ".join(map(repr, self.args))
+        )
+
+    @property
+    def paths(self):
+        """
+        :return: the remote paths that the operation changes
+        """
+        if self.name == OPERATION_RENAME:
+            return self.args
+        return self.args[:1]
+
+    @property
+    def ok(self):
+        return self.done and self.error is None
+
+    def run(self, sftp_channel):
+        return _functions[self.name](sftp_channel, *self.args)
+
+
+def operation_levels(operations, key=os.path.normpath):
+    """Order the operations such that an operation runs after the earlier
+    operations that change the same path, a parent or a child of it,
+    e.g. a mkdir of a directory before the renames into it.
+    :param operations: list of BatchOperation in the order they were recorded
+    :param key: function that returns the normalized absolute form of a path
+    :return: list of lists of operations, where the operations of a list are
+    independent of each other and depend only on those of the earlier lists
+    """
+    # The last level of an operation on each exact path
+    path_levels = {}
+    # The last level of an operation on each path or below it
+    subtree_levels = {}
+    levels = []
+    for operation in operations:
+        keys = [key(path) for path in operation.paths]
+        level = 0
+        for path_key in keys:
+            level = max(level, subtree_levels.get(path_key, -1) + 1)
+            parent = path_key
+            while True:
+                level = max(level, path_levels.get(parent, -1) + 1)
+                next_parent = os.path.dirname(parent)
+                if next_parent == parent:
+                    break
+                parent = next_parent
+        for path_key in keys:
+            path_levels[path_key] = level
+            parent = path_key
+            while True:
+                subtree_levels[parent] = max(subtree_levels.get(parent, -1), level)
+                next_parent = os.path.dirname(parent)
+                if next_parent == parent:
+                    break
+                parent = next_parent
+        if level == len(levels):
+            levels.append([])
+        levels[level].append(operation)
+    return levels
+
+
+class Batch:
+    def __init__(self, store, max_concurrency):
+        """Records metadata operations that are sent together when the batch
+        is flushed, either explicitly or when the with block is left.
+        :param store: the SFTPStore that the operations are run through
+        :param max_concurrency: the amount of connections that the operations
+        are spread across
+        """
+        self.store = store
+        self.max_concurrency = max_concurrency
+        # The operations that have been recorded since the last flush
+        self.pending = []
+        # Every operation that has been flushed
+        self.operations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # The operations are discarded when the block fails
+        if exc_type is None:
+            self.flush()
+        else:
+            self.pending = []
+
+    def _record(self, name, *args):
+        operation = BatchOperation(name, *args)
+        self.pending.append(operation)
+        return operation
+
+    def mkdir(self, path, mode=0o755):
+        """Record that the directory is created, where an existing
+        directory counts as created
+        :return: BatchOperation
+        """
+        return self._record(OPERATION_MKDIR, path, mode)
+
+    def rename(self, old_path, new_path):
+        """
+        :return: BatchOperation
+        """
+        return self._record(OPERATION_RENAME, old_path, new_path)
+
+    def remove(self, path):
+        """
+        :return: BatchOperation
+        """
+        return self._record(OPERATION_REMOVE, path)
+
+    def setstat(self, path, attributes):
+        """
+        :return: BatchOperation
+        """
+        return self._record(OPERATION_SETSTAT, path, attributes)
+
+    def flush(self):
+        """Run the pending operations, where an operation that fails does
+        not stop the others
+        :return: list of the BatchOperation that have been run
+        """
+        operations, self.pending = self.pending, []
+        if operations:
+            self.store._run_batch(operations, self.max_concurrency)
+            self.operations.extend(operations)
+        return operations
+
+    @property
+    def errors(self):
+        """
+        :return: list of the flushed BatchOperation that failed
+        """
+        return [operation for operation in self.operations if not operation.ok]
@@ -0,0 +1,229 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 256 KB blocks
+DEFAULT_BLOCK_SIZE = 1024 * 256
+# 64 MB
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 64
+# Seconds that metadata is trusted after it has been fetched
+DEFAULT_METADATA_TTL = 30
+# Seconds that a path is remembered as missing
+DEFAULT_NEGATIVE_TTL = 5
+DEFAULT_MAX_METADATA_ENTRIES = 1024 * 100
+
+METADATA_STAT = "stat"
+METADATA_REALPATH = "realpath"
+METADATA_LISTDIR = "listdir"
+METADATA_KINDS = [METADATA_STAT, METADATA_REALPATH, METADATA_LISTDIR]
+
+
+class BlockCache:
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE, max_bytes=DEFAULT_CACHE_SIZE):
+        """
+        :param block_size: the size of the aligned blocks that are fetched
+        from the remote end and kept in the cache
+        :param max_bytes: the total amount of bytes that the cache can hold
+        before the least recently used blocks are evicted
+        """
+        if block_size <= 0:
+            raise ValueError("block_size must be positive, is: {}".format(block_size))
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    @property
+    def size(self):
+        """
+        :return: the amount of bytes currently held by the cache
+        """
+        return self._size
+
+    @staticmethod
+    def make_key(path, block_index, mtime, filesize):
+        """
+        :param path: the remote path that the block belongs to
+        :param block_index: the offset of the block divided by the block size
+        :param mtime: the remote modification time of the file
+        :param filesize: the remote size of the file
+        """
+        return (path, mtime, filesize, block_index)
+
+    def get(self, key):
+        """
+        :param key: a key as returned by make_key
+        :return: the cached block, or None if it is not in the cache
+        """
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        """
+        :param key: a key as returned by make_key
+        :param block: the bytes of the block
+        """
+        if len(block) > self.max_bytes:
+            return False
+        with self._lock:
+            existing = self._blocks.pop(key, None)
+            if existing is not None:
+                self._size -= len(existing)
+            self._blocks[key] = block
+            self._size += len(block)
+            while self._size > self.max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+        return True
+
+    def invalidate(self, path):
+        """Remove every cached block of path
+        :param path: the remote path whose blocks should be removed
+        """
+        with self._lock:
+            for key in [key for key in self._blocks if key[0] == path]:
+                self._size -= len(self._blocks.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._size = 0
+
+    def stats(self):
+        """
+        :return: dict with the hit/miss counters and the current usage
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "blocks": len(self._blocks),
+                "size": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class MetadataCache:
+    def __init__(
+        self,
+        ttl=DEFAULT_METADATA_TTL,
+        negative_ttl=DEFAULT_NEGATIVE_TTL,
+        max_entries=DEFAULT_MAX_METADATA_ENTRIES,
+    ):
+        """
+        :param ttl: seconds that a cached entry is valid
+        :param negative_ttl: seconds that a path is remembered as missing
+        :param max_entries: the maximum amount of entries, the oldest
+        entries are evicted first
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kind, path):
+        """
+        :param kind: one of METADATA_KINDS
+        :param path: the normalized remote path
+        :return: tuple of (found, value), where a found value of None
+        means that the path is known to be missing
+        """
+        key = (kind, path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, kind, path, value, ttl=None):
+        """
+        :param kind: one of METADATA_KINDS
+        :param path: the normalized remote path
+        :param value: the metadata, None caches the path as missing
+        :param ttl: overrides the default ttl for this entry
+        """
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        if ttl <= 0:
+            return
+        key = (kind, path)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path, recursive=False):
+        """Remove the cached metadata of path and the listing of its parent
+        :param path: the normalized remote path that has changed
+        :param recursive: also remove every entry below path
+        """
+        parent = os.path.dirname(path.rstrip(os.sep)) or os.sep
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            for kind in METADATA_KINDS:
+                self._entries.pop((kind, path), None)
+            self._entries.pop((METADATA_LISTDIR, parent), None)
+            if recursive:
+                for key in [key for key in self._entries if key[1].startswith(prefix)]:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: dict with the hit/miss counters and the hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
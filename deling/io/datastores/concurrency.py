@@ -0,0 +1,218 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import errno
+import threading
+import time
+from ssh2.error_codes import LIBSSH2_ERROR_EAGAIN
+from ssh2.exceptions import (
+    ChannelWindowFullError,
+    SocketDisconnectError,
+    SocketRecvError,
+    SocketSendError,
+    SocketTimeout,
+    Timeout,
+)
+
+DEFAULT_INITIAL_LIMIT = 4
+# The limit is raised by ADDITIVE_INCREASE when a round of requests had a higher
+# throughput than the one before, and multiplied by MULTIPLICATIVE_DECREASE
+# when the server or the link shows signs of congestion
+ADDITIVE_INCREASE = 1
+MULTIPLICATIVE_DECREASE = 0.5
+# A round is congested when the latency of its requests exceeds, on average,
+# the lowest that has recently been observed for requests of the same kind
+# by this factor,
+LATENCY_TOLERANCE = 2.0
+# and by at least as many seconds, such that the jitter of fast requests is ignored
+LATENCY_SLACK = 0.01
+# The amount of rounds after which the lowest latency is forgotten, such that
+# a single fast request does not remain the reference
+LATENCY_WINDOW = 16
+# The relative improvement that counts as a rise in throughput
+THROUGHPUT_GAIN = 0.05
+
+_congestion_errors = (
+    ConnectionError,
+    TimeoutError,
+    ChannelWindowFullError,
+    SocketDisconnectError,
+    SocketRecvError,
+    SocketSendError,
+    SocketTimeout,
+    Timeout,
+)
+
+
+def is_congestion(error):
+    """
+    :param error: the exception that a request failed with
+    :return: whether the error is a sign that too many requests are in flight,
+    as opposed to a failure of the request itself such as a missing path
+    """
+    while error is not None:
+        if isinstance(error, _congestion_errors):
+            return True
+        if isinstance(error, OSError) and error.errno == errno.EAGAIN:
+            return True
+        if "error_code: {}".format(LIBSSH2_ERROR_EAGAIN) in str(error):
+            return True
+        error = error.__cause__
+    return False
+
+
+class ConcurrencyController:
+    def __init__(self, maximum, minimum=1, initial=DEFAULT_INITIAL_LIMIT):
+        """Limits the amount of requests that are in flight at the same time,
+        where the limit is adjusted by additive increase and multiplicative
+        decrease (AIMD). Each round of as many requests as the limit is measured,
+        and the limit is raised while the throughput of the rounds rises and
+        lowered when a request fails from congestion, e.g. EAGAIN or a timeout,
+        or the latency rises well beyond the lowest that has recently been observed
+        for requests of the same kind.
+        :param maximum: the highest limit, e.g. the size of the connection pool
+        :param minimum: the lowest limit
+        :param initial: the limit that is started with
+        """
+        if minimum <= 0 or maximum < minimum:
+            raise ValueError(
+                "the limits must satisfy 0 < minimum <= maximum: {} {}".format(
+                    minimum, maximum
+                )
+            )
+        self.minimum = minimum
+        self.maximum = maximum
+        self._condition = threading.Condition()
+        self._limit = min(max(initial, minimum), maximum)
+        self._in_flight = 0
+        # The lowest latency of each kind of request in the current
+        # and the previous window of rounds
+        self._lowest_latencies = {}
+        self._rounds = 0
+        self._throughput = None
+        # The requests that were started before the last decrease do not
+        # lower the limit again
+        self._decreased = time.monotonic()
+        self._idle_since = None
+        self._reset_round()
+
+    def _reset_round(self):
+        self._round_started = time.monotonic()
+        self._round_count = 0
+        self._round_amount = 0
+        # The requests whose latency is compared with the lowest of their kind
+        self._round_compared = 0
+        self._round_ratio = 0.0
+        self._round_excess = 0.0
+
+    @property
+    def limit(self):
+        """
+        :return: the amount of requests that are allowed to be in flight
+        """
+        return self._limit
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def acquire(self):
+        """Wait until another request is allowed to be in flight
+        :return: the start time of the request, which is passed to release
+        """
+        with self._condition:
+            while self._in_flight >= self._limit:
+                self._condition.wait()
+            if self._idle_since is not None:
+                # The time without requests does not count against the throughput
+                self._round_started += time.monotonic() - self._idle_since
+                self._idle_since = None
+            self._in_flight += 1
+        return time.monotonic()
+
+    def release(self, started, amount=1, error=None, kind=None):
+        """Record that a request has finished
+        :param started: the value that acquire returned
+        :param amount: the amount that was transferred, e.g. bytes or requests
+        :param error: the exception that the request failed with, if any
+        :param kind: the kind of request, e.g. 'stat', whose latency is only compared
+        with that of the same kind. The latency of requests without a kind, such as
+        directory scans whose cost depends on the size of the directory, does not
+        lower the limit, which they only do by failing from congestion
+        """
+        latency = time.monotonic() - started
+        with self._condition:
+            self._in_flight -= 1
+            if error is not None and is_congestion(error):
+                if started >= self._decreased:
+                    self._decrease()
+            elif error is None:
+                self._measure(latency, amount, kind)
+            if not self._in_flight:
+                self._idle_since = time.monotonic()
+            self._condition.notify_all()
+
+    def _decrease(self):
+        self._limit = max(self.minimum, int(self._limit * MULTIPLICATIVE_DECREASE))
+        self._decreased = time.monotonic()
+        # The throughput at the former limit is no longer the reference
+        self._throughput = None
+        self._next_round()
+
+    def _lowest_latency(self, kind, latency):
+        """
+        :return: the lowest latency of kind in the current and previous window,
+        where latency is included in the current window
+        """
+        windows = self._lowest_latencies.setdefault(kind, [None, None])
+        if windows[0] is None or latency < windows[0]:
+            windows[0] = latency
+        return min(lowest for lowest in windows if lowest is not None)
+
+    def _next_round(self):
+        self._rounds += 1
+        if self._rounds % LATENCY_WINDOW == 0:
+            for windows in self._lowest_latencies.values():
+                windows[:] = [None, windows[0]]
+        self._reset_round()
+
+    def _measure(self, latency, amount, kind):
+        self._round_count += 1
+        self._round_amount += amount
+        if kind is not None:
+            lowest = self._lowest_latency(kind, latency)
+            self._round_compared += 1
+            self._round_ratio += latency / lowest if lowest > 0 else 1.0
+            self._round_excess += latency - lowest
+        if self._round_count < self._limit:
+            return
+
+        elapsed = max(time.monotonic() - self._round_started, 1e-9)
+        throughput = self._round_amount / elapsed
+        if (
+            self._round_compared
+            and self._round_ratio / self._round_compared > LATENCY_TOLERANCE
+            and self._round_excess / self._round_compared > LATENCY_SLACK
+            and self._limit > self.minimum
+        ):
+            self._decrease()
+            return
+        if self._throughput is None or throughput > self._throughput * (
+            1 + THROUGHPUT_GAIN
+        ):
+            self._limit = min(self.maximum, self._limit + ADDITIVE_INCREASE)
+        self._throughput = throughput
+        self._next_round()
@@ -14,8 +14,18 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import datetime
+import fnmatch
+import functools
+import inspect
 import os
+import re
+import shlex
+import stat
+import threading
+import time
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from ssh2.exceptions import SFTPProtocolError
 from ssh2.sftp import (
     LIBSSH2_FXF_READ,
@@ -27,8 +37,166 @@ from ssh2.sftp import (
     LIBSSH2_SFTP_S_IROTH,
     LIBSSH2_FXF_APPEND,
 )
-from deling.clients.ssh import SSHClient, CHANNEL_TYPE_SFTP
+from ssh2.utils import handle_error_codes
+from deling.clients.ssh import (
+    SSHClient,
+    SSHClientResultCode,
+    CHANNEL_TYPE_SFTP,
+    read_channel_exit_status,
+    read_channel_response_stderr,
+    read_channel_stdout_chunks,
+)
+from deling.io.datastores.archive import (
+    ChunkStream,
+    TAR_COMPRESSION_OPTIONS,
+    COMPRESSION_ZSTD,
+    extract_tar_stream,
+    import_zstandard,
+    tar_command,
+)
+from deling.io.datastores.array import RemoteArray, read_npy_header
+from deling.io.datastores.batch import (
+    Batch,
+    OPERATION_MKDIR,
+    OPERATION_RENAME,
+    operation_levels,
+)
+from deling.io.datastores.cache import (
+    BlockCache,
+    METADATA_STAT,
+    METADATA_REALPATH,
+    METADATA_LISTDIR,
+)
+from deling.io.datastores.concurrency import ConcurrencyController
+from deling.io.datastores.entry import (
+    SFTPDirEntry,
+    FIND_PRINTF_FORMAT,
+    FIND_FILE_TYPES,
+    parse_find_record,
+)
 from deling.io.datastores.file import SFTPFileHandle
+from deling.io.datastores.pool import (
+    SFTPConnectionPool,
+    ThreadCheckout,
+    DEFAULT_POOL_SIZE,
+)
+from deling.io.datastores.throttle import (
+    Throttle,
+    PROCESS_THROTTLE,
+    TRAFFIC_BULK,
+    TRAFFIC_CLASSES,
+    TRAFFIC_INTERACTIVE,
+    host_throttle,
+    throttle_transfer,
+)
+from deling.io.datastores.tree import (
+    DirectoryState,
+    DirectoryTree,
+    DiskUsage,
+    ServerClock,
+    WatchEvent,
+    EVENT_CREATED,
+    EVENT_DELETED,
+    diff_states,
+)
+from deling.io.scheduler import TransferScheduler, PRIORITY_NORMAL, DEFAULT_TENANT
+from deling.utils.io import new_hash
+
+# 1 MB
+DEFAULT_TRANSFER_CHUNK_SIZE = 1024 * 1024
+DEFAULT_CHECKSUM_ALGORITHM = "sha256"
+# The commands used to calculate checksums on the remote end
+REMOTE_CHECKSUM_COMMANDS = {
+    "md5": "md5sum",
+    "sha1": "sha1sum",
+    "sha224": "sha224sum",
+    "sha256": "sha256sum",
+    "sha384": "sha384sum",
+    "sha512": "sha512sum",
+    "blake3": "b3sum",
+}
+# The amount of directories that are read at the same time by walk
+DEFAULT_WALK_CONCURRENCY = 4
+# The amount of seconds between the polls of watch
+DEFAULT_WATCH_INTERVAL = 5
+# The amount of paths that are stat'ed at the same time by stat_many
+DEFAULT_BULK_CONCURRENCY = DEFAULT_POOL_SIZE
+# How download_tree transfers a directory, either as a tar archive that is
+# created on the remote end or as separate files over SFTP
+TREE_MODE_TAR = "tar"
+TREE_MODE_SFTP = "sftp"
+TREE_MODES = (TREE_MODE_TAR, TREE_MODE_SFTP)
+# The amount of directories that mkdir remembers to exist
+DEFAULT_MAX_KNOWN_DIRECTORIES = 1024 * 100
+# SFTP status codes, which ssh2-python does not expose
+LIBSSH2_FX_NO_SUCH_FILE = 2
+LIBSSH2_FX_NO_SUCH_PATH = 10
+GLOB_MAGIC = re.compile("[*?[]")
+
+
+def check_remote_checksum(algorithm):
+    """Reject the algorithms that cannot be calculated on the remote end,
+    such that they are not mistaken for a checksum mismatch
+    :param algorithm: the hash algorithm, one of REMOTE_CHECKSUM_COMMANDS
+    """
+    if algorithm not in REMOTE_CHECKSUM_COMMANDS:
+        raise ValueError(
+            "the algorithm must be one of {} to be calculated remotely, is: {}".format(
+                list(REMOTE_CHECKSUM_COMMANDS), algorithm
+            )
+        )
+
+
+def match_glob_parts(parts, names):
+    """
+    :param parts: the components of a glob pattern, where '**' matches
+    any amount of path components
+    :param names: the components of the path that is matched
+    :return: Boolean, where like glob.glob a name that starts with '.' is only
+    matched by a component that starts with '.' as well
+    """
+    if not parts:
+        return not names
+    if parts[0] == "**":
+        return any(
+            match_glob_parts(parts[1:], names[index:])
+            for index in range(len(names) + 1)
+            if not any(name.startswith(".") for name in names[:index])
+        )
+    return (
+        bool(names)
+        and (not names[0].startswith(".") or parts[0].startswith("."))
+        and fnmatch.fnmatchcase(names[0], parts[0])
+        and match_glob_parts(parts[1:], names[1:])
+    )
+
+
+def checkout_connection(method):
+    """Run the SFTPStore method on a connection of the pool of the store
+    when it is called by another thread than the one that created the store,
+    where generators keep the connection until they are exhausted or closed.
+    """
+    if inspect.isgeneratorfunction(method):
+
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            release = self._hold_connection()
+            try:
+                yield from method(self, *args, **kwargs)
+            finally:
+                release()
+
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        release = self._hold_connection()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            release()
+
+    return wrapper
 
 
 class DataStore:
@@ -78,7 +246,45 @@ class DataStore:
 
 
 class SFTPStore(DataStore):
-    def __init__(self, host, port, authenticator, authenticator_prepare_kwargs=None):
+    def __init__(
+        self,
+        host,
+        port,
+        authenticator,
+        authenticator_prepare_kwargs=None,
+        block_cache=None,
+        metadata_cache=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        allow_exec=True,
+        rate_limits=None,
+        scheduler=None,
+    ):
+        """
+        :param block_cache: optional BlockCache that is shared by the
+        file handles opened in read mode through this store
+        :param metadata_cache: optional MetadataCache that stat, exists,
+        realpath and listdir results are kept in
+        :param pool_size: the maximum amount of additional connections
+        that are opened for concurrent operations such as walk, and by the
+        other threads that use the store, which must be at least 1
+        :param allow_exec: whether the server permits commands to be executed,
+        which is used to run operations such as find on the remote end
+        :param rate_limits: dict of the bytes per second that each traffic class,
+        'bulk' and 'interactive', of the store is limited to, which can be
+        changed through self.throttle, host_throttle(host) and PROCESS_THROTTLE
+        :param scheduler: optional TransferScheduler that submit_upload,
+        submit_download and submit_copy run on, which can be shared between stores.
+        By default the store starts its own with a worker per pooled connection
+
+        The store can be shared between threads. The thread that creates the store
+        uses its connection, while the other threads check out a connection of
+        the pool for the duration of each call, or until the file handles they
+        open are closed. A file handle should only be used by one thread at a time.
+        """
+        if pool_size < 1:
+            # The other threads and the scheduler would wait for a connection forever
+            raise ValueError("pool_size must be at least 1, is: {}".format(pool_size))
+
         if not authenticator_prepare_kwargs:
             authenticator_prepare_kwargs = {}
 
@@ -87,6 +293,34 @@ class SFTPStore(DataStore):
         ):
             raise ValueError("Authenticator could not be prepared")
 
+        self.host = host
+        self.port = port
+        self.authenticator = authenticator
+        # A forked process inherits the sockets of the connections
+        self._pid = os.getpid()
+        self.block_cache = block_cache
+        self.metadata_cache = metadata_cache
+        self.allow_exec = allow_exec
+        self.throttle = Throttle(rate_limits)
+        self._scheduler = scheduler
+        # Whether the scheduler is started by and shut down with the store
+        self._owns_scheduler = False
+        self._scheduler_lock = threading.Lock()
+        # The directory that relative paths are resolved against
+        self._home = None
+        # The normalized paths of the directories that mkdir has created or found
+        self._known_directories = set()
+        self._known_directories_lock = threading.Lock()
+        # The directory states that du has read
+        self.tree_cache = DirectoryTree()
+        # Tells whether a directory was read after the second it was modified in
+        self._server_clock = ServerClock()
+        # Additional connections are only opened once they are acquired
+        self.pool = SFTPConnectionPool(host, port, authenticator, max_size=pool_size)
+        self._checkout = ThreadCheckout(self.pool)
+        # Adapts the amount of requests that the pooled operations have in flight
+        self.concurrency = ConcurrencyController(maximum=max(pool_size, 1))
+        self._owner_thread = threading.get_ident()
         self.sftp_channel = None
         self.ssh_client = SSHClient(host, authenticator, port=port)
         connected = self.ssh_client.connect()
@@ -108,22 +342,192 @@ class SFTPStore(DataStore):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.disconnect()
 
+    @property
+    def sftp_channel(self):
+        """
+        :return: the SFTP channel of the connection that the current thread uses
+        """
+        connection = self._checkout.current()
+        if connection is not None:
+            return connection.sftp_channel
+        return self._sftp_channel
+
+    @sftp_channel.setter
+    def sftp_channel(self, sftp_channel):
+        self._sftp_channel = sftp_channel
+
+    @property
+    def ssh_client(self):
+        """
+        :return: the SSHClient of the connection that the current thread uses
+        """
+        connection = self._checkout.current()
+        if connection is not None:
+            return connection.ssh_client
+        return self._ssh_client
+
+    @ssh_client.setter
+    def ssh_client(self, ssh_client):
+        self._ssh_client = ssh_client
+
+    def _hold_connection(self):
+        """Check out a connection of the pool for the current thread,
+        unless it is the thread that created the store
+        :return: function that releases the connection
+        """
+        if threading.get_ident() == self._owner_thread:
+            return lambda: None
+        return self._checkout.acquire()
+
+    @property
+    def scheduler(self):
+        """
+        :return: the TransferScheduler that the submitted transfers run on
+        """
+        with self._scheduler_lock:
+            if self._scheduler is None:
+                self._scheduler = TransferScheduler(
+                    max_workers=max(self.pool.max_size, 1)
+                )
+                self._owns_scheduler = True
+            return self._scheduler
+
+    def submit_upload(
+        self,
+        local_path,
+        remote_path,
+        priority=PRIORITY_NORMAL,
+        tenant=DEFAULT_TENANT,
+        **kwargs,
+    ):
+        """Schedule an upload on a connection of the pool
+        :param priority: transfers with a lower value are started first
+        :param tenant: the name of the tenant that the transfer is accounted to
+        :param kwargs: the keyword arguments of upload
+        :return: concurrent.futures.Future of the result of upload, which can be
+        waited for with as_completed and cancelled until it has been started
+        """
+        return self.scheduler.submit_upload(
+            self, local_path, remote_path, priority=priority, tenant=tenant, **kwargs
+        )
+
+    def submit_download(
+        self,
+        remote_path,
+        local_path,
+        priority=PRIORITY_NORMAL,
+        tenant=DEFAULT_TENANT,
+        **kwargs,
+    ):
+        """Schedule a download on a connection of the pool
+        :return: concurrent.futures.Future of the result of download
+        """
+        return self.scheduler.submit_download(
+            self, remote_path, local_path, priority=priority, tenant=tenant, **kwargs
+        )
+
+    def submit_copy(
+        self,
+        remote_src,
+        remote_dest,
+        priority=PRIORITY_NORMAL,
+        tenant=DEFAULT_TENANT,
+        **kwargs,
+    ):
+        """Schedule a remote copy on a connection of the pool
+        :return: concurrent.futures.Future of the result of copy
+        """
+        return self.scheduler.submit_copy(
+            self, remote_src, remote_dest, priority=priority, tenant=tenant, **kwargs
+        )
+
+    def _holds_pooled_connection(self):
+        return self._checkout.current() is not None
+
     def is_connected(self):
-        return self.ssh_client.is_socket_connected()
+        return self._ssh_client.is_socket_connected()
 
     def disconnect(self):
-        if self.sftp_channel:
-            self.sftp_channel.session.disconnect()
-        if self.ssh_client:
-            self.ssh_client.disconnect()
+        if getattr(self, "_pid", None) != os.getpid():
+            # The connections belong to the process that created the store,
+            # where none are opened when the arguments are rejected
+            return
+        if self._owns_scheduler:
+            # The transfers that are running finish before the pool is closed
+            self._scheduler.shutdown(wait=True, cancel_futures=True)
+            self._scheduler = None
+            self._owns_scheduler = False
+        self.pool.close()
+        if self._sftp_channel:
+            self._sftp_channel.session.disconnect()
+        if self._ssh_client:
+            self._ssh_client.disconnect()
 
-    def open(self, path, flag="r"):
+    def open(self, path, flag="r", block_cache=None, traffic=TRAFFIC_INTERACTIVE):
         """
         :param path: path to file on the sftp end
         :param flag: open mode, either 'r'=read, 'w'=write, 'a'=append
         'rb'=read binary, 'wb'=write binary or 'ab'= append binary
+        :param block_cache: BlockCache to use for the handle,
+        defaults to the cache of the store
+        :param traffic: the traffic class that the rate of the handle is limited by
         :return: SFTPFileHandle
         """
+        if traffic not in TRAFFIC_CLASSES:
+            raise ValueError(
+                "traffic must be one of {}, is: {}".format(TRAFFIC_CLASSES, traffic)
+            )
+        if block_cache is None:
+            block_cache = self.block_cache
+        throttle = self._throttle_function(traffic)
+        # The connection is held by the handle until it is closed
+        release = self._hold_connection()
+        try:
+            fh = self._open(path, flag)
+        except BaseException:
+            release()
+            raise
+        if flag == "r" or flag == "rb":
+            return SFTPFileHandle(
+                fh,
+                path,
+                flag,
+                block_cache=block_cache,
+                on_close=release,
+                throttle=throttle,
+            )
+        self._invalidate(path)
+
+        def on_close():
+            # The size and modification time changes while the handle is written to
+            self._invalidate(path)
+            release()
+
+        return SFTPFileHandle(
+            fh,
+            path,
+            flag,
+            block_cache=block_cache,
+            on_close=on_close,
+            throttle=throttle,
+        )
+
+    def _throttle_function(self, traffic):
+        """
+        :return: function that limits the transfers of traffic to the rate of
+        the store, the host and the process
+        """
+        throttles = [self.throttle, host_throttle(self.host), PROCESS_THROTTLE]
+
+        def throttle(amount):
+            throttle_transfer(amount, traffic, throttles)
+
+        return throttle
+
+    def _open(self, path, flag):
+        """
+        :return: the ssh2.sftp_handle.SFTPHandle of path opened with flag
+        """
         if flag == "r" or flag == "rb":
             r_flags = LIBSSH2_FXF_READ
             mode = LIBSSH2_SFTP_S_IWUSR
@@ -140,8 +544,147 @@ class SFTPStore(DataStore):
                 | LIBSSH2_SFTP_S_IRGRP
                 | LIBSSH2_SFTP_S_IROTH
             )
-            fh = self.sftp_channel.open(path, w_flags, mode)
-        return SFTPFileHandle(fh, path, flag)
+            try:
+                fh = self.sftp_channel.open(path, w_flags, mode)
+            except Exception:
+                self._forget_missing_parent(path)
+                raise
+        return fh
+
+    def open_array(self, path, dtype, shape, offset=0, order="C", block_cache=None):
+        """
+        :param path: path to the file on the sftp end that holds the raw array data
+        :param dtype: the numpy dtype of the array elements
+        :param shape: the shape of the array
+        :param offset: the byte offset in the file where the array data starts
+        :param order: the memory layout of the array, either 'C' or 'F'
+        :param block_cache: BlockCache that the slices are read through,
+        defaults to the cache of the store or a new cache for the array
+        :return: RemoteArray, which only reads the data required by a slice
+        """
+        if block_cache is None:
+            # An empty BlockCache is falsy, since it has a length
+            if self.block_cache is not None:
+                block_cache = self.block_cache
+            else:
+                block_cache = BlockCache()
+        fh = self.open(path, "rb", block_cache=block_cache)
+        try:
+            return RemoteArray(fh, dtype, shape, offset=offset, order=order)
+        except Exception:
+            fh.close()
+            raise
+
+    def open_npy(self, path, block_cache=None):
+        """
+        :param path: path to a .npy file on the sftp end
+        :param block_cache: BlockCache that the slices are read through,
+        defaults to the cache of the store or a new cache for the array
+        :return: RemoteArray, described by the header of the .npy file
+        """
+        if block_cache is None:
+            # An empty BlockCache is falsy, since it has a length
+            if self.block_cache is not None:
+                block_cache = self.block_cache
+            else:
+                block_cache = BlockCache()
+        fh = self.open(path, "rb", block_cache=block_cache)
+        try:
+            descr, fortran_order, shape, offset = read_npy_header(fh)
+            return RemoteArray(
+                fh,
+                descr,
+                shape,
+                offset=offset,
+                order="F" if fortran_order else "C",
+            )
+        except Exception:
+            fh.close()
+            raise
+
+    def _get_home(self):
+        if self._home is None:
+            self._home = self.sftp_channel.realpath(".")
+        return self._home
+
+    def _cache_path(self, path):
+        """
+        :param path: a relative or absolute remote path
+        :return: the normalized absolute path, used as the metadata cache key
+        """
+        if not path:
+            path = "."
+        if path[0] != os.sep:
+            path = os.path.join(self._get_home(), path)
+        return os.path.normpath(path)
+
+    def _cached(self, kind, path, fetch):
+        """Get the metadata of path from the metadata cache if present,
+        otherwise fetch it from the remote end and cache it.
+        :param kind: one of METADATA_KINDS
+        :param fetch: function that returns the metadata, or None if missing,
+        where the exceptions that it raises are not cached
+        """
+        if self.metadata_cache is None:
+            return fetch()
+        key = self._cache_path(path)
+        found, value = self.metadata_cache.get(kind, key)
+        if found:
+            return value
+        value = fetch()
+        self.metadata_cache.put(kind, key, value)
+        return value
+
+    def _invalidate(self, path, recursive=False):
+        """Discard the cached content and metadata of a path that has changed
+        :param path: the remote path that has changed
+        :param recursive: also discard the metadata below path
+        """
+        if self.block_cache is not None:
+            self.block_cache.invalidate(path)
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(self._cache_path(path), recursive=recursive)
+        if self._known_directories:
+            self._forget_directory(self._cache_path(path), recursive=recursive)
+        if len(self.tree_cache):
+            # The modification time only has a resolution of seconds
+            key = self._cache_path(path)
+            self.tree_cache.discard(key, recursive=recursive)
+            self.tree_cache.discard(os.path.dirname(key))
+
+    def _forget_directory(self, key, recursive=False):
+        with self._known_directories_lock:
+            self._known_directories.discard(key)
+            if recursive:
+                prefix = key.rstrip(os.sep) + os.sep
+                self._known_directories.difference_update(
+                    [
+                        known
+                        for known in self._known_directories
+                        if known.startswith(prefix)
+                    ]
+                )
+
+    def _forget_missing_parent(self, path):
+        """Forget the parent directory of path, and the directories below it,
+        when the server reports it as missing, e.g. since another client
+        has removed it after mkdir has created or found it
+        :param path: the remote path that could not be created
+        """
+        if not self._known_directories:
+            return
+        if self.sftp_channel.last_error() in (
+            LIBSSH2_FX_NO_SUCH_FILE,
+            LIBSSH2_FX_NO_SUCH_PATH,
+        ):
+            parent = os.path.dirname(os.path.normpath(path))
+            self._forget_directory(self._cache_path(parent), recursive=True)
+
+    def _remember_directory(self, key):
+        with self._known_directories_lock:
+            if len(self._known_directories) >= DEFAULT_MAX_KNOWN_DIRECTORIES:
+                self._known_directories.clear()
+            self._known_directories.add(key)
 
     def _opendir(self, path):
         """
@@ -151,7 +694,7 @@ class SFTPStore(DataStore):
         return self.sftp_channel.opendir(path)
 
     def close(self):
-        self.sftp_channel.close()
+        self._sftp_channel.close()
 
     def read(self, path, datatype=str):
         """
@@ -217,6 +760,7 @@ class SFTPStore(DataStore):
             fh.write(data)
             return True
 
+    @checkout_connection
     def exists(self, path):
         """
         :param path: the path we are checking whether it exists
@@ -224,13 +768,12 @@ class SFTPStore(DataStore):
         """
         # There is no direct way to check if it exists
         # See if we can stat the designated path instead
-        try:
-            self.sftp_channel.stat(path)
-            return True
-        except SFTPProtocolError:
-            return False
-        return False
+        return (
+            self._cached(METADATA_STAT, path, lambda: self._stat_or_missing(path))
+            is not None
+        )
 
+    @checkout_connection
     def listdir(self, path=None):
         """
         :param path: path to the directory which content should be listed
@@ -239,15 +782,914 @@ class SFTPStore(DataStore):
         if not path:
             # If no path is provided, list the current directory
             path = "."
-        else:
+        return list(self._cached(METADATA_LISTDIR, path, lambda: self._listdir(path)))
+
+    def _listdir(self, path):
+        if path != "." and path[0] != os.sep:
             # If the path is not the current directory and does not start with a slash
             # Discover the absolute path since self._opendir does not support relative paths
-            if path[0] != os.sep:
-                path = self.realpath(path)
+            path = self.realpath(path)
 
         with self._opendir(path) as fh:
             return [name.decode("utf-8") for size, name, attrs in fh.readdir()]
 
+    @checkout_connection
+    def scandir(self, path=None):
+        """
+        :param path: path to the directory which content should be listed
+        :return: generator of SFTPDirEntry, built from the attributes the
+        server returns with the listing, the entries are yielded as they arrive
+        """
+        if not path:
+            # If no path is provided, list the current directory
+            path = "."
+        remote_path = path
+        if path != "." and path[0] != os.sep:
+            # self._opendir does not support relative paths
+            remote_path = self.realpath(path)
+        yield from self._scandir(self.sftp_channel, remote_path, path)
+
+    def _scandir(self, sftp_channel, remote_path, path):
+        """
+        :param sftp_channel: the SFTP channel that the directory is read through
+        :param remote_path: the path that is opened on the sftp end
+        :param path: the path that the entry paths are joined with
+        :return: generator of SFTPDirEntry
+        """
+        with sftp_channel.opendir(remote_path) as fh:
+            for size, name, attrs in fh.readdir():
+                name = name.decode("utf-8")
+                if name in (".", ".."):
+                    continue
+                entry = SFTPDirEntry(name, os.path.join(path, name), attrs)
+                if self.metadata_cache is not None and not entry.is_symlink():
+                    # The entry attributes are equal to those of a stat call
+                    self.metadata_cache.put(
+                        METADATA_STAT,
+                        self._cache_path(os.path.join(remote_path, name)),
+                        attrs,
+                    )
+                yield entry
+
+    def _scan_walk_directory(self, sftp_channel, remote_path, path, followlinks):
+        """
+        :return: tuple of the SFTPDirEntry of the subdirectories and
+        of the remaining entries in the directory
+        """
+        dir_entries, files = [], []
+        for entry in self._scandir(sftp_channel, remote_path, path):
+            is_dir = entry.is_dir()
+            if followlinks and entry.is_symlink():
+                try:
+                    target = sftp_channel.stat(os.path.join(remote_path, entry.name))
+                    is_dir = SFTPDirEntry(entry.name, entry.path, target).is_dir()
+                except Exception:
+                    is_dir = False
+            if is_dir:
+                dir_entries.append(entry)
+            else:
+                files.append(entry)
+        return dir_entries, files
+
+    def _traverse(self, top_item, scan, expand, max_concurrency):
+        """Scan top_item and every item that is expanded from the results,
+        where the items are scanned in parallel on the connections of the pool
+        when max_concurrency is larger than 1 and the pool has any connections,
+        otherwise depth first on the store connection.
+        :param scan: function(sftp_channel, item) that returns the result of item
+        :param expand: function(item, result) that returns the child items, which
+        is called once the result has been consumed
+        :return: generator of (item, result, exception)
+        """
+        # A thread that already holds a connection of the pool could otherwise
+        # wait for the connections that are held by the other threads
+        if self._holds_pooled_connection() or not self.pool.max_size:
+            max_concurrency = 1
+        if max_concurrency <= 1:
+            stack = [top_item]
+            while stack:
+                item = stack.pop()
+                try:
+                    result, error = scan(self.sftp_channel, item), None
+                except Exception as err:
+                    result, error = None, err
+                yield item, result, error
+                if error is None:
+                    stack.extend(reversed(list(expand(item, result))))
+            return
+
+        def scan_pooled(item):
+            started, error = self.concurrency.acquire(), None
+            try:
+                with self.pool.connection() as connection:
+                    return scan(connection.sftp_channel, item)
+            except Exception as err:
+                error = err
+                raise
+            finally:
+                self.concurrency.release(started, error=error)
+
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            pending = {executor.submit(scan_pooled, top_item): top_item}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    try:
+                        result, error = future.result(), None
+                    except Exception as err:
+                        result, error = None, err
+                    yield item, result, error
+                    if error is None:
+                        for child in expand(item, result):
+                            pending[executor.submit(scan_pooled, child)] = child
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _map_pooled(self, function, items, max_concurrency, kind=None):
+        """Call function(sftp_channel, item) for every item, where the items
+        are spread across up to max_concurrency connections of the pool,
+        as far as self.concurrency allows. The items that could not be processed
+        through the pool, because it has no connections or no connection could be
+        opened, are processed on the store connection.
+        :param kind: the kind of request that function sends, whose latency
+        self.concurrency compares with earlier requests of the same kind
+        :return: list of (result, exception) tuples in the order of items
+        """
+        items = list(items)
+        results = [None] * len(items)
+        workers = min(max_concurrency, len(items))
+        if self._holds_pooled_connection() or not self.pool.max_size:
+            workers = 1
+        if workers > 1:
+            indexes = iter(range(len(items)))
+            lock = threading.Lock()
+
+            def work():
+                while True:
+                    with lock:
+                        index = next(indexes, None)
+                    if index is None:
+                        return
+                    item = items[index]
+                    started, error = self.concurrency.acquire(), None
+                    try:
+                        with self.pool.connection() as connection:
+                            try:
+                                result = function(connection.sftp_channel, item)
+                                results[index] = (result, None)
+                            except Exception as err:
+                                error = err
+                                results[index] = (None, err)
+                    except Exception as err:
+                        # No connection could be opened, the remaining
+                        # items are processed on the store connection
+                        error = err
+                        return
+                    finally:
+                        self.concurrency.release(started, error=error, kind=kind)
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for _ in range(workers):
+                    executor.submit(work)
+
+        for index, item in enumerate(items):
+            if results[index] is not None:
+                continue
+            try:
+                results[index] = (function(self.sftp_channel, item), None)
+            except Exception as err:
+                results[index] = (None, err)
+        return results
+
+    @checkout_connection
+    def walk(
+        self,
+        top=None,
+        topdown=True,
+        onerror=None,
+        followlinks=False,
+        max_concurrency=DEFAULT_WALK_CONCURRENCY,
+    ):
+        """Walk the remote directory tree of top, equivalent to os.walk.
+        When max_concurrency is larger than 1, the directories are read in parallel
+        through the connection pool of the store and are yielded in the order that
+        they are read, otherwise they are read depth first on the store connection.
+        :param top: the directory to walk, defaults to the current directory
+        :param topdown: yield a directory before its subdirectories, in which case
+        the subdirectories that are removed from dirnames are not walked
+        :param onerror: function that is called with the exception when
+        a directory could not be read
+        :param followlinks: walk into symlinks that point to directories
+        :param max_concurrency: the amount of directories that are read at a time
+        :return: generator of (dirpath, dirnames, files), where files is a list
+        of SFTPDirEntry with the attributes of each file
+        """
+        if not top:
+            top = "."
+        if not topdown:
+            yield from self._walk_bottomup(top, onerror, followlinks, max_concurrency)
+            return
+
+        for dirpath, dir_entries, files in self._walk(
+            top, onerror, followlinks, max_concurrency
+        ):
+            dirnames = [entry.name for entry in dir_entries]
+            yield dirpath, dirnames, files
+            # Only the subdirectories that remain in dirnames are walked
+            remaining = set(dirnames)
+            dir_entries[:] = [entry for entry in dir_entries if entry.name in remaining]
+
+    def _walk(self, top, onerror, followlinks, max_concurrency):
+        """
+        :return: generator of (dirpath, dir_entries, files), where the
+        subdirectories that are removed from dir_entries are not walked
+        """
+        remote_top = top
+        if top[0] != os.sep:
+            remote_top = self.realpath(top)
+            if not remote_top:
+                if onerror is not None:
+                    onerror(FileNotFoundError("Failed to resolve path: {}".format(top)))
+                return
+        if self.metadata_cache is not None:
+            # Resolve the home directory before the scans are spread across threads
+            self._get_home()
+
+        def scan(sftp_channel, item):
+            dirpath, remote_dirpath = item
+            return self._scan_walk_directory(
+                sftp_channel, remote_dirpath, dirpath, followlinks
+            )
+
+        def expand(item, result):
+            # The subdirectories might have been pruned by the caller
+            _, remote_dirpath = item
+            return [
+                (entry.path, os.path.join(remote_dirpath, entry.name))
+                for entry in result[0]
+            ]
+
+        for (dirpath, _), result, error in self._traverse(
+            (top, remote_top), scan, expand, max_concurrency
+        ):
+            if error is not None:
+                if onerror is not None:
+                    onerror(error)
+                continue
+            dir_entries, files = result
+            yield dirpath, dir_entries, files
+
+    def _refresh_tree(
+        self,
+        remote_top,
+        tree,
+        max_concurrency,
+        onerror=None,
+        recursive=True,
+        force=False,
+        errored=None,
+    ):
+        """Bring the states in tree of the directories below remote_top up to date,
+        where only the directories whose modification time has changed are read.
+        :param remote_top: the absolute remote path of the top directory
+        :param tree: DirectoryTree that is updated
+        :param recursive: also refresh the subdirectories of remote_top
+        :param force: read every directory, regardless of its modification time
+        :param errored: optional set that the remote paths of the directories
+        that could not be read are added to
+        :return: generator of (remote_path, previous_state, state) of every directory
+        that has been read, where previous_state is None for new directories
+        and state is None for removed directories. The directories that could not
+        be read keep their known state, as do the known directories below them.
+        """
+
+        def scan(sftp_channel, item):
+            remote_path, attributes = item
+            if attributes is None:
+                attributes = sftp_channel.stat(remote_path)
+            self._server_clock.observe(attributes.mtime)
+            previous = tree.get(remote_path)
+            if (
+                not force
+                and previous is not None
+                and previous.mtime == attributes.mtime
+                and previous.is_settled()
+            ):
+                return previous, previous
+            read_time = self._server_clock.now()
+            dir_entries, files = self._scan_walk_directory(
+                sftp_channel, remote_path, remote_path, False
+            )
+            state = DirectoryState(
+                attributes,
+                {entry.name: entry.attributes for entry in files},
+                {entry.name: entry.attributes for entry in dir_entries},
+                read_time=read_time,
+            )
+            return previous, state
+
+        def expand(item, result):
+            if not recursive:
+                return []
+            remote_path, _ = item
+            previous, state = result
+            # The attributes of the subdirectories are only current
+            # if the directory has just been read
+            return [
+                (
+                    os.path.join(remote_path, name),
+                    attributes if state is not previous else None,
+                )
+                for name, attributes in state.directories.items()
+            ]
+
+        visited = set()
+        if errored is None:
+            errored = set()
+        for (remote_path, _), result, error in self._traverse(
+            (remote_top, None), scan, expand, max_concurrency
+        ):
+            if error is not None:
+                errored.add(remote_path)
+                if onerror is not None:
+                    onerror(error)
+                continue
+            visited.add(remote_path)
+            previous, state = result
+            if state is not previous:
+                tree.put(remote_path, state)
+                yield remote_path, previous, state
+
+        # A directory that could not be read, e.g. from a transient error,
+        # is not known to be removed and neither is its subtree
+        for path in errored:
+            visited.update(tree.paths(path))
+        for remote_path in tree.paths(remote_top):
+            if remote_path not in visited:
+                previous = tree.get(remote_path)
+                tree.discard(remote_path)
+                yield remote_path, previous, None
+
+    @checkout_connection
+    def du(
+        self,
+        path=None,
+        depth=0,
+        use_exec=False,
+        max_concurrency=DEFAULT_WALK_CONCURRENCY,
+    ):
+        """Calculate the disk usage of path and its subdirectories, where
+        the directory states are cached by their modification time, such that
+        repeated calls only read the directories that have changed.
+        Changes to the content of existing files are not detected until
+        an entry in the same directory is created, removed or renamed.
+        :param path: the directory to summarize, defaults to the current directory
+        :param depth: the amount of levels below path that are summarized
+        :param use_exec: calculate the usage with du on the remote end
+        when exec is allowed, which is not cached
+        :param max_concurrency: the amount of directories that are read at a time
+        :return: dict of the DiskUsage of path and its subdirectories up to depth,
+        or False if path or any directory below it could not be read
+        """
+        if not path:
+            path = "."
+        path = os.path.normpath(path)
+        if use_exec and self.allow_exec:
+            usage = self._du_exec(path, depth)
+            if usage:
+                return usage
+
+        remote_top = path
+        if path[0] != os.sep:
+            remote_top = self.realpath(path)
+            if not remote_top:
+                return False
+        remote_top = os.path.normpath(remote_top)
+        if self.metadata_cache is not None:
+            self._get_home()
+        errored = set()
+        for _ in self._refresh_tree(
+            remote_top, self.tree_cache, max_concurrency, errored=errored
+        ):
+            pass
+        # The totals would be partial
+        if errored or remote_top not in self.tree_cache:
+            return False
+
+        usage = {}
+        for remote_path, disk_usage in self.tree_cache.disk_usage(remote_top).items():
+            relative = os.path.relpath(remote_path, remote_top)
+            if relative == ".":
+                usage[path] = disk_usage
+            elif relative.count(os.sep) < depth:
+                usage[os.path.join(path, relative)] = disk_usage
+        return usage
+
+    @checkout_connection
+    def refresh_manifest(
+        self,
+        manifest,
+        full=False,
+        checksum=None,
+        onerror=None,
+        max_concurrency=DEFAULT_WALK_CONCURRENCY,
+    ):
+        """Bring a RemoteManifest up to date with the remote tree of its root,
+        where only the directories whose modification time has changed are read.
+        The entries below a directory that could not be read are left as they were,
+        instead of being marked as deleted.
+        :param manifest: the RemoteManifest to refresh
+        :param full: read every directory, such that files whose content has
+        changed without any change to their directory are detected as well
+        :param checksum: name of the hash algorithm, e.g. 'sha256', that the
+        new and modified files are hashed with
+        :param onerror: function that is called with the exception when
+        a directory could not be read
+        :param max_concurrency: the amount of directories that are read at a time
+        :return: dict with the amount of directories that were read, removed and
+        could not be read, or False if the root could not be read
+        """
+        remote_top = manifest.root
+        if remote_top[0] != os.sep:
+            remote_top = self.realpath(remote_top)
+            if not remote_top:
+                return False
+        remote_top = os.path.normpath(remote_top)
+        if self.metadata_cache is not None:
+            self._get_home()
+
+        tree = manifest.tree
+        if full:
+            manifest.expire(remote_top)
+        summary = {"read": 0, "removed": 0}
+        errored = set()
+        for _, _, state in self._refresh_tree(
+            remote_top, tree, max_concurrency, onerror=onerror, errored=errored
+        ):
+            summary["read" if state is not None else "removed"] += 1
+        summary["errors"] = len(errored)
+        if remote_top in errored or remote_top not in tree:
+            manifest.commit()
+            return False
+
+        if checksum:
+            for path in manifest.missing_hashes(checksum, path=remote_top):
+                digest = self._hashsum(path, checksum)
+                if digest:
+                    manifest.set_hash(path, digest, checksum)
+        manifest.commit()
+        return summary
+
+    @checkout_connection
+    def watch(
+        self,
+        path=None,
+        interval=DEFAULT_WATCH_INTERVAL,
+        recursive=True,
+        stable_polls=1,
+        initial=False,
+        rescan_interval=None,
+        onerror=None,
+        max_concurrency=DEFAULT_WALK_CONCURRENCY,
+    ):
+        """Poll path for entries that are created, modified or deleted.
+        Every poll stats the watched directories, but only those whose modification
+        time has changed are read again. Files that are created or modified are
+        reported once their size and modification time have stopped changing,
+        such that files which are still being written are not reported early.
+        Changes to the content of existing files are only detected once their
+        directory is read again, see rescan_interval.
+        :param path: the directory to watch, defaults to the current directory
+        :param interval: the amount of seconds between the start of each poll
+        :param recursive: also watch the subdirectories of path
+        :param stable_polls: the amount of polls that the size of a created or
+        modified file must be unchanged for before it is reported
+        :param initial: report the entries that exist when the watch starts
+        as created, instead of only the changes that happen afterwards
+        :param rescan_interval: the amount of seconds between polls that read
+        every directory regardless of its modification time, defaults to never
+        :param onerror: function that is called with the exception when
+        a directory could not be read, in which case no events are reported
+        for it or below it until it can be read again
+        :param max_concurrency: the amount of directories that are read at a time
+        :return: generator of WatchEvent, which polls until it is closed
+        """
+        if interval < 0:
+            raise ValueError("interval must be a positive number: {}".format(interval))
+        if stable_polls < 0:
+            raise ValueError(
+                "stable_polls must be a positive number: {}".format(stable_polls)
+            )
+        if not path:
+            path = "."
+        path = os.path.normpath(path)
+        remote_top = path
+        if path[0] != os.sep:
+            remote_top = self.realpath(path)
+            if not remote_top:
+                if onerror is not None:
+                    onerror(
+                        FileNotFoundError("Failed to resolve path: {}".format(path))
+                    )
+                return
+        remote_top = os.path.normpath(remote_top)
+        if self.metadata_cache is not None:
+            self._get_home()
+
+        # The watch keeps its own states, since du could otherwise consume changes
+        tree = DirectoryTree()
+        pending = {}
+        report = initial
+        last_rescan = time.monotonic()
+        while True:
+            started = time.monotonic()
+            force = (
+                rescan_interval is not None and started - last_rescan >= rescan_interval
+            )
+            if force:
+                last_rescan = started
+            for kind, remote_path, is_dir, attributes in self._poll_changes(
+                remote_top,
+                tree,
+                pending,
+                report,
+                stable_polls,
+                recursive,
+                force,
+                onerror,
+                max_concurrency,
+            ):
+                relative = os.path.relpath(remote_path, remote_top)
+                yield WatchEvent(kind, os.path.join(path, relative), is_dir, attributes)
+            report = True
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def _poll_changes(
+        self,
+        remote_top,
+        tree,
+        pending,
+        report,
+        stable_polls,
+        recursive,
+        force,
+        onerror,
+        max_concurrency,
+    ):
+        """Refresh tree and compare the directories that have been read
+        :param pending: dict of the remote path of every file whose size has not
+        settled yet and its [kind, attributes, unchanged polls]
+        :param report: whether the changes are reported, which they are not
+        while the initial state of the tree is read
+        :return: list of (kind, remote_path, is_dir, attributes)
+        """
+        events = []
+        observed, added = {}, set()
+        for remote_path, previous, state in self._refresh_tree(
+            remote_top,
+            tree,
+            max_concurrency,
+            onerror=onerror,
+            recursive=recursive,
+            force=force,
+        ):
+            if not report:
+                continue
+            for kind, name, is_dir, attributes in diff_states(previous, state):
+                entry_path = os.path.join(remote_path, name)
+                if kind == EVENT_DELETED:
+                    waiting = pending.pop(entry_path, None)
+                    observed.pop(entry_path, None)
+                    # A file that is deleted before it has settled was never reported
+                    if waiting is None or waiting[0] != EVENT_CREATED:
+                        events.append((kind, entry_path, is_dir, None))
+                elif is_dir or stable_polls == 0:
+                    events.append((kind, entry_path, is_dir, attributes))
+                elif entry_path in pending:
+                    observed[entry_path] = attributes
+                else:
+                    pending[entry_path] = [kind, attributes, 0]
+                    added.add(entry_path)
+
+        # The files that are still being written do not change their directory
+        unobserved = [
+            entry_path
+            for entry_path in pending
+            if entry_path not in observed and entry_path not in added
+        ]
+        for entry_path, (attributes, error) in zip(
+            unobserved,
+            self._map_pooled(
+                self._stat_channel, unobserved, max_concurrency, kind="stat"
+            ),
+        ):
+            # A file that has been deleted is reported by its directory
+            if error is None:
+                observed[entry_path] = attributes
+
+        for entry_path, attributes in observed.items():
+            waiting = pending[entry_path]
+            if (
+                attributes.filesize != waiting[1].filesize
+                or attributes.mtime != waiting[1].mtime
+            ):
+                pending[entry_path] = [waiting[0], attributes, 0]
+                continue
+            waiting[2] += 1
+            if waiting[2] < stable_polls:
+                continue
+            del pending[entry_path]
+            events.append((waiting[0], entry_path, False, attributes))
+            # The settled attributes are the reference for later changes
+            state = tree.get(os.path.dirname(entry_path))
+            if state is not None and os.path.basename(entry_path) in state.files:
+                state.files[os.path.basename(entry_path)] = attributes
+        return events
+
+    def _hashsum(self, path, algorithm):
+        """
+        :return: the hexdigest of path, calculated on the remote end when exec
+        is allowed, otherwise over the content as it is read
+        """
+        if algorithm in REMOTE_CHECKSUM_COMMANDS:
+            digest = self.remote_hashsum(path, algorithm=algorithm)
+            if digest:
+                return digest
+        hash_algorithm = new_hash(algorithm)
+        try:
+            with self.open(path, "rb", traffic=TRAFFIC_BULK) as fh:
+                for chunk in iter(lambda: fh.read(DEFAULT_TRANSFER_CHUNK_SIZE), b""):
+                    hash_algorithm.update(chunk)
+        except Exception:
+            return False
+        return hash_algorithm.hexdigest()
+
+    def _du_exec(self, path, depth):
+        """
+        :return: dict of the DiskUsage reported by du on the remote end,
+        or None if du could not be run
+        """
+        arguments = "--max-depth={} -- {}".format(int(depth), shlex.quote(path))
+        # The sizes and the entry counts are separated by a NUL byte
+        command = (
+            "du --apparent-size --block-size=1 {0} && printf '\\0' && "
+            "du --inodes {0}".format(arguments)
+        )
+        try:
+            result_code, result = self._exec(command)
+        except Exception:
+            return None
+        if result_code != SSHClientResultCode.SUCCESS or result.get("exit_code"):
+            return None
+        sizes, _, inodes = result["output"].partition("\0")
+        counts = dict(
+            reversed(line.split("\t", 1)) for line in inodes.splitlines() if line
+        )
+        usage = {}
+        for line in sizes.splitlines():
+            if not line:
+                continue
+            size, du_path = line.split("\t", 1)
+            if du_path not in counts:
+                return None
+            usage[du_path] = DiskUsage(int(size), int(counts[du_path]))
+        return usage
+
+    def _walk_bottomup(self, top, onerror, followlinks, max_concurrency):
+        # The entire tree is read before the deepest directories can be yielded
+        tree = {}
+        for dirpath, dirnames, files in self.walk(
+            top,
+            topdown=True,
+            onerror=onerror,
+            followlinks=followlinks,
+            max_concurrency=max_concurrency,
+        ):
+            tree[dirpath] = (dirnames, files)
+
+        stack = [(top, False)]
+        while stack:
+            dirpath, visited = stack.pop()
+            if dirpath not in tree:
+                continue
+            dirnames, files = tree[dirpath]
+            if visited:
+                del tree[dirpath]
+                yield dirpath, dirnames, files
+                continue
+            stack.append((dirpath, True))
+            for name in reversed(dirnames):
+                stack.append((os.path.join(dirpath, name), False))
+
+    @checkout_connection
+    def find(
+        self,
+        path=None,
+        name=None,
+        newer=None,
+        size=None,
+        file_type=None,
+        min_depth=1,
+        max_depth=None,
+        max_concurrency=DEFAULT_WALK_CONCURRENCY,
+    ):
+        """Find the entries below path that match every given condition.
+        When exec is allowed, a single find command is run on the remote end
+        and its output is parsed as it is received, otherwise the tree is walked.
+        :param path: the directory to search, defaults to the current directory
+        :param name: shell pattern that the name of an entry must match
+        :param newer: timestamp or datetime that the modification time must be after
+        :param size: the size in bytes, or a tuple of the (min, max) size in bytes
+        where either can be None
+        :param file_type: 'f' for files, 'd' for directories, 'l' for symlinks
+        :param min_depth: the depth below path where entries are matched from
+        :param max_depth: the depth below path where the search stops
+        :param max_concurrency: the amount of directories that are read at a time
+        when the tree is walked
+        :return: generator of SFTPDirEntry
+        """
+        if not path:
+            path = "."
+        if file_type is not None and file_type not in FIND_FILE_TYPES:
+            raise ValueError(
+                "file_type must be one of {}, is: {}".format(
+                    list(FIND_FILE_TYPES), file_type
+                )
+            )
+        if isinstance(newer, datetime.datetime):
+            newer = newer.timestamp()
+        if isinstance(size, int):
+            size = (size, size)
+        conditions = (name, newer, size, file_type, min_depth, max_depth)
+
+        if self.allow_exec:
+            found = False
+            try:
+                for entry in self._find_exec(path, *conditions):
+                    found = True
+                    yield entry
+                return
+            except Exception:
+                # The results of find can not be merged with those of a walk
+                if found:
+                    raise
+        yield from self._find_walk(path, *conditions, max_concurrency)
+
+    def _find_exec(self, path, name, newer, size, file_type, min_depth, max_depth):
+        """
+        :return: generator of the SFTPDirEntry printed by find on the remote end
+        """
+        search_path = path
+        if path.startswith("-"):
+            # Otherwise the path would be parsed as part of the expression
+            search_path = os.path.join(".", path)
+
+        expression = ["-mindepth", str(min_depth)]
+        if max_depth is not None:
+            expression.extend(["-maxdepth", str(max_depth)])
+        if name is not None:
+            expression.extend(["-name", name])
+        if file_type is not None:
+            expression.extend(["-type", file_type])
+        if newer is not None:
+            expression.extend(["-newermt", "@{}".format(newer)])
+        if size is not None:
+            min_size, max_size = size
+            if min_size:
+                expression.extend(["-size", "+{}c".format(min_size - 1)])
+            if max_size is not None:
+                expression.extend(["-size", "-{}c".format(max_size + 1)])
+        expression.extend(["-printf", FIND_PRINTF_FORMAT])
+        command = "find {} {} 2>/dev/null".format(
+            shlex.quote(search_path), " ".join(shlex.quote(arg) for arg in expression)
+        )
+
+        # A dedicated channel, such that the store can be used while
+        # the results are consumed
+        channel = self.ssh_client.session.open_session()
+        try:
+            handle_error_codes(channel.execute(command))
+            found, remainder = False, b""
+            for chunk in read_channel_stdout_chunks(channel):
+                records = (remainder + chunk).split(b"\0")
+                remainder = records.pop()
+                for record in records:
+                    found = True
+                    entry = parse_find_record(record)
+                    if search_path != path:
+                        relative = os.path.relpath(entry.path, search_path)
+                        entry.path = path
+                        if relative != ".":
+                            entry.path = os.path.join(path, relative)
+                    yield entry
+        finally:
+            channel.close()
+        channel.wait_closed()
+        if not found and read_channel_exit_status(channel) != 0:
+            raise ChildProcessError("Failed to run: {}".format(command))
+
+    def _find_walk(
+        self,
+        path,
+        name,
+        newer,
+        size,
+        file_type,
+        min_depth,
+        max_depth,
+        max_concurrency,
+    ):
+        """
+        :return: generator of the SFTPDirEntry that are found by walking the tree
+        """
+        if min_depth <= 0:
+            # The walk only reports the entries below path
+            attributes = self._stat(path)
+            if attributes is not None:
+                entry = SFTPDirEntry(os.path.basename(path), path, attributes)
+                if self._find_matches(entry, name, newer, size, file_type):
+                    yield entry
+
+        depths = {path: 0}
+        for dirpath, dir_entries, files in self._walk(
+            path, None, False, max_concurrency
+        ):
+            depth = depths.pop(dirpath) + 1
+            if depth >= min_depth:
+                for entry in dir_entries + files:
+                    if self._find_matches(entry, name, newer, size, file_type):
+                        yield entry
+            if max_depth is not None and depth >= max_depth:
+                dir_entries.clear()
+            for entry in dir_entries:
+                depths[entry.path] = depth
+
+    @staticmethod
+    def _find_matches(entry, name, newer, size, file_type):
+        if name is not None and not fnmatch.fnmatchcase(entry.name, name):
+            return False
+        if newer is not None and not entry.mtime > newer:
+            return False
+        if size is not None:
+            min_size, max_size = size
+            if min_size is not None and entry.size < min_size:
+                return False
+            if max_size is not None and entry.size > max_size:
+                return False
+        if file_type is not None:
+            if entry.mode is None:
+                return False
+            if stat.S_IFMT(entry.mode) != FIND_FILE_TYPES[file_type]:
+                return False
+        return True
+
+    @checkout_connection
+    def glob(self, pattern, max_concurrency=DEFAULT_WALK_CONCURRENCY):
+        """Find the paths that match pattern, where '*', '?' and '[seq]' match
+        within a single path component and '**' matches any amount of directories.
+        :param pattern: the relative or absolute glob pattern
+        :param max_concurrency: the amount of directories that are read at a time
+        when exec is not allowed and the tree is walked
+        :return: generator of the matching paths
+        """
+        parts = [part for part in pattern.split(os.sep) if part]
+        # The leading components without any magic are searched from
+        magic_index = len(parts)
+        for index, part in enumerate(parts):
+            if GLOB_MAGIC.search(part):
+                magic_index = index
+                break
+        prefix, parts = parts[:magic_index], parts[magic_index:]
+        root = os.sep.join(prefix)
+        if pattern.startswith(os.sep):
+            root = os.sep + root
+        if not parts:
+            if self.exists(pattern):
+                yield pattern
+            return
+
+        search_root = root or "."
+        if "**" in parts:
+            min_depth = max(len([part for part in parts if part != "**"]), 1)
+            max_depth = None
+        else:
+            min_depth = max_depth = len(parts)
+        # Only the last component can be matched by find itself
+        name = parts[-1] if parts[-1] != "**" else None
+
+        for entry in self.find(
+            search_root,
+            name=name,
+            min_depth=min_depth,
+            max_depth=max_depth,
+            max_concurrency=max_concurrency,
+        ):
+            relative = os.path.relpath(entry.path, search_root)
+            if match_glob_parts(parts, relative.split(os.sep)):
+                yield os.path.join(root, relative)
+
     def touch(self, path):
         """
         :param path:
@@ -257,30 +1699,57 @@ class SFTPStore(DataStore):
         with self.open(path, "a") as fh:
             fh.write("")
 
+    @checkout_connection
     def mkdir(self, path, mode=0o755, recursive=False, **kwargs):
-        """
+        """Create the directory optimistically, where the parent directories
+        are only created if the server reports them as missing and
+        an existing directory is treated as created.
+        The directories that have been created or found are not checked again,
+        until a file or directory cannot be created in them because the server
+        reports them as missing, e.g. when another client has removed them.
         :param path: path to the directory that should be created
+        :param recursive: create the missing parent directories as well
         :return: Boolean
         """
-        split_path = path.split(os.sep) if recursive else [path]
+        path = os.path.normpath(path)
+        if self._cache_path(path) in self._known_directories:
+            return True
 
-        if split_path[0] == "":
-            split_path[0] = os.sep
-        previous_dir = ""
-        for path_part in split_path:
-            current_path = os.path.join(previous_dir, path_part)
-            if not self.exists(current_path):
-                try:
-                    self.sftp_channel.mkdir(current_path, mode)
-                except Exception:
-                    error = self.sftp_channel.last_error()
-                    print(
-                        "Failed to create path: {} - error_code: {}".format(
-                            current_path, error
-                        )
-                    )
-                    return False
-            previous_dir = current_path
+        missing, ascended = [path], set()
+        while missing:
+            current_path = missing[-1]
+            key = self._cache_path(current_path)
+            if key in self._known_directories:
+                missing.pop()
+                continue
+            try:
+                self.sftp_channel.mkdir(current_path, mode)
+                self._invalidate(current_path)
+                self._remember_directory(key)
+                missing.pop()
+                continue
+            except Exception:
+                error = self.sftp_channel.last_error()
+                self._forget_missing_parent(current_path)
+
+            parent = os.path.dirname(current_path)
+            if (
+                recursive
+                and error in (LIBSSH2_FX_NO_SUCH_FILE, LIBSSH2_FX_NO_SUCH_PATH)
+                and parent not in ("", current_path)
+                and current_path not in ascended
+            ):
+                # Create the parent before the directory is tried again
+                ascended.add(current_path)
+                missing.append(parent)
+                continue
+
+            # The server might report an existing path as a generic failure
+            attributes = self._stat(current_path)
+            if attributes is None or not stat.S_ISDIR(attributes.permissions):
+                return False
+            self._remember_directory(key)
+            missing.pop()
         return True
 
     def _rmdir(self, path):
@@ -289,6 +1758,7 @@ class SFTPStore(DataStore):
         """
         try:
             self.sftp_channel.rmdir(path)
+            self._invalidate(path, recursive=True)
             return True
         except Exception:
             error = self.sftp_channel.last_error()
@@ -296,35 +1766,196 @@ class SFTPStore(DataStore):
             return False
         return False
 
-    def rmdir(self, path, recursive=False):
+    @checkout_connection
+    def rmdir(
+        self,
+        path,
+        recursive=False,
+        max_concurrency=DEFAULT_WALK_CONCURRENCY,
+        use_exec=False,
+    ):
         """
         :param path: path to the directory that should be removed
-        :return: None
+        :param recursive: remove the content of the directory as well
+        :param max_concurrency: the amount of removals that are issued at a time
+        :param use_exec: remove the directory with a single 'rm -rf' command
+        on the remote end when exec is allowed
+        :return: Boolean
         """
         if not recursive:
             return self._rmdir(path)
+        if use_exec and self.allow_exec and self._rmtree_exec(path):
+            return True
+        return self._rmtree(path, max_concurrency)
 
-        # TODO, update this to be able to recusively remove all
-        # non specified files and directories as would be expected
-        # from a recursive removal
-        if os.sep in path:
-            split_path = path.split(os.sep)
-            new_path = os.sep.join(split_path[:-1])
-            if not self._rmdir(path):
-                return False
-            return self.rmdir(new_path, recursive=True)
-        else:
-            return self.rmdir(path, recursive=False)
+    def _rmtree_exec(self, path):
+        # Like _rmtree, a symlink to a directory is not removed, where a trailing
+        # separator would make test resolve the symlink
+        path = os.path.normpath(path)
+        command = "test -d {0} && ! test -L {0} && rm -rf -- {0}".format(
+            shlex.quote(path)
+        )
+        try:
+            result_code, result = self._exec(command)
+        except Exception:
+            return False
+        self._invalidate(path, recursive=True)
+        return result_code == SSHClientResultCode.SUCCESS and not result.get(
+            "exit_code"
+        )
 
+    def _rmtree(self, path, max_concurrency):
+        """Remove the files below path followed by the directories,
+        deepest first, where each level is removed concurrently
+        """
+        # The levels are counted by the separators of the walked paths,
+        # which must not include a trailing separator of path
+        path = os.path.normpath(path)
+        try:
+            attributes = self.sftp_channel.lstat(path)
+        except Exception:
+            attributes = None
+        # A symlink is not followed, such that only the tree of path is removed
+        if attributes is None or not stat.S_ISDIR(attributes.permissions):
+            print("Failed to remove path: {} - not a directory".format(path))
+            return False
+
+        errors = []
+        files, levels = [], {}
+        for dirpath, dir_entries, entries in self._walk(
+            path, errors.append, False, max_concurrency
+        ):
+            files.extend(entry.path for entry in entries)
+            levels.setdefault(dirpath.count(os.sep), []).append(dirpath)
+
+        removals = [(files, lambda channel, file: channel.unlink(file), "unlink")]
+        for depth in sorted(levels, reverse=True):
+            removals.append(
+                (
+                    levels[depth],
+                    lambda channel, directory: channel.rmdir(directory),
+                    "rmdir",
+                )
+            )
+
+        removed = True
+        for paths, remove, kind in removals:
+            results = self._map_pooled(remove, paths, max_concurrency, kind=kind)
+            for removed_path, (_, error) in zip(paths, results):
+                self._invalidate(removed_path)
+                if error is not None:
+                    print(
+                        "Failed to remove path: {} - error: {}".format(
+                            removed_path, error
+                        )
+                    )
+                    removed = False
+        self._invalidate(path, recursive=True)
+        for error in errors:
+            print("Failed to read directory - error: {}".format(error))
+        return removed and not errors
+
+    @checkout_connection
     def stat(self, path):
         """
         :param path: path to the file that should return it's stats
         """
         try:
-            return self.sftp_channel.stat(path)
+            attributes = self._cached(
+                METADATA_STAT, path, lambda: self._stat_or_missing(path)
+            )
         except Exception:
             return False
+        if attributes is None:
+            return False
+        return attributes
+
+    @checkout_connection
+    def stat_many(self, paths, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        """Stat every path, where the paths are spread across the connections
+        of the pool such that many requests are in flight at the same time.
+        :param paths: iterable of paths to stat
+        :param max_concurrency: the amount of connections that are used
+        :return: list of (path, attributes, error) tuples in the order of paths,
+        where attributes is None and error is set when the path could not be stat'ed
+        """
+        paths = list(paths)
+        results = [None] * len(paths)
+        missing = []
+        for index, path in enumerate(paths):
+            if self.metadata_cache is not None:
+                found, attributes = self.metadata_cache.get(
+                    METADATA_STAT, self._cache_path(path)
+                )
+                if found:
+                    error = None
+                    if attributes is None:
+                        error = FileNotFoundError("No such path: {}".format(path))
+                    results[index] = (path, attributes, error)
+                    continue
+            missing.append(index)
+
+        stats = self._map_pooled(
+            self._stat_channel,
+            [paths[index] for index in missing],
+            max_concurrency,
+            kind="stat",
+        )
+        for index, (attributes, error) in zip(missing, stats):
+            path = paths[index]
+            if self.metadata_cache is not None:
+                if error is None or isinstance(error, FileNotFoundError):
+                    self.metadata_cache.put(
+                        METADATA_STAT, self._cache_path(path), attributes
+                    )
+            results[index] = (path, attributes, error)
+        return results
+
+    def exists_many(self, paths, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        """
+        :param paths: iterable of paths that are checked
+        :return: list of Boolean in the order of paths
+        """
+        return [
+            attributes is not None
+            for _, attributes, _ in self.stat_many(
+                paths, max_concurrency=max_concurrency
+            )
+        ]
+
+    @staticmethod
+    def _stat_channel(sftp_channel, path):
+        try:
+            return sftp_channel.stat(path)
+        except Exception as err:
+            error = sftp_channel.last_error()
+            if error in (LIBSSH2_FX_NO_SUCH_FILE, LIBSSH2_FX_NO_SUCH_PATH):
+                raise FileNotFoundError("No such path: {}".format(path)) from err
+            raise OSError(
+                "Failed to stat path: {} - error_code: {}".format(path, error)
+            ) from err
 
+    def _stat(self, path):
+        """
+        :return: the SFTPAttributes of path, or None if it could not be stat'ed
+        """
+        try:
+            return self.sftp_channel.stat(path)
+        except Exception:
+            return None
+
+    def _stat_or_missing(self, path):
+        """
+        :return: the SFTPAttributes of path, or None if the server reports
+        that it could not be stat'ed, e.g. because it does not exist, where other
+        errors such as a lost connection are raised, such that they are not cached
+        """
+        try:
+            return self.sftp_channel.stat(path)
+        except SFTPProtocolError:
+            return None
+
+    @checkout_connection
     def setstat(self, path, attributes):
         """
         :param path: path to the file that should have set their stat attributes
@@ -332,29 +1963,84 @@ class SFTPStore(DataStore):
         """
         try:
             self.sftp_channel.setstat(path, attributes)
+            self._invalidate(path)
             return True
         except Exception:
             return False
 
+    @checkout_connection
     def remove(self, path):
         """
         :param path: path to the file that should be removed
         """
         try:
             self.sftp_channel.unlink(path)
+            self._invalidate(path)
             return True
         except Exception:
             return False
 
+    def batch(self, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        """Record mkdir, rename, remove and setstat operations that are sent
+        together on the connections of the pool when the batch is flushed,
+        instead of waiting for the reply of each before the next is sent.
+        An operation runs after the earlier operations of the batch that change
+        the same path, its parent directories or the paths below it.
+
+            with store.batch() as batch:
+                batch.rename("data.tmp", "data")
+                batch.setstat("data", attributes)
+            failed = batch.errors
+
+        :param max_concurrency: the amount of connections that are used
+        :return: Batch
+        """
+        return Batch(self, max_concurrency)
+
+    @checkout_connection
+    def _run_batch(self, operations, max_concurrency):
+        """Run the operations of a batch and set their result or error
+        :param operations: list of BatchOperation in the order they were recorded
+        """
+        for level in operation_levels(operations, key=self._cache_path):
+            results = self._map_pooled(
+                lambda sftp_channel, operation: operation.run(sftp_channel),
+                level,
+                max_concurrency,
+                kind="batch",
+            )
+            for operation, (result, error) in zip(level, results):
+                operation.result, operation.error = result, error
+                operation.done = True
+                if error is not None:
+                    continue
+                for path in operation.paths:
+                    self._invalidate(path, recursive=operation.name == OPERATION_RENAME)
+                if operation.name == OPERATION_MKDIR:
+                    self._remember_directory(self._cache_path(operation.paths[0]))
+
+    @checkout_connection
     def realpath(self, path):
         """
         :param path: The path that should be resolved
         """
         try:
-            return self.sftp_channel.realpath(path)
+            resolved = self._cached(
+                METADATA_REALPATH, path, lambda: self._realpath(path)
+            )
         except Exception:
             return False
+        if resolved is None:
+            return False
+        return resolved
+
+    def _realpath(self, path):
+        try:
+            return self.sftp_channel.realpath(path)
+        except SFTPProtocolError:
+            return None
 
+    @checkout_connection
     def rename(self, old_path, new_path):
         """
         :param old_path: The path that should be renamed
@@ -362,46 +2048,290 @@ class SFTPStore(DataStore):
         """
         try:
             self.sftp_channel.rename(old_path, new_path)
+            self._invalidate(old_path, recursive=True)
+            self._invalidate(new_path, recursive=True)
             return True
         except Exception:
             return False
 
-    def upload(self, local_path, remote_path, file_format="binary"):
+    def _exec(self, command):
+        """Execute command on a new session channel of the store connection
+        :param command: the command to execute
+        :return: tuple of SSHClientResultCode and the result dict
+        """
+        if not self.ssh_client.open_channel():
+            return (
+                SSHClientResultCode.CHANNEL_OPEN_ERROR,
+                {"output": f"Failed to open a channel for the command: {command}"},
+            )
+        try:
+            return self.ssh_client.exec_command(
+                command, channel=self.ssh_client.get_channel()
+            )
+        finally:
+            self.ssh_client.close_channel()
+
+    @checkout_connection
+    def remote_hashsum(self, path, algorithm=DEFAULT_CHECKSUM_ALGORITHM):
+        """Calculate the checksum of path on the remote end, such that the
+        content does not have to be transferred to be verified.
+        :param path: path to the remote file
+        :param algorithm: the hash algorithm, one of REMOTE_CHECKSUM_COMMANDS
+        :return: the hexdigest of the file, or False if it could not be calculated
+        """
+        check_remote_checksum(algorithm)
+        if not self.allow_exec:
+            return False
+        command = "{} -- {}".format(
+            REMOTE_CHECKSUM_COMMANDS[algorithm], shlex.quote(path)
+        )
+        try:
+            result_code, result = self._exec(command)
+        except Exception:
+            return False
+        if result_code != SSHClientResultCode.SUCCESS or result.get("exit_code"):
+            return False
+        output = result["output"].split()
+        if not output:
+            return False
+        # Checksum tools escape the line when the path contains special characters
+        return output[0].lstrip("\\")
+
+    def _transfer_result(self, remote_path, hash_algorithm, algorithm, verify):
+        """
+        :return: True if no checksum was requested, otherwise the hexdigest of the
+        transferred content, or False if it differs from the remote checksum
+        """
+        if hash_algorithm is None:
+            return True
+        digest = hash_algorithm.hexdigest()
+        if verify and self.remote_hashsum(remote_path, algorithm=algorithm) != digest:
+            return False
+        return digest
+
+    @checkout_connection
+    def upload(
+        self,
+        local_path,
+        remote_path,
+        file_format="binary",
+        checksum=None,
+        verify=False,
+        chunk_size=DEFAULT_TRANSFER_CHUNK_SIZE,
+        traffic=TRAFFIC_BULK,
+    ):
         """
         :param local_path: The path to the local file
         :param remote_path: The path to the remote file
+        :param checksum: name of the hash algorithm, e.g. 'sha256', that is
+        calculated over the transferred content while it is being uploaded
+        :param verify: compare the checksum with one calculated on the remote end,
+        where the algorithm must be one of REMOTE_CHECKSUM_COMMANDS
+        :param chunk_size: the amount of bytes that are transferred at a time
+        :param traffic: the traffic class that the rate of the transfer is limited by
+        :return: True, or the hexdigest if a checksum is requested,
+        False if the verification failed
         """
         r_mode = "rb" if file_format == "binary" else "r"
         w_mode = "wb" if file_format == "binary" else "w"
+        empty = b"" if file_format == "binary" else ""
+        if verify and not checksum:
+            checksum = DEFAULT_CHECKSUM_ALGORITHM
+        if verify:
+            check_remote_checksum(checksum)
+        hash_algorithm = new_hash(checksum) if checksum else None
 
         # TODO, add exception handling
         with open(local_path, r_mode) as fh:
-            with self.open(remote_path, w_mode) as remote_fh:
-                remote_fh.write(fh.read())
-        return True
+            with self.open(remote_path, w_mode, traffic=traffic) as remote_fh:
+                for chunk in iter(lambda: fh.read(chunk_size), empty):
+                    remote_fh.write(chunk)
+                    if hash_algorithm is not None:
+                        if isinstance(chunk, str):
+                            chunk = chunk.encode("utf-8")
+                        hash_algorithm.update(chunk)
+        return self._transfer_result(remote_path, hash_algorithm, checksum, verify)
 
-    def download(self, remote_path, local_path, file_format="binary"):
+    @checkout_connection
+    def download(
+        self,
+        remote_path,
+        local_path,
+        file_format="binary",
+        checksum=None,
+        verify=False,
+        chunk_size=DEFAULT_TRANSFER_CHUNK_SIZE,
+        traffic=TRAFFIC_BULK,
+    ):
         """
         :param remote_path: The path to the remote file
         :param local_path: The path to the local file
+        :param checksum: name of the hash algorithm, e.g. 'sha256', that is
+        calculated over the transferred content while it is being downloaded
+        :param verify: compare the checksum with one calculated on the remote end,
+        where the algorithm must be one of REMOTE_CHECKSUM_COMMANDS
+        :param chunk_size: the amount of bytes that are transferred at a time
+        :param traffic: the traffic class that the rate of the transfer is limited by
+        :return: True, or the hexdigest if a checksum is requested,
+        False if the verification failed
         """
 
         r_mode = "rb" if file_format == "binary" else "r"
         w_mode = "wb" if file_format == "binary" else "w"
+        empty = b"" if file_format == "binary" else ""
+        if verify and not checksum:
+            checksum = DEFAULT_CHECKSUM_ALGORITHM
+        if verify:
+            check_remote_checksum(checksum)
+        hash_algorithm = new_hash(checksum) if checksum else None
 
         # TODO, add exception handling
-        with self.open(remote_path, r_mode) as fh:
+        with self.open(remote_path, r_mode, traffic=traffic) as fh:
             with open(local_path, w_mode) as local_fh:
-                local_fh.write(fh.read())
+                for chunk in iter(lambda: fh.read(chunk_size), empty):
+                    local_fh.write(chunk)
+                    if hash_algorithm is not None:
+                        if isinstance(chunk, str):
+                            chunk = chunk.encode("utf-8")
+                        hash_algorithm.update(chunk)
+        return self._transfer_result(remote_path, hash_algorithm, checksum, verify)
+
+    @checkout_connection
+    def download_tree(
+        self,
+        remote_path,
+        local_path,
+        mode=TREE_MODE_TAR,
+        compression=None,
+        max_concurrency=DEFAULT_BULK_CONCURRENCY,
+        traffic=TRAFFIC_BULK,
+    ):
+        """Download the content of a remote directory into a local directory
+        :param remote_path: The path to the remote directory
+        :param local_path: The path to the local directory, which is created
+        :param mode: 'tar' streams the directory as a single tar archive that is
+        created by tar on the remote end and extracted while it is received, where
+        the files are downloaded separately over SFTP when exec is not allowed or
+        the archive could not be created. 'sftp' only downloads the files separately
+        :param compression: optional 'gzip' or 'zstd' that the archive is compressed
+        with on the remote end, where zstd requires the zstandard package
+        :param max_concurrency: the amount of files that are downloaded at a time
+        over SFTP
+        :param traffic: the traffic class that the rate of the transfer is limited by
+        :return: Boolean
+        """
+        if mode not in TREE_MODES:
+            raise ValueError("mode must be one of {}, is: {}".format(TREE_MODES, mode))
+        if compression is not None and compression not in TAR_COMPRESSION_OPTIONS:
+            raise ValueError(
+                "compression must be one of {}, is: {}".format(
+                    list(TAR_COMPRESSION_OPTIONS), compression
+                )
+            )
+        if compression == COMPRESSION_ZSTD:
+            import_zstandard()
+
+        attributes = self._stat(remote_path)
+        if attributes is None or not stat.S_ISDIR(attributes.permissions):
+            print("Failed to download path: {} - not a directory".format(remote_path))
+            return False
+        os.makedirs(local_path, exist_ok=True)
+        if (
+            mode == TREE_MODE_TAR
+            and self.allow_exec
+            and self._download_tree_tar(remote_path, local_path, compression, traffic)
+        ):
+            return True
+        return self._download_tree_sftp(
+            remote_path, local_path, max_concurrency, traffic
+        )
+
+    def _download_tree_tar(self, remote_path, local_path, compression, traffic):
+        throttle = self._throttle_function(traffic)
+
+        def read_chunks(channel):
+            for chunk in read_channel_stdout_chunks(channel):
+                throttle(len(chunk))
+                yield chunk
+
+        channel = None
+        try:
+            try:
+                # A dedicated channel, such that the archive is read as a single stream
+                channel = self.ssh_client.session.open_session()
+                handle_error_codes(
+                    channel.execute(tar_command(remote_path, compression))
+                )
+                chunks = read_chunks(channel)
+                extract_tar_stream(ChunkStream(chunks), local_path, compression)
+                # The padding after the end of the archive is not read by tarfile
+                for _ in chunks:
+                    pass
+                # E.g. the files that could not be read
+                _, errors = read_channel_response_stderr(channel)
+            finally:
+                if channel is not None:
+                    channel.close()
+            channel.wait_closed()
+            exit_code = read_channel_exit_status(channel)
+        except Exception as err:
+            print(
+                "Failed to download path: {} as a tar archive - error: {}".format(
+                    remote_path, err
+                )
+            )
+            return False
+        if exit_code != 0:
+            print(
+                "Failed to download path: {} as a tar archive - exit code: {} "
+                "- error: {}".format(remote_path, exit_code, errors.strip())
+            )
+            return False
         return True
 
-    def copy(self, remote_src, remote_dest):
+    def _download_tree_sftp(self, remote_path, local_path, max_concurrency, traffic):
+        errors = []
+        downloads = []
+        for dirpath, _, entries in self._walk(
+            remote_path, errors.append, False, max_concurrency
+        ):
+            local_dirpath = os.path.normpath(
+                os.path.join(local_path, os.path.relpath(dirpath, remote_path))
+            )
+            os.makedirs(local_dirpath, exist_ok=True)
+            downloads.extend(
+                (entry.path, os.path.join(local_dirpath, entry.name))
+                for entry in entries
+            )
+        for error in errors:
+            print("Failed to read directory - error: {}".format(error))
+
+        def download(paths):
+            try:
+                return self.download(*paths, traffic=traffic)
+            except Exception as err:
+                print("Failed to download path: {} - error: {}".format(paths[0], err))
+                return False
+
+        workers = min(max_concurrency, len(downloads))
+        # A thread that holds a connection of the pool downloads on it,
+        # where the other threads of the executor check out their own
+        if workers <= 1 or self._holds_pooled_connection() or not self.pool.max_size:
+            results = [download(paths) for paths in downloads]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(download, downloads))
+        return all(results) and not errors
+
+    @checkout_connection
+    def copy(self, remote_src, remote_dest, traffic=TRAFFIC_BULK):
         """
         :param remote_src: The path to the remote source file
         :param remote_dest: The path to the remote destination file
+        :param traffic: the traffic class that the rate of the copy is limited by
         """
         # TODO, add exception handling
-        with self.open(remote_src, "rb") as src:
-            with self.open(remote_dest, "wb") as dest:
+        with self.open(remote_src, "rb", traffic=traffic) as src:
+            with self.open(remote_dest, "wb", traffic=traffic) as dest:
                 dest.write(src.read())
         return True
@@ -0,0 +1,118 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import stat
+from ssh2.sftp import (
+    LIBSSH2_SFTP_ATTR_ACMODTIME,
+    LIBSSH2_SFTP_ATTR_PERMISSIONS,
+    LIBSSH2_SFTP_ATTR_SIZE,
+    LIBSSH2_SFTP_ATTR_UIDGID,
+)
+from ssh2.sftp_handle import SFTPAttributes
+
+# The fields that `find -printf` outputs for each entry, terminated by a NUL byte
+# such that paths can contain any character
+FIND_PRINTF_FORMAT = "%y %m %s %T@ %A@ %U %G %p\\0"
+# The file type bits of the types reported by %y
+FIND_FILE_TYPES = {
+    "f": stat.S_IFREG,
+    "d": stat.S_IFDIR,
+    "l": stat.S_IFLNK,
+    "b": stat.S_IFBLK,
+    "c": stat.S_IFCHR,
+    "p": stat.S_IFIFO,
+    "s": stat.S_IFSOCK,
+}
+
+
+class SFTPDirEntry:
+    __slots__ = ("name", "path", "attributes")
+
+    def __init__(self, name, path, attributes):
+        """A directory entry that is built from the attributes returned
+        by the server when the directory was read, such that no further
+        stat calls are required.
+        :param name: the name of the entry
+        :param path: the path of the entry, the scanned directory joined with name
+        :param attributes: ssh2.sftp.SFTPAttributes of the entry
+        """
+        self.name = name
+        self.path = path
+        self.attributes = attributes
+
+    def __repr__(self):
+        return "<SFTPDirEntry '{}'>".format(self.name)
+
+    def __fspath__(self):
+        return self.path
+
+    @property
+    def size(self):
+        return self.attributes.filesize
+
+    @property
+    def mtime(self):
+        return self.attributes.mtime
+
+    @property
+    def mode(self):
+        """
+        :return: the permissions including the file type bits,
+        or None if the server did not send them
+        """
+        if not self.attributes.flags & LIBSSH2_SFTP_ATTR_PERMISSIONS:
+            return None
+        return self.attributes.permissions
+
+    def is_dir(self):
+        return self.mode is not None and stat.S_ISDIR(self.mode)
+
+    def is_file(self):
+        return self.mode is not None and stat.S_ISREG(self.mode)
+
+    def is_symlink(self):
+        return self.mode is not None and stat.S_ISLNK(self.mode)
+
+    def stat(self):
+        """
+        :return: the ssh2.sftp.SFTPAttributes of the entry, symlinks are not followed
+        """
+        return self.attributes
+
+
+def parse_find_record(record):
+    """
+    :param record: bytes of a single entry printed with FIND_PRINTF_FORMAT
+    :return: SFTPDirEntry with the attributes reported by find
+    """
+    file_type, mode, size, mtime, atime, uid, gid, path = record.decode("utf-8").split(
+        " ", 7
+    )
+    attributes = SFTPAttributes()
+    attributes.flags = (
+        LIBSSH2_SFTP_ATTR_SIZE
+        | LIBSSH2_SFTP_ATTR_UIDGID
+        | LIBSSH2_SFTP_ATTR_PERMISSIONS
+        | LIBSSH2_SFTP_ATTR_ACMODTIME
+    )
+    attributes.filesize = int(size)
+    attributes.mtime = int(float(mtime))
+    attributes.atime = int(float(atime))
+    attributes.uid = int(uid)
+    attributes.gid = int(gid)
+    attributes.permissions = FIND_FILE_TYPES.get(file_type, 0) | int(mode, 8)
+    return SFTPDirEntry(os.path.basename(path), path, attributes)
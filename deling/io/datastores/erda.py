@@ -28,6 +28,8 @@ class ERDASFTPShare(SFTPStore):
             ERDA.url,
             port,
             SSHAuthenticator(username=username, password=password),
+            # ERDA only provides SFTP access
+            allow_exec=False,
         )
 
 
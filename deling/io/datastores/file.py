@@ -14,8 +14,39 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import bisect
+import codecs
 from abc import abstractmethod
 
+DEFAULT_CHUNK_SIZE = 1024 * 64
+# Ranges that are closer than this are fetched as a single read
+DEFAULT_RANGE_GAP = 1024 * 64
+# Upper bound on the size of a merged range read
+DEFAULT_MAX_RANGE_READ = 1024 * 1024 * 16
+
+
+def merge_ranges(ranges, max_gap=DEFAULT_RANGE_GAP, max_size=DEFAULT_MAX_RANGE_READ):
+    """Merge the ranges that overlap or are separated by at most max_gap bytes
+    :param ranges: list of (offset, length) tuples
+    :param max_gap: the largest amount of unrequested bytes to read in
+    order to join two ranges
+    :param max_size: ranges are not joined beyond this size
+    :return: sorted list of merged (offset, length) tuples
+    """
+    merged = []
+    for offset, length in sorted(
+        (offset, length) for offset, length in ranges if length > 0
+    ):
+        if merged:
+            merged_offset, merged_length = merged[-1]
+            merged_end = merged_offset + merged_length
+            end = max(merged_end, offset + length)
+            if offset - merged_end <= max_gap and end - merged_offset <= max_size:
+                merged[-1] = (merged_offset, end - merged_offset)
+                continue
+        merged.append((offset, length))
+    return merged
+
 
 class FileHandle:
     @abstractmethod
@@ -52,19 +83,51 @@ class FileHandle:
 
 
 class SFTPFileHandle(FileHandle):
-    def __init__(self, fh, name, flag):
+    def __init__(
+        self,
+        fh,
+        name,
+        flag,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        block_cache=None,
+        on_close=None,
+        throttle=None,
+    ):
         """
         :param fh: Expects a PySFTPHandle
+        :param chunk_size: amount of bytes that are requested at a time
+        when the file is read line by line
+        :param block_cache: optional BlockCache that reads are served from
+        :param on_close: optional function that is called once the handle is closed
+        :param throttle: optional function that is called with the amount of bytes
+        that have been read from or written to the remote end, which might
+        block to limit the transfer rate
         """
         self.fh = fh
         self.name = name
         self.flag = flag
+        self.chunk_size = chunk_size
+        self.block_cache = block_cache
+        self.on_close = on_close
+        self.throttle = throttle
+        # (mtime, filesize) of the remote file, used to key cached blocks
+        self._cache_identity = None
+        # Content that has been read from the remote end but not yet
+        # returned, bytes in binary mode and decoded str in text mode, which starts
+        # at _buffer_start such that returning a line does not copy the rest
+        self._buffer = self._empty_buffer()
+        self._buffer_start = 0
+        self._decoder = None
+        self._encoding = None
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        return self.read()
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
 
     def __enter__(self):
         return self
@@ -72,12 +135,168 @@ class SFTPFileHandle(FileHandle):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    def _is_binary(self):
+        return "b" in self.flag
+
+    def _empty_buffer(self):
+        if self._is_binary():
+            return b""
+        return ""
+
+    def _get_decoder(self, encoding="utf-8"):
+        """Get the incremental decoder used in text mode, which keeps
+        multibyte characters that are split across chunks intact.
+        """
+        if self._decoder is None or self._encoding != encoding:
+            self._decoder = codecs.getincrementaldecoder(encoding)()
+            self._encoding = encoding
+        return self._decoder
+
+    def _reset_buffer(self):
+        self._buffer = self._empty_buffer()
+        self._buffer_start = 0
+        if self._decoder is not None:
+            self._decoder.reset()
+
+    def _pending_size(self):
+        """
+        :return: the amount of bytes that have been read from the remote end
+        but not yet returned to the caller
+        """
+        if self._is_binary():
+            return self._buffered_size()
+        size = 0
+        if self._buffered_size():
+            size += len(self._buffer[self._buffer_start :].encode(self._encoding))
+        if self._decoder is not None:
+            size += len(self._decoder.getstate()[0])
+        return size
+
+    def _buffered_size(self):
+        """
+        :return: the amount of items in the read buffer that have not been returned
+        """
+        return len(self._buffer) - self._buffer_start
+
+    def _take_buffer(self, n=-1):
+        """Remove and return up to n items from the read buffer
+        :param n: the maximum amount of items to return, -1 returns everything
+        """
+        start = self._buffer_start
+        if n == -1 or n >= self._buffered_size():
+            data = self._buffer[start:]
+            self._buffer, self._buffer_start = self._empty_buffer(), 0
+        else:
+            data = self._buffer[start : start + n]
+            self._buffer_start += n
+        return data
+
+    def _fill_buffer(self, encoding="utf-8"):
+        """Read the next chunk from the remote end into the read buffer
+        :return: False if the end of the file has been reached, True otherwise
+        """
+        chunk = self._read_raw(self.chunk_size)
+        if self._buffer_start:
+            # The returned items are dropped once per chunk instead of per take
+            self._buffer = self._buffer[self._buffer_start :]
+            self._buffer_start = 0
+        if not chunk:
+            if not self._is_binary() and self._decoder is not None:
+                self._buffer += self._decoder.decode(b"", final=True)
+            return False
+        if self._is_binary():
+            self._buffer += chunk
+        else:
+            self._buffer += self._get_decoder(encoding).decode(chunk)
+        return True
+
+    def _read_raw(self, n=-1):
+        """
+        :param n: amount of bytes to be read, defaults to the rest of the file
+        :return: the bytes read from the remote end, bypassing the read buffer
+        """
+        if self.block_cache is not None:
+            return self._read_cached(n)
+        return self._read_remote(n)
+
+    def _read_remote(self, n=-1):
+        """
+        :param n: amount of bytes to be read, defaults to the rest of the file
+        :return: the bytes read directly from the remote handle
+        """
+        data = []
+        if n != -1:
+            remaining = n
+            while remaining > 0:
+                # 1, because pysftphandle returns an array -> 1 = data
+                size, chunk = self.fh.read(remaining)
+                if size <= 0:
+                    break
+                data.append(chunk)
+                remaining -= size
+                if self.throttle is not None:
+                    self.throttle(size)
+        else:
+            for size, chunk in self.fh:
+                data.append(chunk)
+                if self.throttle is not None:
+                    self.throttle(size)
+        return b"".join(data)
+
+    def _get_cache_identity(self):
+        if self._cache_identity is None:
+            file_stat = self.fh.fstat()
+            self._cache_identity = (file_stat.mtime, file_stat.filesize)
+        return self._cache_identity
+
+    def _read_block(self, block_index):
+        """
+        :param block_index: the index of the aligned block to be read
+        :return: the block, from the cache if present, otherwise from the remote end
+        """
+        mtime, filesize = self._get_cache_identity()
+        key = self.block_cache.make_key(self.name, block_index, mtime, filesize)
+        block = self.block_cache.get(key)
+        if block is None:
+            self.fh.seek64(block_index * self.block_cache.block_size)
+            block = self._read_remote(self.block_cache.block_size)
+            self.block_cache.put(key, block)
+        return block
+
+    def _read_cached(self, n=-1):
+        """
+        :param n: amount of bytes to be read, defaults to the rest of the file
+        :return: the bytes read through the block cache
+        """
+        _, filesize = self._get_cache_identity()
+        block_size = self.block_cache.block_size
+        position = self.fh.tell64()
+        end = filesize if n == -1 else min(position + n, filesize)
+
+        data = []
+        while position < end:
+            block_index, block_offset = divmod(position, block_size)
+            block = self._read_block(block_index)
+            block_end = block_offset + end - position
+            chunk = block[block_offset:block_end]
+            if not chunk:
+                break
+            data.append(chunk)
+            position += len(chunk)
+        self.fh.seek64(position)
+        return b"".join(data)
+
     def close(self):
         """
         Close the passed PySFTPHandles
         :return: None
         """
-        self.fh.close()
+        try:
+            self.fh.close()
+        finally:
+            if self.on_close is not None:
+                on_close, self.on_close = self.on_close, None
+                on_close()
 
     def fsetstat(self, attributes):
         """
@@ -109,14 +328,74 @@ class SFTPFileHandle(FileHandle):
 
     def read(self, n=-1, encoding="utf-8"):
         """
-        :param n: amount of bytes to be read, defaults to the entire file
+        :param n: amount of bytes in binary mode or characters in text mode
+        to be read, defaults to the entire file
         :return: the content of path, decoded to utf-8 string
         """
         assert "r" in self.flag
-        if "b" in self.flag:
+        if self._is_binary():
             return self.read_binary(n)
-        else:
-            return self.read_binary(n).decode(encoding)
+
+        decoder = self._get_decoder(encoding)
+        data = self._take_buffer(n)
+        if n == -1:
+            return data + decoder.decode(self._read_raw(), final=True)
+
+        while len(data) < n:
+            # Every missing character requires at least one more byte
+            chunk = self._read_raw(n - len(data))
+            if not chunk:
+                data += decoder.decode(b"", final=True)
+                break
+            data += decoder.decode(chunk)
+        return data
+
+    def readline(self, size=-1, encoding="utf-8"):
+        """Read until the next newline, only a chunk of the
+        file is kept in memory at a time.
+        :param size: the maximum amount of bytes in binary mode or
+        characters in text mode to be returned
+        :return: the line including the newline, empty at the end of the file
+        """
+        assert "r" in self.flag
+        newline = b"\n" if self._is_binary() else "\n"
+        # Relative to the start of the buffer, which moves when it is filled
+        search_start = 0
+        while True:
+            newline_index = self._buffer.find(
+                newline, self._buffer_start + search_start
+            )
+            if newline_index != -1:
+                end = newline_index + 1 - self._buffer_start
+                break
+            if size >= 0 and self._buffered_size() >= size:
+                end = size
+                break
+            search_start = self._buffered_size()
+            if not self._fill_buffer(encoding):
+                end = self._buffered_size()
+                break
+        if size >= 0:
+            end = min(end, size)
+        return self._take_buffer(end)
+
+    def readlines(self, hint=-1, encoding="utf-8"):
+        """
+        :param hint: stop once the total size of the lines read
+        exceeds hint, -1 reads every line
+        :return: list of lines
+        """
+        lines = []
+        total_size = 0
+        while True:
+            line = self.readline(encoding=encoding)
+            if not line:
+                break
+            lines.append(line)
+            total_size += len(line)
+            if 0 < hint <= total_size:
+                break
+        return lines
 
     def write(self, data, encoding="utf-8"):
         """
@@ -126,14 +405,18 @@ class SFTPFileHandle(FileHandle):
         :return: None
         """
         assert "w" in self.flag or "a" in self.flag
+        if self.block_cache is not None:
+            self.block_cache.invalidate(self.name)
         if isinstance(data, str):
             data = bytes(data, encoding=encoding)
-            return self.fh.write(data)
-        if isinstance(data, bytearray):
-            return self.fh.write(bytes(data))
-        if not isinstance(data, bytes):
+        elif isinstance(data, bytearray):
+            data = bytes(data)
+        elif not isinstance(data, bytes):
             raise TypeError("data must be bytes before it can be written")
-        return self.fh.write(data)
+        result = self.fh.write(data)
+        if self.throttle is not None:
+            self.throttle(len(data))
+        return result
 
     def seek(self, offset, whence=0):
         """Seek file to a given offset
@@ -147,29 +430,66 @@ class SFTPFileHandle(FileHandle):
             self.fh.seek64(offset)
         if whence == 1:
             # Seek relative to the current position
-            current_offset = self.fh.tell64()
-            self.fh.seek(current_offset + offset)
+            current_offset = self.tell()
+            self.fh.seek64(current_offset + offset)
         if whence == 2:
             file_stat = self.fh.fstat()
             # Seek relative to the file end
-            self.fh.seek(file_stat.filesize + offset)
+            self.fh.seek64(file_stat.filesize + offset)
+        # The buffered content no longer follows the current position
+        self._reset_buffer()
 
     def read_binary(self, n=-1):
         """
         :param n: amount of bytes to be read
         :return: a binary string of the content within in file
         """
-        data = []
-        if n != -1:
-            # 1, because pysftphandle returns an array -> 1 = data
-            data.append(self.fh.read(n)[1])
-        else:
-            for size, chunk in self.fh:
-                data.append(chunk)
-        return b"".join(data)
+        if self._is_binary():
+            data = self._take_buffer(n)
+            if n == -1:
+                return data + self._read_raw()
+            return data + self._read_raw(n - len(data))
+
+        if self._pending_size() > 0:
+            # Rewind past the decoded content that has not been returned yet
+            self.seek(self.tell())
+        return self._read_raw(n)
+
+    def read_ranges(
+        self, ranges, max_gap=DEFAULT_RANGE_GAP, max_size=DEFAULT_MAX_RANGE_READ
+    ):
+        """Read multiple byte ranges, where nearby ranges are merged into
+        larger reads that libssh2 keeps multiple requests in flight for.
+        The current file position is left unchanged.
+        :param ranges: list of (offset, length) tuples
+        :param max_gap: ranges closer than this amount of bytes are read together
+        :param max_size: the maximum size of a merged read
+        :return: list of bytes, in the same order as ranges
+        """
+        assert "r" in self.flag
+        # The read buffer is left as is, restoring the remote position
+        # keeps it aligned with the buffered content
+        remote_position = self.fh.tell64()
+        fetched = []
+        for offset, length in merge_ranges(ranges, max_gap=max_gap, max_size=max_size):
+            self.fh.seek64(offset)
+            fetched.append((offset, self._read_raw(length)))
+        self.fh.seek64(remote_position)
+
+        fetched_offsets = [offset for offset, _ in fetched]
+        results = []
+        for offset, length in ranges:
+            if length <= 0:
+                results.append(b"")
+                continue
+            index = bisect.bisect_right(fetched_offsets, offset) - 1
+            fetched_offset, data = fetched[index]
+            start = offset - fetched_offset
+            results.append(data[start:][:length])
+        return results
 
     def tell(self):
         """Get the current file handle offset
         :return: int
         """
-        return self.fh.tell64()
+        return self.fh.tell64() - self._pending_size()
@@ -0,0 +1,397 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from ssh2.sftp import (
+    LIBSSH2_SFTP_ATTR_ACMODTIME,
+    LIBSSH2_SFTP_ATTR_PERMISSIONS,
+    LIBSSH2_SFTP_ATTR_SIZE,
+)
+from ssh2.sftp_handle import SFTPAttributes
+from deling.io.datastores.tree import DirectoryState
+
+ManifestEntry = namedtuple(
+    "ManifestEntry",
+    [
+        "path",
+        "size",
+        "mtime",
+        "mode",
+        "hash",
+        "hash_algorithm",
+        "created",
+        "updated",
+        "deleted",
+    ],
+)
+
+ENTRY_COLUMNS = ", ".join(ManifestEntry._fields)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime INTEGER,
+    mode INTEGER,
+    read_time REAL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER,
+    mtime INTEGER,
+    mode INTEGER,
+    hash TEXT,
+    hash_algorithm TEXT,
+    created REAL,
+    updated REAL,
+    deleted REAL
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+CREATE INDEX IF NOT EXISTS entries_updated ON entries (updated);
+CREATE INDEX IF NOT EXISTS entries_deleted ON entries (deleted);
+"""
+
+
+def make_attributes(size, mtime, mode):
+    attributes = SFTPAttributes()
+    attributes.flags = (
+        LIBSSH2_SFTP_ATTR_SIZE
+        | LIBSSH2_SFTP_ATTR_PERMISSIONS
+        | LIBSSH2_SFTP_ATTR_ACMODTIME
+    )
+    attributes.filesize = size
+    attributes.mtime = mtime
+    attributes.atime = mtime
+    attributes.permissions = mode
+    return attributes
+
+
+class RemoteManifest:
+    def __init__(self, database_path, root):
+        """A local index of the entries below a remote directory, which is kept
+        up to date with SFTPStore.refresh_manifest. Only the directories whose
+        modification time has changed are read again when it is refreshed.
+        Removed entries are kept with their deletion time until they are purged.
+        :param database_path: path to the local SQLite database,
+        which is created if it does not exist
+        :param root: the remote directory that the manifest describes
+        """
+        self.database_path = database_path
+        self.root = root
+        # The directory states are read by the threads that refresh the manifest
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock:
+            self._connection.executescript(SCHEMA)
+            columns = [
+                row[1]
+                for row in self._connection.execute("PRAGMA table_info(directories)")
+            ]
+            if "read_time" not in columns:
+                # A manifest that was created before the read times were recorded
+                self._connection.execute(
+                    "ALTER TABLE directories ADD COLUMN read_time REAL"
+                )
+            self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self._query_one("SELECT COUNT(*) FROM entries WHERE deleted IS NULL")[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
+
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+
+    def _query(self, query, parameters=()):
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    def _query_one(self, query, parameters=()):
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchone()
+
+    @staticmethod
+    def _below(path):
+        """
+        :return: the SQL condition and parameters that select the paths below path
+        """
+        prefix = path.rstrip(os.sep) + os.sep
+        return "substr(path, 1, ?) = ?", (len(prefix), prefix)
+
+    def entry(self, path):
+        """
+        :param path: the absolute remote path of the entry
+        :return: ManifestEntry, or None if the path is not in the manifest
+        """
+        row = self._query_one(
+            "SELECT {} FROM entries WHERE path = ?".format(ENTRY_COLUMNS), (path,)
+        )
+        if row is None:
+            return None
+        return ManifestEntry(*row)
+
+    def entries(self, path=None, include_deleted=False):
+        """
+        :param path: only include the entries below this absolute remote path
+        :param include_deleted: include the entries that have been removed
+        :return: list of ManifestEntry ordered by path
+        """
+        conditions, parameters = [], ()
+        if path is not None:
+            condition, parameters = self._below(path)
+            conditions.append(condition)
+        if not include_deleted:
+            conditions.append("deleted IS NULL")
+        query = "SELECT {} FROM entries".format(ENTRY_COLUMNS)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY path"
+        return [ManifestEntry(*row) for row in self._query(query, parameters)]
+
+    def changes(self, since):
+        """
+        :param since: timestamp of the earliest change that is included
+        :return: list of ManifestEntry that have been created, modified or
+        removed since the timestamp, where removed entries have deleted set
+        """
+        return [
+            ManifestEntry(*row)
+            for row in self._query(
+                "SELECT {} FROM entries WHERE updated >= ? OR deleted >= ? "
+                "ORDER BY path".format(ENTRY_COLUMNS),
+                (since, since),
+            )
+        ]
+
+    def missing_hashes(self, algorithm, path=None):
+        """
+        :return: list of the paths of the files that have no hash of algorithm
+        """
+        query = (
+            "SELECT path FROM entries WHERE deleted IS NULL AND is_dir = 0 "
+            "AND (hash IS NULL OR hash_algorithm != ?)"
+        )
+        parameters = (algorithm,)
+        if path is not None:
+            condition, below = self._below(path)
+            query += " AND " + condition
+            parameters += below
+        return [row[0] for row in self._query(query + " ORDER BY path", parameters)]
+
+    def set_hash(self, path, digest, algorithm):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE entries SET hash = ?, hash_algorithm = ? WHERE path = ?",
+                (digest, algorithm, path),
+            )
+
+    def purge_deleted(self, before=None):
+        """Remove the entries that were deleted before the timestamp
+        :param before: timestamp, defaults to every deleted entry
+        """
+        if before is None:
+            before = float("inf")
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM entries WHERE deleted IS NOT NULL AND deleted < ?",
+                (before,),
+            )
+            self._connection.commit()
+
+    def expire(self, path):
+        """Force the directories below path, path included, to be read again
+        on the next refresh, such that modified file contents are detected
+        :param path: the absolute remote path of the directory
+        """
+        condition, parameters = self._below(path)
+        with self._lock:
+            self._connection.execute(
+                "UPDATE directories SET mtime = NULL WHERE path = ? OR " + condition,
+                (path,) + parameters,
+            )
+
+    @property
+    def tree(self):
+        """
+        :return: a DirectoryTree compatible view of the manifest
+        """
+        return ManifestTree(self)
+
+
+class ManifestTree:
+    def __init__(self, manifest):
+        """The directory states of a RemoteManifest, used to refresh it"""
+        self.manifest = manifest
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def get(self, path):
+        manifest = self.manifest
+        row = manifest._query_one(
+            "SELECT size, mtime, mode, read_time FROM directories WHERE path = ?",
+            (path,),
+        )
+        # An expired directory is read again as if it was new
+        if row is None or row[1] is None:
+            return None
+        files, directories = {}, {}
+        for name, is_dir, size, mtime, mode in manifest._query(
+            "SELECT name, is_dir, size, mtime, mode FROM entries "
+            "WHERE parent = ? AND deleted IS NULL",
+            (path,),
+        ):
+            entries = directories if is_dir else files
+            entries[name] = make_attributes(size, mtime, mode)
+        size, mtime, mode, read_time = row
+        if read_time is None:
+            # The directory is read again when it is not known whether it was
+            # read after the second that it was last modified in
+            read_time = float("-inf")
+        return DirectoryState(
+            make_attributes(size, mtime, mode), files, directories, read_time=read_time
+        )
+
+    def put(self, path, state):
+        """Record the state of the directory, where the entries that
+        have changed since the previous state are marked as updated
+        """
+        now = time.time()
+        manifest = self.manifest
+        with manifest._lock:
+            connection = manifest._connection
+            connection.execute(
+                "INSERT OR REPLACE INTO directories (path, size, mtime, mode, "
+                "read_time) VALUES (?, ?, ?, ?, ?)",
+                (
+                    path,
+                    state.attributes.filesize,
+                    state.attributes.mtime,
+                    state.attributes.permissions,
+                    state.read_time,
+                ),
+            )
+            existing = {
+                name: (size, mtime, mode, deleted)
+                for name, size, mtime, mode, deleted in connection.execute(
+                    "SELECT name, size, mtime, mode, deleted FROM entries "
+                    "WHERE parent = ?",
+                    (path,),
+                )
+            }
+            for is_dir, entries in ((1, state.directories), (0, state.files)):
+                for name, attributes in entries.items():
+                    current = (
+                        attributes.filesize,
+                        attributes.mtime,
+                        attributes.permissions,
+                    )
+                    previous = existing.pop(name, None)
+                    if previous is None or previous[3] is not None:
+                        connection.execute(
+                            "INSERT OR REPLACE INTO entries (path, parent, name, "
+                            "is_dir, size, mtime, mode, created, updated) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (os.path.join(path, name), path, name, is_dir)
+                            + current
+                            + (now, now),
+                        )
+                    elif is_dir and previous[:3] != current:
+                        # The modification time of a directory changes with its
+                        # entries, which are tracked themselves
+                        entry_path = os.path.join(path, name)
+                        connection.execute(
+                            "UPDATE entries SET is_dir = 1, size = ?, mtime = ?, "
+                            "mode = ? WHERE path = ?",
+                            current + (entry_path,),
+                        )
+                        if previous[2] != current[2]:
+                            connection.execute(
+                                "UPDATE entries SET updated = ? WHERE path = ?",
+                                (now, entry_path),
+                            )
+                    elif previous[:3] != current:
+                        # The content might have changed, so the hash is unknown
+                        connection.execute(
+                            "UPDATE entries SET is_dir = 0, size = ?, mtime = ?, "
+                            "mode = ?, hash = NULL, hash_algorithm = NULL, "
+                            "updated = ? WHERE path = ?",
+                            current + (now, os.path.join(path, name)),
+                        )
+            removed = [
+                os.path.join(path, name)
+                for name, previous in existing.items()
+                if previous[3] is None
+            ]
+            connection.executemany(
+                "UPDATE entries SET deleted = ? WHERE path = ?",
+                [(now, removed_path) for removed_path in removed],
+            )
+
+    def discard(self, path, recursive=False):
+        """Forget the directory, where its entries are marked as deleted"""
+        now = time.time()
+        manifest = self.manifest
+        condition, parameters = manifest._below(path)
+        with manifest._lock:
+            connection = manifest._connection
+            if recursive:
+                connection.execute(
+                    "DELETE FROM directories WHERE path = ? OR " + condition,
+                    (path,) + parameters,
+                )
+                connection.execute(
+                    "UPDATE entries SET deleted = ? WHERE deleted IS NULL AND "
+                    + condition,
+                    (now,) + parameters,
+                )
+            else:
+                connection.execute("DELETE FROM directories WHERE path = ?", (path,))
+                connection.execute(
+                    "UPDATE entries SET deleted = ? "
+                    "WHERE deleted IS NULL AND parent = ?",
+                    (now, path),
+                )
+
+    def paths(self, root):
+        manifest = self.manifest
+        condition, parameters = manifest._below(root)
+        return [
+            row[0]
+            for row in manifest._query(
+                "SELECT path FROM directories WHERE path = ? OR " + condition,
+                (root,) + parameters,
+            )
+        ]
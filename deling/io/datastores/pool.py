@@ -0,0 +1,199 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import threading
+from contextlib import contextmanager
+from ssh2.exceptions import SFTPProtocolError
+from deling.clients.ssh import SSHClient, CHANNEL_TYPE_SFTP
+
+DEFAULT_POOL_SIZE = 8
+
+
+def is_request_error(error):
+    """
+    :param error: the exception that was raised while a connection was used
+    :return: whether the error is the response of the server to a failed request,
+    e.g. a missing path, after which the connection can still be used
+    """
+    while error is not None:
+        if isinstance(error, SFTPProtocolError):
+            return True
+        error = error.__cause__
+    return False
+
+
+class SFTPConnection:
+    def __init__(self, host, port, authenticator):
+        """An additional SSH connection with its own SFTP channel,
+        which can be used independently of other connections to the host.
+        """
+        self.ssh_client = SSHClient(host, authenticator, port=port)
+        if not self.ssh_client.connect():
+            raise ConnectionError("Could not connect to the server")
+        if not self.ssh_client.open_channel(channel_type=CHANNEL_TYPE_SFTP):
+            self.ssh_client.disconnect()
+            raise ConnectionError("Could not open an SFTP channel")
+        self.sftp_channel = self.ssh_client.get_channel(CHANNEL_TYPE_SFTP)
+
+    def is_connected(self):
+        return self.ssh_client.is_socket_connected()
+
+    def disconnect(self):
+        if self.ssh_client:
+            self.ssh_client.disconnect()
+        self.sftp_channel = None
+
+
+class SFTPConnectionPool:
+    def __init__(self, host, port, authenticator, max_size=DEFAULT_POOL_SIZE):
+        """A pool of SFTP connections that are created on demand
+        and reused once they are released.
+        :param max_size: the maximum amount of connections that are
+        opened at the same time
+        """
+        self.host = host
+        self.port = port
+        self.authenticator = authenticator
+        self.max_size = max_size
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def acquire(self, timeout=None):
+        """
+        :param timeout: seconds to wait for a connection to be released
+        when the pool is exhausted, None waits indefinitely
+        :return: SFTPConnection
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise ConnectionError("The connection pool has been closed")
+                if self.max_size < 1:
+                    # No connection would ever be released to wait for
+                    raise ConnectionError("The connection pool has no connections")
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if not self._condition.wait(timeout=timeout):
+                    raise TimeoutError("No connection was released within the timeout")
+
+        # Connect outside of the lock, such that other connections
+        # can be acquired and released in the meantime
+        try:
+            return SFTPConnection(self.host, self.port, self.authenticator)
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, connection, discard=False):
+        """
+        :param connection: a SFTPConnection that was acquired from the pool
+        :param discard: disconnect the connection instead of reusing it
+        """
+        with self._condition:
+            if discard or self._closed or not connection.is_connected():
+                self._size -= 1
+                connection.disconnect()
+            else:
+                self._idle.append(connection)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        connection = self.acquire(timeout=timeout)
+        try:
+            yield connection
+        except BaseException as err:
+            # The protocol state is unknown after a failure, unless the server
+            # has responded to the failed request
+            self.release(connection, discard=not is_request_error(err))
+            raise
+        else:
+            self.release(connection)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            connection.disconnect()
+
+
+class ThreadCheckout:
+    def __init__(self, pool):
+        """Lends the connections of a SFTPConnectionPool to threads, where the
+        nested checkouts of a thread share a single connection, which is
+        returned to the pool once the outermost checkout is released.
+        """
+        self.pool = pool
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def current(self):
+        """
+        :return: the SFTPConnection that is checked out by the current thread,
+        or None
+        """
+        hold = getattr(self._local, "hold", None)
+        if hold is None:
+            return None
+        return hold[0]
+
+    def acquire(self, timeout=None):
+        """
+        :param timeout: seconds to wait for a connection of the pool
+        :return: function that releases the checkout, which might be called
+        by another thread, e.g. when a file handle is closed
+        """
+        hold = getattr(self._local, "hold", None)
+        with self._lock:
+            if hold is not None and hold[1] > 0:
+                hold[1] += 1
+            else:
+                hold = None
+        if hold is None:
+            hold = [self.pool.acquire(timeout=timeout), 1]
+            self._local.hold = hold
+        released = False
+
+        def release():
+            nonlocal released
+            with self._lock:
+                if released:
+                    return
+                released = True
+                hold[1] -= 1
+                if hold[1] > 0:
+                    return
+                connection, hold[0] = hold[0], None
+            self.pool.release(connection)
+
+        return release
@@ -0,0 +1,178 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import pickle
+import threading
+from deling.io.datastores.core import SFTPStore
+from deling.io.datastores.throttle import TRAFFIC_CLASSES
+
+# The stores that have been connected by StoreSpec.get_store in this process
+_process_stores = {}
+_process_stores_pid = os.getpid()
+_process_stores_lock = threading.Lock()
+
+
+def authenticator_identity(authenticator):
+    """
+    :param authenticator: the authenticator of a StoreSpec
+    :return: the type and credentials of the authenticator, which unlike the
+    authenticator itself do not change when it is prepared
+    """
+    credentials = getattr(authenticator, "credentials", None)
+    if credentials is None:
+        return authenticator
+    return type(authenticator), credentials
+
+
+def normalize_key_value(value):
+    """
+    :param value: a keyword argument of a StoreSpec
+    :return: the value in a form that pickles the same for equal values,
+    such as 1 and 1.0 or dicts with a different insertion order
+    """
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return sorted(
+            ((key, normalize_key_value(item)) for key, item in value.items()),
+            key=lambda pair: repr(pair[0]),
+        )
+    if isinstance(value, (list, tuple)):
+        return type(value)(normalize_key_value(item) for item in value)
+    return value
+
+
+class StoreSpec:
+    def __init__(self, host, port, authenticator, store_class=SFTPStore, **kwargs):
+        """A picklable description of how to connect a store, which can be sent
+        to the workers of a process pool in place of the store itself.
+        :param host: the host of the store
+        :param port: the port of the store
+        :param authenticator: the authenticator that the store is connected with,
+        which must be picklable, such as SSHAuthenticator
+        :param store_class: the SFTPStore class that is connected
+        :param kwargs: the additional keyword arguments of store_class,
+        such as pool_size and allow_exec, which must be picklable. Objects that
+        belong to a process, such as a scheduler or cache, are not
+        """
+        for name, value in kwargs.items():
+            try:
+                pickle.dumps(value)
+            except Exception as err:
+                raise ValueError(
+                    "The keyword argument {} of a StoreSpec must be picklable, "
+                    "is: {!r}".format(name, value)
+                ) from err
+
+        self.host = host
+        self.port = port
+        self.authenticator = authenticator
+        self.store_class = store_class
+        self.kwargs = kwargs
+        # The store prepares the authenticator when it is connected,
+        # which must not change the key of the spec
+        self._key = pickle.dumps(
+            (
+                self.store_class,
+                self.host,
+                str(self.port),
+                authenticator_identity(self.authenticator),
+                normalize_key_value(self.kwargs),
+            )
+        )
+
+    @classmethod
+    def from_store(cls, store):
+        """
+        :param store: a connected SFTPStore
+        :return: StoreSpec that connects to the same host with the same
+        authenticator and options as store
+        """
+        rate_limits = {
+            traffic: store.throttle.rate(traffic)
+            for traffic in TRAFFIC_CLASSES
+            if store.throttle.rate(traffic) is not None
+        }
+        return cls(
+            store.host,
+            store.port,
+            store.authenticator,
+            pool_size=store.pool.max_size,
+            allow_exec=store.allow_exec,
+            rate_limits=rate_limits,
+        )
+
+    def __repr__(self):
+        return "{}(host={!r}, port={!r}, store_class={})".format(
+            type(self).__name__, self.host, self.port, self.store_class.__name__
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, StoreSpec):
+            return NotImplemented
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    @property
+    def key(self):
+        """
+        :return: bytes that are equal for specs that connect the same store,
+        also when they have been unpickled separately
+        """
+        return self._key
+
+    def connect(self):
+        """
+        :return: a new connected store
+        """
+        return self.store_class(self.host, self.port, self.authenticator, **self.kwargs)
+
+    def get_store(self):
+        """Get the store of the spec that has been connected in the current process,
+        where the store is connected on first use and reconnected if it has been
+        disconnected. The store can be shared by the threads of the process.
+        :return: the connected store
+        """
+        global _process_stores_pid
+        key = self.key
+        with _process_stores_lock:
+            if _process_stores_pid != os.getpid():
+                # The stores that are inherited from the parent process share its
+                # sockets, which the stores do not disconnect outside of the parent
+                _process_stores.clear()
+                _process_stores_pid = os.getpid()
+            store = _process_stores.get(key)
+            if store is not None and store.is_connected():
+                return store
+            store = self.connect()
+            _process_stores[key] = store
+            return store
+
+
+def close_stores():
+    """Disconnect the stores that have been connected by StoreSpec.get_store
+    in the current process, e.g. when a worker process is shut down
+    """
+    with _process_stores_lock:
+        stores = list(_process_stores.values())
+        _process_stores.clear()
+    if _process_stores_pid != os.getpid():
+        return
+    for store in stores:
+        store.disconnect()
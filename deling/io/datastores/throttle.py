@@ -0,0 +1,142 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import threading
+import time
+
+# Transfers such as upload and download, and reads and writes through open
+TRAFFIC_BULK = "bulk"
+TRAFFIC_INTERACTIVE = "interactive"
+TRAFFIC_CLASSES = (TRAFFIC_BULK, TRAFFIC_INTERACTIVE)
+# The amount of seconds of traffic that can be sent at once after being idle
+DEFAULT_BURST_SECONDS = 0.5
+# Shorter waits are carried over as debt until they add up, such that
+# small reads and writes are not each followed by a sleep
+MIN_SLEEP = 0.05
+
+
+class TokenBucket:
+    def __init__(self, rate=None, burst=None):
+        """
+        :param rate: the amount of bytes per second, None is unlimited
+        :param burst: the amount of bytes that can be consumed at once,
+        defaults to DEFAULT_BURST_SECONDS of the rate
+        """
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._time = time.monotonic()
+        self.rate = None
+        self.burst = None
+        self.set_rate(rate, burst=burst)
+
+    def set_rate(self, rate, burst=None):
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be larger than 0: {}".format(rate))
+        if burst is None and rate is not None:
+            burst = rate * DEFAULT_BURST_SECONDS
+        with self._lock:
+            self.rate = rate
+            self.burst = burst
+            # The debt of earlier transfers is kept
+            if self._tokens is None or burst is None:
+                self._tokens = burst
+            else:
+                self._tokens = min(self._tokens, burst)
+            self._time = time.monotonic()
+
+    def consume(self, amount):
+        """
+        :param amount: the amount of bytes that have been transferred
+        :return: the amount of seconds to wait before more is transferred
+        """
+        if self.rate is None:
+            return 0.0
+        with self._lock:
+            if self.rate is None:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._time) * self.rate
+            )
+            self._time = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class Throttle:
+    def __init__(self, rates=None):
+        """A separate TokenBucket for each class of traffic
+        :param rates: dict of the bytes per second of each traffic class
+        """
+        self._buckets = {traffic: TokenBucket() for traffic in TRAFFIC_CLASSES}
+        for traffic, rate in (rates or {}).items():
+            self.set_rate(rate, traffic=traffic)
+
+    def _bucket(self, traffic):
+        if traffic not in self._buckets:
+            raise ValueError(
+                "traffic must be one of {}, is: {}".format(TRAFFIC_CLASSES, traffic)
+            )
+        return self._buckets[traffic]
+
+    def rate(self, traffic=TRAFFIC_BULK):
+        """
+        :return: the bytes per second of traffic, or None if it is unlimited
+        """
+        return self._bucket(traffic).rate
+
+    def set_rate(self, rate, traffic=TRAFFIC_BULK, burst=None):
+        """Change the rate, which takes effect for the transfers in progress
+        :param rate: bytes per second, None removes the limit
+        :param traffic: the traffic class that is limited
+        :param burst: the amount of bytes that can be transferred at once
+        """
+        self._bucket(traffic).set_rate(rate, burst=burst)
+
+    def consume(self, amount, traffic=TRAFFIC_BULK):
+        return self._bucket(traffic).consume(amount)
+
+
+# Applies to every store of the process
+PROCESS_THROTTLE = Throttle()
+_host_throttles = {}
+_host_throttles_lock = threading.Lock()
+
+
+def host_throttle(host):
+    """
+    :param host: the host that the throttle applies to
+    :return: the Throttle that is shared by every store of host in the process
+    """
+    with _host_throttles_lock:
+        throttle = _host_throttles.get(host)
+        if throttle is None:
+            throttle = _host_throttles[host] = Throttle()
+        return throttle
+
+
+def throttle_transfer(amount, traffic, throttles):
+    """Account for a transfer in every throttle, where the caller sleeps
+    until the amount is within the rate of the slowest of them
+    :param amount: the amount of bytes that have been transferred
+    :param traffic: the traffic class of the transfer
+    :param throttles: list of Throttle
+    """
+    wait = max(throttle.consume(amount, traffic=traffic) for throttle in throttles)
+    if wait >= MIN_SLEEP:
+        time.sleep(wait)
@@ -0,0 +1,222 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+# size is the apparent size in bytes and files the amount of entries,
+# including the directories themselves, equivalent to du -b and du --inodes
+DiskUsage = namedtuple("DiskUsage", ["size", "files"])
+
+EVENT_CREATED = "created"
+EVENT_MODIFIED = "modified"
+EVENT_DELETED = "deleted"
+# A change to an entry of a watched directory, where attributes is None
+# for entries that have been deleted
+WatchEvent = namedtuple("WatchEvent", ["kind", "path", "is_dir", "attributes"])
+
+
+class DirectoryState:
+    __slots__ = ("attributes", "files", "directories", "read_time")
+
+    def __init__(self, attributes, files, directories, read_time=None):
+        """The content of a directory as it was when the directory was read
+        :param attributes: ssh2.sftp.SFTPAttributes of the directory itself
+        :param files: dict of the name and attributes of every non-directory entry
+        :param directories: dict of the name and attributes of every subdirectory
+        :param read_time: the earliest time of the server clock at which
+        the directory can have been read, see ServerClock
+        """
+        self.attributes = attributes
+        self.files = files
+        self.directories = directories
+        self.read_time = read_time
+
+    @property
+    def mtime(self):
+        return self.attributes.mtime
+
+    def is_settled(self):
+        """
+        :return: False if the directory might have been read within the same second
+        of the server clock as it was last modified, in which case later changes
+        in that second would not change its modification time
+        """
+        return self.read_time is None or self.read_time >= self.mtime + 1
+
+
+class ServerClock:
+    def __init__(self):
+        """Estimates the time of the server clock, which the modification times are
+        set by, without relying on the local clock being in sync with it.
+        Since a modification time is never ahead of the server clock at the time
+        it is seen, the latest modification time that has been seen, plus the local
+        time that has passed since, is a lower bound of the server time.
+        """
+        # The lower bound of the server time minus the local monotonic time
+        self._offset = None
+        self._lock = threading.Lock()
+
+    def observe(self, mtime):
+        """
+        :param mtime: a modification time that has just been received from the server
+        """
+        offset = mtime - time.monotonic()
+        with self._lock:
+            if self._offset is None or offset > self._offset:
+                self._offset = offset
+
+    def now(self):
+        """
+        :return: the lower bound of the current server time,
+        or None if no modification time has been observed yet
+        """
+        if self._offset is None:
+            return None
+        return time.monotonic() + self._offset
+
+
+def _entry_changed(previous, current, is_dir):
+    if (previous.permissions & 0o7777) != (current.permissions & 0o7777):
+        return True
+    # The modification time of a directory changes with its entries
+    if is_dir:
+        return False
+    return previous.filesize != current.filesize or previous.mtime != current.mtime
+
+
+def diff_states(previous, state):
+    """Compare two states of the same directory
+    :param previous: the earlier DirectoryState, or None if the directory is new
+    :param state: the current DirectoryState, or None if the directory is removed
+    :return: generator of (kind, name, is_dir, attributes) for every entry that
+    has been created, modified or deleted, where an entry that changes between
+    a file and a directory is both deleted and created
+    """
+    before, after = {}, {}
+    if previous is not None:
+        before.update((name, (False, attrs)) for name, attrs in previous.files.items())
+        before.update(
+            (name, (True, attrs)) for name, attrs in previous.directories.items()
+        )
+    if state is not None:
+        after.update((name, (False, attrs)) for name, attrs in state.files.items())
+        after.update((name, (True, attrs)) for name, attrs in state.directories.items())
+    for name, (is_dir, attributes) in before.items():
+        if name not in after or after[name][0] != is_dir:
+            yield EVENT_DELETED, name, is_dir, None
+    for name, (is_dir, attributes) in after.items():
+        if name not in before or before[name][0] != is_dir:
+            yield EVENT_CREATED, name, is_dir, attributes
+        elif _entry_changed(before[name][1], attributes, is_dir):
+            yield EVENT_MODIFIED, name, is_dir, attributes
+
+
+class DirectoryTree:
+    def __init__(self):
+        """The last known state of remote directories, keyed by their absolute path.
+        A directory only has to be read again once its modification time changes,
+        which happens when entries are created, removed or renamed in it. Changes
+        to the content of existing files do not change the modification time.
+        """
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, path):
+        return path in self._states
+
+    def get(self, path):
+        """
+        :param path: the absolute remote path of the directory
+        :return: DirectoryState or None if the directory is unknown
+        """
+        return self._states.get(path)
+
+    def put(self, path, state):
+        with self._lock:
+            self._states[path] = state
+
+    def discard(self, path, recursive=False):
+        """
+        :param path: the absolute remote path of the directory
+        :param recursive: also discard every directory below path
+        """
+        with self._lock:
+            self._states.pop(path, None)
+            if recursive:
+                for known in self._below(path):
+                    del self._states[known]
+
+    def paths(self, root):
+        """
+        :return: list of the known directories, root included, below root
+        """
+        with self._lock:
+            paths = self._below(root)
+            if root in self._states:
+                paths.append(root)
+            return paths
+
+    def _below(self, path):
+        prefix = path.rstrip(os.sep) + os.sep
+        return [known for known in self._states if known.startswith(prefix)]
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+    def files(self, root):
+        """
+        :return: generator of (path, attributes) for every known entry below root,
+        where directories are included
+        """
+        for path in self.paths(root):
+            state = self.get(path)
+            if state is None:
+                continue
+            for entries in (state.directories, state.files):
+                for name, attributes in entries.items():
+                    yield os.path.join(path, name), attributes
+
+    def disk_usage(self, root):
+        """
+        :param root: the absolute remote path of the directory
+        :return: dict of the DiskUsage of root and every known directory below it
+        """
+        usage = {}
+        # Deeper directories are summarized before their parents
+        for path in sorted(self.paths(root), key=lambda path: -path.count(os.sep)):
+            state = self.get(path)
+            if state is None:
+                continue
+            size = state.attributes.filesize
+            files = 1
+            for attributes in state.files.values():
+                size += attributes.filesize
+                files += 1
+            for name, attributes in state.directories.items():
+                child = usage.get(os.path.join(path, name))
+                if child is None:
+                    child = DiskUsage(attributes.filesize, 1)
+                size += child.size
+                files += child.files
+            usage[path] = DiskUsage(size, files)
+        return usage
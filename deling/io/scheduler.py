@@ -0,0 +1,349 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+# Jobs with a lower priority value are started first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 10
+PRIORITY_BULK = 20
+DEFAULT_TENANT = "default"
+DEFAULT_MAX_WORKERS = 16
+# The amount of jobs that run against a host at the same time,
+# which should not exceed the amount of sessions that the server allows
+DEFAULT_HOST_LIMIT = 8
+# The amount of connections that are established to a host at the same time,
+# OpenSSH starts to refuse unauthenticated connections beyond MaxStartups=10
+DEFAULT_HOST_STARTUPS = 10
+
+
+class TransferJob:
+    __slots__ = (
+        "sequence",
+        "store",
+        "function",
+        "args",
+        "kwargs",
+        "priority",
+        "tenant",
+        "future",
+        "connecting",
+    )
+
+    def __init__(self, sequence, store, function, args, kwargs, priority, tenant):
+        self.sequence = sequence
+        self.store = store
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.tenant = tenant
+        self.future = Future()
+        # Whether the job holds a startup slot of its host
+        self.connecting = False
+
+    @property
+    def host(self):
+        return self.store.host
+
+
+class TransferScheduler:
+    def __init__(
+        self,
+        max_workers=DEFAULT_MAX_WORKERS,
+        host_limits=None,
+        default_host_limit=DEFAULT_HOST_LIMIT,
+        host_startups=DEFAULT_HOST_STARTUPS,
+        tenant_weights=None,
+    ):
+        """Runs transfer jobs against SFTPStores on a shared set of worker threads.
+        The waiting jobs with the lowest priority value are started first, where
+        the tenants of the same priority share the workers by their weight and the
+        jobs of a tenant are started in the order they were submitted. Each job runs
+        on a connection of the pool of its store.
+        :param max_workers: the amount of jobs that run at the same time
+        :param host_limits: dict of the amount of jobs that run against a host
+        at the same time, e.g. matching the MaxSessions of the server
+        :param default_host_limit: the limit of the hosts that are not in host_limits
+        :param host_startups: the amount of new connections that are established
+        to a host at the same time, e.g. matching the MaxStartups of the server
+        :param tenant_weights: dict of the relative share of each tenant,
+        where the tenants that are not included have a weight of 1
+        """
+        if max_workers <= 0:
+            raise ValueError(
+                "max_workers must be larger than 0: {}".format(max_workers)
+            )
+        self.max_workers = max_workers
+        self.host_limits = dict(host_limits or {})
+        self.default_host_limit = default_host_limit
+        self.host_startups = host_startups
+        self.tenant_weights = dict(tenant_weights or {})
+        self._condition = threading.Condition()
+        # priority -> tenant -> id of the store -> deque of TransferJob
+        self._queues = {}
+        self._pending = 0
+        self._sequence = itertools.count()
+        # The share of the workers that each tenant has received
+        self._usage = {}
+        self._host_running = {}
+        self._host_connecting = {}
+        self._store_running = {}
+        self._workers = []
+        self._idle_workers = 0
+        self._shutdown = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+
+    @property
+    def pending(self):
+        """
+        :return: the amount of jobs that have not been started
+        """
+        return self._pending
+
+    def host_limit(self, host):
+        return self.host_limits.get(host, self.default_host_limit)
+
+    def set_host_limit(self, host, limit):
+        """
+        :param host: the host of the stores that the limit applies to
+        :param limit: the amount of jobs that run against host at the same time
+        """
+        if limit <= 0:
+            raise ValueError("limit must be larger than 0: {}".format(limit))
+        with self._condition:
+            self.host_limits[host] = limit
+            self._condition.notify_all()
+
+    def submit(
+        self,
+        store,
+        function,
+        *args,
+        priority=PRIORITY_NORMAL,
+        tenant=DEFAULT_TENANT,
+        **kwargs
+    ):
+        """Schedule function(store, *args, **kwargs) to be run by a worker
+        :param store: the SFTPStore that the job transfers through
+        :param priority: jobs with a lower value are started first
+        :param tenant: the name of the tenant that the job is accounted to
+        :return: concurrent.futures.Future of the result
+        """
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new jobs after shutdown")
+            job = TransferJob(
+                next(self._sequence), store, function, args, kwargs, priority, tenant
+            )
+            tenants = self._queues.setdefault(priority, {})
+            if not self._is_active(tenant):
+                # A tenant that has been idle does not get to catch up
+                # on the share it did not use
+                active = [
+                    self._usage.get(name, 0.0)
+                    for queued in self._queues.values()
+                    for name in queued
+                ]
+                if active:
+                    self._usage[tenant] = max(self._usage.get(tenant, 0.0), min(active))
+                else:
+                    self._usage.clear()
+            tenants.setdefault(tenant, {}).setdefault(id(store), deque()).append(job)
+            self._pending += 1
+            self._condition.notify()
+            # The idle workers might be waiting for the limit of another host
+            if (
+                self._idle_workers < self._pending
+                and len(self._workers) < self.max_workers
+            ):
+                worker = threading.Thread(target=self._work, daemon=True)
+                self._workers.append(worker)
+                worker.start()
+        return job.future
+
+    def submit_upload(self, store, local_path, remote_path, **kwargs):
+        """
+        :return: Future of SFTPStore.upload(local_path, remote_path)
+        """
+        return self.submit(store, type(store).upload, local_path, remote_path, **kwargs)
+
+    def submit_download(self, store, remote_path, local_path, **kwargs):
+        """
+        :return: Future of SFTPStore.download(remote_path, local_path)
+        """
+        return self.submit(
+            store, type(store).download, remote_path, local_path, **kwargs
+        )
+
+    def submit_copy(self, store, remote_src, remote_dest, **kwargs):
+        """
+        :return: Future of SFTPStore.copy(remote_src, remote_dest)
+        """
+        return self.submit(store, type(store).copy, remote_src, remote_dest, **kwargs)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """
+        :param wait: wait for the jobs that have been submitted to finish
+        :param cancel_futures: cancel the jobs that have not been started
+        """
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                for tenants in self._queues.values():
+                    for stores in tenants.values():
+                        for jobs in stores.values():
+                            for job in jobs:
+                                job.future.cancel()
+                self._queues.clear()
+                self._pending = 0
+            self._condition.notify_all()
+            workers = list(self._workers)
+        if wait:
+            for worker in workers:
+                worker.join()
+
+    def _is_active(self, tenant):
+        return any(tenant in tenants for tenants in self._queues.values())
+
+    def _can_start(self, job):
+        host = job.host
+        if self._host_running.get(host, 0) >= self.host_limit(host):
+            return False
+        pool = job.store.pool
+        if self._store_running.get(id(job.store), 0) >= pool.max_size:
+            return False
+        # A new connection has to be established when none is idle
+        if not pool.idle and self._host_connecting.get(host, 0) >= self.host_startups:
+            return False
+        return True
+
+    def _take(self, stores):
+        """
+        :param stores: dict of the queued jobs of a tenant by their store
+        :return: the earliest submitted job that can be started, or None
+        """
+        selected = None
+        for key, jobs in list(stores.items()):
+            while jobs and jobs[0].future.cancelled():
+                jobs.popleft()
+                self._pending -= 1
+            if not jobs:
+                del stores[key]
+                continue
+            if self._can_start(jobs[0]) and (
+                selected is None or jobs[0].sequence < stores[selected][0].sequence
+            ):
+                selected = key
+        if selected is None:
+            return None
+        job = stores[selected].popleft()
+        if not stores[selected]:
+            del stores[selected]
+        return job
+
+    def _next_job(self):
+        """
+        :return: the next TransferJob to run, which is accounted as running,
+        or None if no job can be started
+        """
+        for priority in sorted(self._queues):
+            tenants = self._queues[priority]
+            for tenant in sorted(tenants, key=lambda name: self._usage.get(name, 0.0)):
+                job = self._take(tenants[tenant])
+                if not tenants[tenant]:
+                    del tenants[tenant]
+                if job is not None:
+                    break
+            else:
+                job = None
+            if not tenants:
+                del self._queues[priority]
+            if job is not None:
+                self._pending -= 1
+                self._usage[job.tenant] = self._usage.get(
+                    job.tenant, 0.0
+                ) + 1.0 / self.tenant_weights.get(job.tenant, 1)
+                host = job.host
+                self._host_running[host] = self._host_running.get(host, 0) + 1
+                self._store_running[id(job.store)] = (
+                    self._store_running.get(id(job.store), 0) + 1
+                )
+                if not job.store.pool.idle:
+                    job.connecting = True
+                    self._host_connecting[host] = self._host_connecting.get(host, 0) + 1
+                return job
+        return None
+
+    def _connected(self, job):
+        with self._condition:
+            if job.connecting:
+                job.connecting = False
+                self._host_connecting[job.host] -= 1
+                self._condition.notify_all()
+
+    def _finish(self, job):
+        with self._condition:
+            self._host_running[job.host] -= 1
+            self._store_running[id(job.store)] -= 1
+            if not self._store_running[id(job.store)]:
+                del self._store_running[id(job.store)]
+            self._condition.notify_all()
+
+    def _run(self, job):
+        try:
+            if not job.future.set_running_or_notify_cancel():
+                return
+            try:
+                # The connection of the pool that the job runs on
+                release = job.store._hold_connection()
+            except BaseException as err:
+                job.future.set_exception(err)
+                return
+            finally:
+                self._connected(job)
+            try:
+                result = job.function(job.store, *job.args, **job.kwargs)
+            except BaseException as err:
+                job.future.set_exception(err)
+            else:
+                job.future.set_result(result)
+            finally:
+                release()
+        finally:
+            self._connected(job)
+            self._finish(job)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    if self._shutdown and not self._pending:
+                        return
+                    self._idle_workers += 1
+                    self._condition.wait()
+                    self._idle_workers -= 1
+                    job = self._next_job()
+            self._run(job)
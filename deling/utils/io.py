@@ -17,6 +17,7 @@
 import os
 import stat
 import fcntl
+import hashlib
 import yaml
 import shutil
 
@@ -186,12 +187,28 @@ def load_yaml(path, opener=None):
     return False
 
 
+def new_hash(algorithm):
+    """
+    :param algorithm: name of a hashlib algorithm, or 'blake3' which
+    requires the optional blake3 package
+    :return: a hash object with update and hexdigest methods
+    """
+    if algorithm == "blake3":
+        try:
+            from blake3 import blake3
+
+            return blake3()
+        except ImportError as err:
+            raise ValueError(
+                "The blake3 package is required for the blake3 algorithm"
+            ) from err
+    return hashlib.new(algorithm)
+
+
 # Read chunks of a file, default to 64KB
 def hashsum(path, algorithm="sha1", buffer_size=65536):
     try:
-        import hashlib
-
-        hash_algorithm = hashlib.new(algorithm)
+        hash_algorithm = new_hash(algorithm)
         with open(path, "rb") as fh:
             for chunk in iter(lambda: fh.read(buffer_size), b""):
                 hash_algorithm.update(chunk)
@@ -53,6 +53,8 @@ setup(
     extras_require={
         "test": read_req("tests/requirements.txt"),
         "dev": read_req("requirements-dev.txt"),
+        "array": ["numpy"],
+        "zstd": ["zstandard"],
     },
     project_urls={"Source Code": "https://github.com/rasmunk/deling"},
     classifiers=[
@@ -14,9 +14,16 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import hashlib
 import os
 import random
-from deling.utils.io import hashsum, makedirs, exists
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ssh2.exceptions import SFTPProtocolError
+from deling.io.datastores.cache import BlockCache
+from deling.io.datastores.manifest import RemoteManifest
+from deling.utils.io import hashsum, makedirs, exists, removedirs
 
 from utils import gen_random_file
 
@@ -118,6 +125,37 @@ class CommonDataStoreTests:
         self.assertTrue(self.share.rmdir(make_nested_directory))
         self.assertNotIn(make_nested_directory, self.share.listdir())
 
+    def test_make_existing_directory(self):
+        make_directory = "existing_directory_{}".format(self.seed)
+        nested_directory = os.path.join(make_directory, "nested")
+        content_file = os.path.join(make_directory, "content")
+        self.assertTrue(self.share.mkdir(make_directory))
+        # An existing directory is treated as created
+        self.assertTrue(self.share.mkdir(make_directory))
+        self.assertTrue(self.share.mkdir(nested_directory, recursive=True))
+        self.assertTrue(self.share.mkdir(nested_directory, recursive=True))
+        # A file is not a directory
+        self.assertTrue(self.share.write(content_file, "content"))
+        self.assertFalse(self.share.mkdir(content_file))
+        self.assertFalse(
+            self.share.mkdir(os.path.join(content_file, "nested"), recursive=True)
+        )
+
+        # Removed directories are created again
+        self.assertTrue(self.share.rmdir(make_directory, recursive=True))
+        self.assertTrue(self.share.mkdir(nested_directory, recursive=True))
+        self.assertIn("nested", self.share.listdir(make_directory))
+
+        # A directory that is removed by another client is created again,
+        # once a file could not be created in it
+        nested_file = os.path.join(nested_directory, "content")
+        self.share.sftp_channel.rmdir(self.share.realpath(nested_directory))
+        self.assertRaises(SFTPProtocolError, self.share.write, nested_file, "content")
+        self.assertTrue(self.share.mkdir(nested_directory, recursive=True))
+        self.assertTrue(self.share.write(nested_file, "content"))
+        self.assertTrue(self.share.rmdir(make_directory, recursive=True))
+        self.assertNotIn(make_directory, self.share.listdir())
+
     def test_make_absolute_nested_directory(self):
         first_directory_name = "nested_directory_{}".format(self.seed)
         second_directory_name = "nested"
@@ -146,9 +184,263 @@ class CommonDataStoreTests:
         self.assertTrue(self.share.mkdir(make_directory_path, recursive=True))
         self.assertIn(first_directory_name, self.share.listdir())
         self.assertIn(second_directory_name, self.share.listdir(first_directory_name))
+        for directory in [first_directory_name, make_directory_path]:
+            for index in range(3):
+                content_file = os.path.join(directory, "content_{}".format(index))
+                self.assertTrue(self.share.write(content_file, "content"))
+        # A non-empty directory can only be removed recursively
+        self.assertFalse(self.share.rmdir(make_directory_path))
+
+        # Only the content below the given directory is removed
         self.assertTrue(self.share.rmdir(make_directory_path, recursive=True))
+        self.assertNotIn(
+            second_directory_name, self.share.listdir(first_directory_name)
+        )
+        self.assertIn("content_0", self.share.listdir(first_directory_name))
+        # A trailing separator does not change the order of the removals
+        self.assertTrue(self.share.mkdir(make_directory_path))
+        self.assertTrue(self.share.rmdir(first_directory_name + os.sep, recursive=True))
         self.assertNotIn(first_directory_name, self.share.listdir())
 
+    def test_scandir(self):
+        directory = "scandir_directory_{}".format(self.seed)
+        sub_directory = os.path.join(directory, "sub")
+        content_file = os.path.join(directory, "content")
+        self.assertTrue(self.share.mkdir(sub_directory, recursive=True))
+        self.assertTrue(self.share.write(content_file, "content"))
+
+        entries = {entry.name: entry for entry in self.share.scandir(directory)}
+        self.assertEqual(set(entries), {"sub", "content"})
+        self.assertTrue(entries["sub"].is_dir())
+        self.assertFalse(entries["sub"].is_file())
+        self.assertTrue(entries["content"].is_file())
+        self.assertEqual(entries["content"].size, len("content"))
+        self.assertEqual(entries["content"].path, content_file)
+
+        self.assertTrue(self.share.remove(content_file))
+        self.assertTrue(self.share.rmdir(sub_directory))
+        self.assertTrue(self.share.rmdir(directory))
+
+    def test_walk(self):
+        directory = "walk_directory_{}".format(self.seed)
+        directories = [
+            os.path.join(directory, "a", "aa"),
+            os.path.join(directory, "b"),
+        ]
+        files = [os.path.join(path, "content") for path in directories]
+        for path in directories:
+            self.assertTrue(self.share.mkdir(path, recursive=True))
+        for path in files:
+            self.assertTrue(self.share.write(path, "content"))
+
+        for max_concurrency in (1, 4):
+            walked = {
+                dirpath: (sorted(dirnames), [entry.name for entry in entries])
+                for dirpath, dirnames, entries in self.share.walk(
+                    directory, max_concurrency=max_concurrency
+                )
+            }
+            self.assertEqual(walked[directory], (["a", "b"], []))
+            self.assertEqual(walked[os.path.join(directory, "a")], (["aa"], []))
+            self.assertEqual(walked[directories[0]], ([], ["content"]))
+            self.assertEqual(walked[directories[1]], ([], ["content"]))
+
+        # Subdirectories that are removed from dirnames are not walked
+        walked = []
+        for dirpath, dirnames, entries in self.share.walk(directory):
+            walked.append(dirpath)
+            if "a" in dirnames:
+                dirnames.remove("a")
+        self.assertEqual(sorted(walked), [directory, directories[1]])
+
+        bottomup = [dirpath for dirpath, _, _ in self.share.walk(directory, False)]
+        self.assertEqual(bottomup[-1], directory)
+        self.assertLess(
+            bottomup.index(directories[0]),
+            bottomup.index(os.path.join(directory, "a")),
+        )
+
+        for path in files:
+            self.assertTrue(self.share.remove(path))
+        for path in [directories[0], os.path.join(directory, "a"), directories[1]]:
+            self.assertTrue(self.share.rmdir(path))
+        self.assertTrue(self.share.rmdir(directory))
+
+    def test_stat_many(self):
+        files = ["stat_many_file_{}_{}".format(index, self.seed) for index in range(5)]
+        for index, path in enumerate(files):
+            self.assertTrue(self.share.write(path, "1" * index))
+        missing_file = "stat_many_missing_{}".format(self.seed)
+
+        paths = files + [missing_file]
+        results = self.share.stat_many(paths)
+        self.assertEqual([path for path, _, _ in results], paths)
+        for index, (_, attributes, error) in enumerate(results[:-1]):
+            self.assertIsNone(error)
+            self.assertEqual(attributes.filesize, index)
+        self.assertIsNone(results[-1][1])
+        self.assertIsInstance(results[-1][2], FileNotFoundError)
+        self.assertEqual(self.share.exists_many(paths), [True] * len(files) + [False])
+
+        for path in files:
+            self.assertTrue(self.share.remove(path))
+        self.assertEqual(self.share.exists_many(files), [False] * len(files))
+
+    def test_du(self):
+        directory = "du_directory_{}".format(self.seed)
+        sub_directory = os.path.join(directory, "sub")
+        self.assertTrue(self.share.mkdir(sub_directory, recursive=True))
+        self.assertTrue(self.share.write(os.path.join(directory, "content"), "1" * 10))
+        self.assertTrue(self.share.write(os.path.join(sub_directory, "content"), "1"))
+
+        usage = self.share.du(directory, depth=1)
+        self.assertEqual(set(usage), {directory, sub_directory})
+        # Two files and two directories
+        self.assertEqual(usage[directory].files, 4)
+        self.assertEqual(usage[sub_directory].files, 2)
+        self.assertEqual(
+            usage[directory].size - usage[sub_directory].size,
+            self.share.stat(directory).filesize + 10,
+        )
+        self.assertEqual(self.share.du(directory, depth=1), usage)
+        self.assertEqual(set(self.share.du(directory)), {directory})
+
+        self.assertTrue(self.share.write(os.path.join(sub_directory, "more"), "1" * 5))
+        changed = self.share.du(directory, depth=1)
+        self.assertEqual(changed[sub_directory].files, 3)
+        self.assertEqual(changed[directory].size, usage[directory].size + 5)
+
+        # A directory that cannot be read fails the usage instead of
+        # being left out of it
+        self.assertTrue(self.share.write(os.path.join(sub_directory, "other"), "1"))
+        attributes = self.share.stat(sub_directory)
+        permissions = attributes.permissions
+        attributes.permissions = stat.S_IFDIR
+        self.assertTrue(self.share.setstat(sub_directory, attributes))
+        self.assertFalse(self.share.du(directory, depth=1))
+        attributes.permissions = permissions
+        self.assertTrue(self.share.setstat(sub_directory, attributes))
+        self.assertEqual(self.share.du(directory, depth=1)[sub_directory].files, 4)
+
+        self.assertTrue(self.share.rmdir(directory, recursive=True))
+        self.assertFalse(self.share.du(directory))
+
+    def test_refresh_manifest(self):
+        directory = "manifest_directory_{}".format(self.seed)
+        sub_directory = os.path.join(directory, "sub")
+        content_file = os.path.join(sub_directory, "content")
+        self.assertTrue(self.share.mkdir(sub_directory, recursive=True))
+        self.assertTrue(self.share.write(content_file, "content"))
+
+        with RemoteManifest(":memory:", directory) as manifest:
+            summary = self.share.refresh_manifest(manifest, checksum="sha256")
+            self.assertEqual(summary["read"], 2)
+            remote_file = os.path.join(self.share.realpath(directory), "sub", "content")
+            entry = manifest.entry(remote_file)
+            self.assertEqual(entry.size, len("content"))
+            self.assertEqual(
+                entry.hash, hashlib.sha256("content".encode("utf-8")).hexdigest()
+            )
+            # A change within the second that the directory was read in
+            # is found, even though the modification time might not change
+            same_second_file = os.path.join(sub_directory, "same_second")
+            self.assertTrue(self.share.write(same_second_file, "same second"))
+            self.share.refresh_manifest(manifest)
+            remote_same_second = os.path.join(
+                os.path.dirname(remote_file), "same_second"
+            )
+            self.assertIsNotNone(manifest.entry(remote_same_second))
+            self.assertTrue(self.share.remove(same_second_file))
+            self.share.refresh_manifest(manifest)
+            self.assertIsNotNone(manifest.entry(remote_same_second).deleted)
+
+            # Nothing is read when nothing has changed, once a second has passed
+            # since the directories were last modified
+            time.sleep(1)
+            self.share.refresh_manifest(manifest)
+            self.assertEqual(self.share.refresh_manifest(manifest)["read"], 0)
+
+            # The modification time of a directory has a resolution of seconds
+            time.sleep(1)
+            since = time.time()
+            self.assertTrue(self.share.remove(content_file))
+            self.assertEqual(self.share.refresh_manifest(manifest)["read"], 1)
+            changes = manifest.changes(since)
+            self.assertEqual([change.path for change in changes], [remote_file])
+            self.assertIsNotNone(changes[0].deleted)
+
+            # The entries of a directory that cannot be read are not deleted
+            other_file = os.path.join(sub_directory, "other")
+            self.assertTrue(self.share.write(other_file, "other"))
+            self.assertEqual(self.share.refresh_manifest(manifest)["read"], 1)
+            time.sleep(1)
+            since = time.time()
+            self.assertTrue(self.share.write(content_file, "content"))
+            attributes = self.share.stat(sub_directory)
+            permissions = attributes.permissions
+            attributes.permissions = stat.S_IFDIR
+            self.assertTrue(self.share.setstat(sub_directory, attributes))
+            errors = []
+            summary = self.share.refresh_manifest(manifest, onerror=errors.append)
+            self.assertEqual((summary["removed"], summary["errors"]), (0, 1))
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(manifest.changes(since), [])
+            remote_other = os.path.join(os.path.dirname(remote_file), "other")
+            self.assertIsNone(manifest.entry(remote_other).deleted)
+
+            attributes.permissions = permissions
+            self.assertTrue(self.share.setstat(sub_directory, attributes))
+            summary = self.share.refresh_manifest(manifest)
+            self.assertEqual((summary["read"], summary["errors"]), (1, 0))
+            self.assertEqual(
+                [change.path for change in manifest.changes(since)], [remote_file]
+            )
+
+        self.assertTrue(self.share.rmdir(directory, recursive=True))
+
+    def test_watch(self):
+        directory = "watch_directory_{}".format(self.seed)
+        existing_file = os.path.join(directory, "existing")
+        new_file = os.path.join(directory, "new")
+        self.assertTrue(self.share.mkdir(directory))
+        self.assertTrue(self.share.write(existing_file, "existing"))
+
+        events = self.share.watch(directory, interval=0.1, initial=True)
+        event = next(events)
+        self.assertEqual(
+            (event.kind, event.path, event.is_dir), ("created", existing_file, False)
+        )
+        self.assertTrue(self.share.remove(existing_file))
+        self.assertTrue(self.share.write(new_file, "new"))
+        changes = {
+            (event.kind, event.path): event for event in (next(events), next(events))
+        }
+        self.assertEqual(
+            set(changes), {("deleted", existing_file), ("created", new_file)}
+        )
+        self.assertEqual(changes[("created", new_file)].attributes.filesize, 3)
+        events.close()
+
+        self.assertTrue(self.share.rmdir(directory, recursive=True))
+
+    def test_share_between_threads(self):
+        directory = "threads_directory_{}".format(self.seed)
+        self.assertTrue(self.share.mkdir(directory))
+
+        def write_read(index):
+            path = os.path.join(directory, "content_{}".format(index))
+            self.assertTrue(self.share.write(path, str(index)))
+            return self.share.read(path)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            contents = list(executor.map(write_read, range(16)))
+        self.assertEqual(contents, [str(index) for index in range(16)])
+        self.assertLessEqual(
+            {"content_{}".format(index) for index in range(16)},
+            set(self.share.listdir(directory)),
+        )
+        self.assertTrue(self.share.rmdir(directory, recursive=True))
+
     def test_directory_exists(self):
         make_directory = "make_directory_exists_{}".format(self.seed)
         self.assertTrue(self.share.mkdir(make_directory))
@@ -319,6 +611,119 @@ class CommonDataStoreTests:
         self.assertTrue(self.share.remove(filename + "_copy"))
         self.assertNotIn(filename + "_copy", self.share.listdir())
 
+    def test_submit_transfers(self):
+        tmp_test_dir = os.path.join(os.getcwd(), "tests", "tmp")
+        if not exists(tmp_test_dir):
+            self.assertTrue(makedirs(tmp_test_dir))
+        filenames = ["submit_file_{}_{}".format(self.seed, index) for index in range(8)]
+        upload_hashes = {}
+        for filename in filenames:
+            upload_file = os.path.join(tmp_test_dir, filename)
+            self.assertTrue(gen_random_file(upload_file, size=1024 * 64))
+            upload_hashes[filename] = hashsum(upload_file)
+
+        uploads = {
+            self.share.submit_upload(
+                os.path.join(tmp_test_dir, filename), filename
+            ): filename
+            for filename in filenames
+        }
+        self.assertEqual(
+            {uploads[future] for future in as_completed(uploads, timeout=60)},
+            set(filenames),
+        )
+        self.assertTrue(all(future.result() for future in uploads))
+
+        copies = [
+            self.share.submit_copy(filename, filename + "_copy")
+            for filename in filenames
+        ]
+        self.assertTrue(all(future.result(timeout=60) for future in copies))
+
+        downloads = {}
+        for filename in filenames:
+            download_path = os.path.join(tmp_test_dir, "downloaded_" + filename)
+            future = self.share.submit_download(filename + "_copy", download_path)
+            downloads[future] = (filename, download_path)
+        for future in as_completed(downloads, timeout=60):
+            filename, download_path = downloads[future]
+            self.assertTrue(future.result())
+            self.assertEqual(upload_hashes[filename], hashsum(download_path))
+
+        for filename in filenames:
+            self.assertTrue(self.share.remove(filename))
+            self.assertTrue(self.share.remove(filename + "_copy"))
+
+    def test_batch(self):
+        directory = "batch_directory_{}".format(self.seed)
+        archive = os.path.join(directory, "archive")
+        self.assertTrue(self.share.mkdir(directory))
+        names = ["content_{}".format(index) for index in range(16)]
+        for name in names:
+            self.assertTrue(self.share.write(os.path.join(directory, name), name))
+        attributes = self.share.stat(os.path.join(directory, names[0]))
+
+        with self.share.batch() as batch:
+            batch.mkdir(archive)
+            for name in names:
+                batch.rename(os.path.join(directory, name), os.path.join(archive, name))
+                batch.setstat(os.path.join(archive, name), attributes)
+            missing = batch.remove(os.path.join(directory, "missing"))
+            self.assertEqual(len(batch.pending), 2 * len(names) + 2)
+        self.assertEqual(batch.pending, [])
+        self.assertEqual(batch.errors, [missing])
+        self.assertIsInstance(missing.error, OSError)
+        self.assertEqual(
+            sorted(
+                name for name in self.share.listdir(archive) if name not in (".", "..")
+            ),
+            sorted(names),
+        )
+
+        with self.share.batch() as batch:
+            for name in names:
+                batch.remove(os.path.join(archive, name))
+            self.assertEqual(len(batch.flush()), len(names))
+            self.assertEqual(batch.flush(), [])
+        self.assertEqual(batch.errors, [])
+        self.assertEqual(
+            [name for name in self.share.listdir(archive) if name not in (".", "..")],
+            [],
+        )
+        self.assertTrue(self.share.rmdir(directory, recursive=True))
+
+    def test_download_tree(self):
+        directory = "tree_directory_{}".format(self.seed)
+        contents = {
+            os.path.join("level_{}".format(level), "file_{}".format(index)): str(index)
+            for level in range(3)
+            for index in range(8)
+        }
+        contents["top_file"] = "top"
+        for path, content in contents.items():
+            remote_path = os.path.join(directory, path)
+            self.assertTrue(
+                self.share.mkdir(os.path.dirname(remote_path), recursive=True)
+            )
+            self.assertTrue(self.share.write(remote_path, content))
+
+        tmp_test_dir = os.path.join(os.getcwd(), "tests", "tmp")
+        for mode in ("tar", "sftp"):
+            local_path = os.path.join(tmp_test_dir, "{}_{}".format(directory, mode))
+            self.assertTrue(self.share.download_tree(directory, local_path, mode=mode))
+            for path, content in contents.items():
+                with open(os.path.join(local_path, path)) as fh:
+                    self.assertEqual(fh.read(), content)
+            self.assertTrue(removedirs(local_path, recursive=True))
+
+        self.assertRaises(
+            ValueError, self.share.download_tree, directory, tmp_test_dir, mode="zip"
+        )
+        self.assertFalse(
+            self.share.download_tree(os.path.join(directory, "top_file"), tmp_test_dir)
+        )
+        self.assertTrue(self.share.rmdir(directory, recursive=True))
+
 
 class CommonDataStoreFileHandleTests:
     def setUp(self):
@@ -414,3 +819,65 @@ class CommonDataStoreFileHandleTests:
             _file.seek(-6, whence)
             end_content = _file.read()
             self.assertEqual(end_content, b" World")
+
+    def test_readline(self):
+        lines_file = "".join(["lines_file", self.seed])
+        self.files.append(lines_file)
+        lines = ["første linje\n", "second ✓ line\n", "\n", "last"]
+        with self.share.open(lines_file, "w") as _file:
+            _file.write("".join(lines))
+
+        with self.share.open(lines_file, "r") as _file:
+            # Small chunks splits the multibyte characters across reads
+            _file.chunk_size = 3
+            self.assertEqual(_file.readline(), lines[0])
+            self.assertEqual(_file.readline(), lines[1])
+            self.assertEqual(_file.readlines(), lines[2:])
+            self.assertEqual(_file.readline(), "")
+
+        with self.share.open(lines_file, "rb") as _file:
+            _file.chunk_size = 3
+            self.assertEqual(_file.readline(), bytes(lines[0], "utf-8"))
+            self.assertEqual(_file.tell(), len(bytes(lines[0], "utf-8")))
+
+    def test_iterate_lines(self):
+        lines_file = "".join(["iterate_lines_file", self.seed])
+        self.files.append(lines_file)
+        lines = ["første linje\n", "second ✓ line\n", "last"]
+        with self.share.open(lines_file, "w") as _file:
+            _file.write("".join(lines))
+
+        with self.share.open(lines_file, "r") as _file:
+            _file.chunk_size = 3
+            self.assertEqual([line for line in _file], lines)
+
+    def test_block_cache_read(self):
+        block_cache = BlockCache(block_size=4, max_bytes=1024)
+        with self.share.open(self.seek_file, "rb", block_cache=block_cache) as _file:
+            _file.seek(self.space_offset)
+            self.assertEqual(_file.read(3), b"Wor")
+            # Served from the block that was fetched by the previous read
+            _file.seek(self.space_offset + 2)
+            self.assertEqual(_file.read(2), b"rl")
+            self.assertEqual(_file.tell(), self.space_offset + 4)
+            _file.seek(0)
+            self.assertEqual(_file.read(), self.data_bytes)
+
+        stats = block_cache.stats()
+        self.assertGreater(stats["hits"], 0)
+        self.assertEqual(stats["size"], len(self.data_bytes))
+
+    def test_read_ranges(self):
+        ranges = [(6, 5), (0, 5), (4, 3), (10, 0)]
+        with self.share.open(self.seek_file, "rb") as _file:
+            _file.seek(2)
+            self.assertEqual(
+                _file.read_ranges(ranges),
+                [
+                    self.data_bytes[offset : offset + length]
+                    for offset, length in ranges
+                ],
+            )
+            # The position of the handle is left unchanged
+            self.assertEqual(_file.tell(), 2)
+            self.assertEqual(_file.read(3), b"llo")
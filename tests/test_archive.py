@@ -0,0 +1,105 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import io
+import os
+import subprocess
+import tarfile
+import tempfile
+import unittest
+from deling.io.datastores.archive import (
+    ChunkStream,
+    COMPRESSION_GZIP,
+    extract_tar_stream,
+    tar_command,
+)
+
+
+def make_archive(members, mode="w"):
+    """
+    :param members: dict of the content of each file name
+    :return: the bytes of the archive
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def split(data, size):
+    return [data[offset : offset + size] for offset in range(0, len(data), size)]
+
+
+class ArchiveTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.members = {
+            "nested/file_{}".format(index): bytes([index]) * index
+            for index in range(64)
+        }
+        self.members["file"] = b"Hello World"
+
+    def assertExtracted(self):
+        for name, content in self.members.items():
+            with open(os.path.join(self.directory.name, name), "rb") as fh:
+                self.assertEqual(fh.read(), content)
+
+    def test_chunk_stream(self):
+        stream = ChunkStream(iter([b"ab", b"", b"cde"]))
+        self.assertEqual(stream.read(1), b"a")
+        self.assertEqual(stream.read(), b"bcde")
+        self.assertEqual(stream.read(), b"")
+
+    def test_extract(self):
+        stream = ChunkStream(split(make_archive(self.members), 1000))
+        extracted = extract_tar_stream(stream, self.directory.name)
+        self.assertEqual(extracted, len(self.members))
+        self.assertExtracted()
+
+    def test_extract_gzip(self):
+        stream = ChunkStream(split(make_archive(self.members, mode="w:gz"), 100))
+        extract_tar_stream(stream, self.directory.name, compression=COMPRESSION_GZIP)
+        self.assertExtracted()
+
+    def test_reject_outside(self):
+        stream = ChunkStream([make_archive({"../outside": b"content"})])
+        self.assertRaises(
+            tarfile.TarError, extract_tar_stream, stream, self.directory.name
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(self.directory.name, "..", "outside"))
+        )
+
+    def test_tar_command(self):
+        self.assertEqual(tar_command("my dir"), "tar -C 'my dir' -cf - .")
+        self.assertEqual(
+            tar_command("dir", compression=COMPRESSION_GZIP), "tar -C dir -z -cf - ."
+        )
+        # The exit status is that of tar, also when the archive is compressed
+        missing = os.path.join(self.directory.name, "missing")
+        for compression in (None, COMPRESSION_GZIP):
+            result = subprocess.run(
+                tar_command(missing, compression=compression),
+                shell=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn(b"missing", result.stderr)
@@ -0,0 +1,52 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import unittest
+from deling.io.datastores.batch import (
+    BatchOperation,
+    OPERATION_MKDIR,
+    OPERATION_RENAME,
+    OPERATION_REMOVE,
+    OPERATION_SETSTAT,
+    operation_levels,
+)
+
+
+class OperationLevelsTests(unittest.TestCase):
+    def test_independent(self):
+        operations = [
+            BatchOperation(
+                OPERATION_RENAME, "/a/{}".format(index), "/b/{}".format(index)
+            )
+            for index in range(4)
+        ]
+        self.assertEqual(operation_levels(operations), [operations])
+
+    def test_dependencies(self):
+        mkdir = BatchOperation(OPERATION_MKDIR, "/data", 0o755)
+        rename = BatchOperation(OPERATION_RENAME, "/tmp/file", "/data/file")
+        other = BatchOperation(OPERATION_RENAME, "/tmp/other", "/tmp/other.old")
+        setstat = BatchOperation(OPERATION_SETSTAT, "/data/file", None)
+        remove = BatchOperation(OPERATION_REMOVE, "/tmp/other.old")
+        self.assertEqual(
+            operation_levels([mkdir, rename, other, setstat, remove]),
+            [[mkdir, other], [rename, remove], [setstat]],
+        )
+
+    def test_parent_after_child(self):
+        remove = BatchOperation(OPERATION_REMOVE, "/data/file")
+        rename = BatchOperation(OPERATION_RENAME, "/data", "/archive")
+        self.assertEqual(operation_levels([remove, rename]), [[remove], [rename]])
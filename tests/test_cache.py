@@ -0,0 +1,108 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import time
+import unittest
+from deling.io.datastores.cache import (
+    BlockCache,
+    MetadataCache,
+    METADATA_STAT,
+    METADATA_LISTDIR,
+)
+
+
+class BlockCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = BlockCache(block_size=4, max_bytes=12)
+
+    def test_hit_miss(self):
+        key = BlockCache.make_key("file", 0, 1, 8)
+        self.assertIsNone(self.cache.get(key))
+        self.assertTrue(self.cache.put(key, b"abcd"))
+        self.assertEqual(self.cache.get(key), b"abcd")
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 4)
+
+    def test_lru_eviction(self):
+        keys = [BlockCache.make_key("file", index, 1, 16) for index in range(4)]
+        for key in keys[:3]:
+            self.cache.put(key, b"abcd")
+        # Use the first block such that the second is the least recently used
+        self.assertEqual(self.cache.get(keys[0]), b"abcd")
+        self.cache.put(keys[3], b"abcd")
+        self.assertEqual(self.cache.size, 12)
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNotNone(self.cache.get(keys[3]))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_changed_file_misses(self):
+        self.cache.put(BlockCache.make_key("file", 0, 1, 8), b"abcd")
+        self.assertIsNone(self.cache.get(BlockCache.make_key("file", 0, 2, 8)))
+
+    def test_invalidate(self):
+        self.cache.put(BlockCache.make_key("file", 0, 1, 8), b"abcd")
+        self.cache.put(BlockCache.make_key("file", 1, 1, 8), b"efgh")
+        self.cache.put(BlockCache.make_key("other", 0, 1, 4), b"ijkl")
+        self.cache.invalidate("file")
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.size, 4)
+
+
+class MetadataCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = MetadataCache(ttl=60, negative_ttl=60)
+
+    def test_hit_miss(self):
+        self.assertEqual(self.cache.get(METADATA_STAT, "/a"), (False, None))
+        self.cache.put(METADATA_STAT, "/a", "attributes")
+        self.assertEqual(self.cache.get(METADATA_STAT, "/a"), (True, "attributes"))
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_negative_entry(self):
+        self.cache.put(METADATA_STAT, "/missing", None)
+        self.assertEqual(self.cache.get(METADATA_STAT, "/missing"), (True, None))
+
+    def test_expired_entry(self):
+        self.cache.put(METADATA_STAT, "/a", "attributes", ttl=0.01)
+        time.sleep(0.02)
+        self.assertEqual(self.cache.get(METADATA_STAT, "/a"), (False, None))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate(self):
+        self.cache.put(METADATA_STAT, "/dir/a", "attributes")
+        self.cache.put(METADATA_LISTDIR, "/dir", ["a"])
+        self.cache.put(METADATA_STAT, "/other", "attributes")
+        self.cache.invalidate("/dir/a")
+        self.assertEqual(self.cache.get(METADATA_STAT, "/dir/a"), (False, None))
+        self.assertEqual(self.cache.get(METADATA_LISTDIR, "/dir"), (False, None))
+        self.assertEqual(self.cache.get(METADATA_STAT, "/other"), (True, "attributes"))
+
+    def test_invalidate_recursive(self):
+        self.cache.put(METADATA_STAT, "/dir/sub/a", "attributes")
+        self.cache.put(METADATA_LISTDIR, "/dir/sub", ["a"])
+        self.cache.put(METADATA_STAT, "/directory", "attributes")
+        self.cache.invalidate("/dir", recursive=True)
+        self.assertEqual(self.cache.get(METADATA_STAT, "/dir/sub/a"), (False, None))
+        self.assertEqual(self.cache.get(METADATA_LISTDIR, "/dir/sub"), (False, None))
+        self.assertEqual(
+            self.cache.get(METADATA_STAT, "/directory"), (True, "attributes")
+        )
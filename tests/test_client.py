@@ -14,14 +14,20 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import asyncio
+import io
 import unittest
 import os
 import random
+from ssh2.error_codes import LIBSSH2_ERROR_EAGAIN
 from ssh2.sftp import SFTP
 from deling.clients.ssh import (
+    ChannelPump,
     SSHClient,
     CHANNEL_TYPE_SFTP,
     SSHClientResultCode,
+    STREAM_STDOUT,
+    iter_stdin_chunks,
     read_channel_exit_status,
 )
 from deling.authenticators.ssh import SSHAuthenticator
@@ -170,6 +176,74 @@ class SSHClientTestAuthentication(CommonClientTestCases, unittest.TestCase):
         self.assertIsNone(self.client.channel)
         self.client.disconnect()
 
+    def test_client_exec_command_stdin(self):
+        self.assertTrue(self.client.connect())
+        # More than the channel window in both directions
+        data = b"Hello World\n" * 1024 * 1024
+        success, response = self.client.exec_command(
+            "cat", channel=self.client.session.open_session(), stdin=data
+        )
+        self.assertEqual(success, SSHClientResultCode.SUCCESS)
+        self.assertEqual(response["output"], data.decode("utf-8"))
+
+        upload_path = os.path.join(self.test_ssh_dir, "stdin_{}".format(self.seed))
+        with open(upload_path, "wb") as fh:
+            fh.write(data)
+        with open(upload_path, "rb") as fh:
+            success, response = self.client.exec_command(
+                "wc -c", channel=self.client.session.open_session(), stdin=fh
+            )
+        self.assertEqual(success, SSHClientResultCode.SUCCESS)
+        self.assertEqual(response, {"exit_code": 0, "output": f"{len(data)}\n"})
+
+        lines = (f"{index}\n" for index in range(1000))
+        success, response = self.client.exec_command(
+            "tail -n 1", channel=self.client.session.open_session(), stdin=lines
+        )
+        self.assertEqual(response, {"exit_code": 0, "output": "999\n"})
+        # The session is blocking again
+        self.assertTrue(self.client.session.get_blocking())
+        self.client.disconnect()
+
+    def test_client_exec_async(self):
+        self.assertTrue(self.client.connect())
+
+        async def run():
+            results = await asyncio.gather(
+                *[self.client.exec(f"sleep 1; echo {index}") for index in range(8)]
+            )
+            piped = await self.client.exec("cat", stdin="Hello World")
+            failed = await self.client.exec("echo failed 1>&2; exit 3")
+            command = self.client.exec_stream("seq 1 3")
+            chunks = [output async for output in command]
+            return results, piped, failed, command, chunks
+
+        results, piped, failed, command, chunks = asyncio.run(run())
+        self.assertEqual(
+            results,
+            [
+                (SSHClientResultCode.SUCCESS, {"exit_code": 0, "output": f"{index}\n"})
+                for index in range(8)
+            ],
+        )
+        self.assertEqual(
+            piped,
+            (SSHClientResultCode.SUCCESS, {"exit_code": 0, "output": "Hello World"}),
+        )
+        self.assertEqual(
+            failed,
+            (
+                SSHClientResultCode.STDERR_RESPONSE,
+                {"exit_code": 3, "output": "failed\n"},
+            ),
+        )
+        self.assertEqual({stream for stream, _ in chunks}, {STREAM_STDOUT})
+        self.assertEqual(b"".join(chunk for _, chunk in chunks), b"1\n2\n3\n")
+        self.assertEqual(command.exit_code, 0)
+        # The blocking methods can be used again once the commands have finished
+        self.assertTrue(self.client.session.get_blocking())
+        self.client.disconnect()
+
     def test_client_run_single_command(self):
         input_data = "Hdk1902dm10d9m1d"
         command = f"echo {input_data}"
@@ -258,3 +332,81 @@ class SSHClientTestAuthentication(CommonClientTestCases, unittest.TestCase):
         # 1 == unrecognized option
         # 127 == invalid command
         self.assertListEqual(response_exit_codes, [1, 127, 127])
+
+
+class CatChannelStub:
+    def __init__(self, window):
+        """Echoes stdin to stdout, where at most window bytes are buffered"""
+        self.window = window
+        self.buffer = b""
+        self.eof_received = False
+
+    def write(self, data):
+        accepted = min(len(data), self.window - len(self.buffer))
+        if not accepted:
+            return LIBSSH2_ERROR_EAGAIN, 0
+        self.buffer += data[:accepted]
+        return accepted, accepted
+
+    def send_eof(self):
+        self.eof_received = True
+        return 0
+
+    def read(self, size):
+        if not self.buffer:
+            return LIBSSH2_ERROR_EAGAIN, b""
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return len(data), data
+
+    def read_stderr(self, size):
+        return LIBSSH2_ERROR_EAGAIN, b""
+
+    def eof(self):
+        return self.eof_received and not self.buffer
+
+
+class StdinChunksTests(unittest.TestCase):
+    def test_bytes(self):
+        self.assertEqual(
+            list(iter_stdin_chunks(b"abcdefg", chunk_size=3)), [b"abc", b"def", b"g"]
+        )
+        self.assertEqual(list(iter_stdin_chunks("abc")), [b"abc"])
+        self.assertEqual(list(iter_stdin_chunks(b"")), [])
+
+    def test_file(self):
+        self.assertEqual(
+            list(iter_stdin_chunks(io.BytesIO(b"abcde"), chunk_size=2)),
+            [b"ab", b"cd", b"e"],
+        )
+        self.assertEqual(list(iter_stdin_chunks(io.StringIO("abc"))), [b"abc"])
+
+    def test_iterator(self):
+        self.assertEqual(
+            list(iter_stdin_chunks(iter([b"a", "b", b"", bytearray(b"c")]))),
+            [b"a", b"b", b"c"],
+        )
+
+
+class ChannelPumpTests(unittest.TestCase):
+    def test_flow_control(self):
+        data = bytes(range(256)) * 64
+        channel = CatChannelStub(window=100)
+        pump = ChannelPump(channel, stdin=io.BytesIO(data), chunk_size=64)
+        output = []
+        steps = 0
+        while not pump.done:
+            progress, chunks = pump.step()
+            self.assertTrue(progress or pump.done)
+            output.extend(chunks)
+            steps += 1
+        self.assertEqual({stream for stream, _ in output}, {STREAM_STDOUT})
+        self.assertEqual(b"".join(chunk for _, chunk in output), data)
+        # The output is drained while the input is written
+        self.assertGreater(steps, len(data) // 100)
+
+    def test_no_stdin(self):
+        channel = CatChannelStub(window=100)
+        channel.eof_received = True
+        pump = ChannelPump(channel)
+        self.assertEqual(pump.step(), (False, []))
+        self.assertTrue(pump.done)
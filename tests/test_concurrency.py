@@ -0,0 +1,150 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import threading
+import unittest
+from unittest import mock
+from deling.io.datastores.concurrency import (
+    ConcurrencyController,
+    LATENCY_WINDOW,
+    is_congestion,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ConcurrencyControllerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch(
+            "deling.io.datastores.concurrency.time.monotonic", self.clock
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_round(self, controller, latency, error=None, kind=None):
+        """Run as many requests as the limit at the same time"""
+        started = [controller.acquire() for _ in range(controller.limit)]
+        self.clock.now += latency
+        for start in started:
+            controller.release(start, error=error, kind=kind)
+
+    def test_limits(self):
+        self.assertRaises(ValueError, ConcurrencyController, 0)
+        self.assertRaises(ValueError, ConcurrencyController, 2, minimum=3)
+        self.assertEqual(ConcurrencyController(2, initial=4).limit, 2)
+
+    def test_increase(self):
+        controller = ConcurrencyController(8, initial=2)
+        # The throughput rises with the limit while the latency is constant
+        for limit in range(2, 8):
+            self.assertEqual(controller.limit, limit)
+            self.run_round(controller, 0.1)
+        self.assertEqual(controller.limit, 8)
+        self.run_round(controller, 0.1)
+        self.assertEqual(controller.limit, 8)
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_hold(self):
+        controller = ConcurrencyController(8, initial=4)
+        self.run_round(controller, 0.1)
+        self.assertEqual(controller.limit, 5)
+        # The same throughput at a higher limit
+        self.run_round(controller, 0.125)
+        self.assertEqual(controller.limit, 5)
+
+    def test_congestion(self):
+        controller = ConcurrencyController(8, initial=8)
+        self.run_round(controller, 0.1, error=TimeoutError())
+        # The requests of the same round only decrease the limit once
+        self.assertEqual(controller.limit, 4)
+        self.run_round(controller, 0.1, error=FileNotFoundError())
+        self.assertEqual(controller.limit, 4)
+
+    def test_latency(self):
+        controller = ConcurrencyController(8, initial=4)
+        self.run_round(controller, 0.1, kind="stat")
+        self.assertEqual(controller.limit, 5)
+        self.run_round(controller, 0.5, kind="stat")
+        self.assertEqual(controller.limit, 2)
+
+    def test_mixed_latency(self):
+        controller = ConcurrencyController(8, initial=2)
+        self.run_round(controller, 0.002, kind="stat")
+        limit = controller.limit
+        # The slower directory scans are not compared with the fast stat
+        limits = []
+        for _ in range(10):
+            self.run_round(controller, 0.04)
+            limits.append(controller.limit)
+        self.assertEqual(limits, [limit] * 10)
+
+        # Neither are requests of another kind
+        controller = ConcurrencyController(8, initial=2)
+        self.run_round(controller, 0.002, kind="stat")
+        for _ in range(10):
+            self.run_round(controller, 0.04, kind="rmdir")
+        self.assertEqual(controller.limit, limit)
+
+    def test_latency_window(self):
+        controller = ConcurrencyController(8, initial=2)
+        started = controller.acquire()
+        self.clock.now += 0.002
+        controller.release(started, kind="stat")
+        # A single fast request is forgotten once the window has passed,
+        # after which the slower requests no longer lower the limit
+        for _ in range(2 * LATENCY_WINDOW):
+            self.run_round(controller, 0.04, kind="stat")
+        limits = []
+        for _ in range(10):
+            self.run_round(controller, 0.04, kind="stat")
+            limits.append(controller.limit)
+        self.assertEqual(limits, sorted(limits))
+        self.assertEqual(controller.limit, 8)
+
+    def test_acquire_waits(self):
+        controller = ConcurrencyController(1, initial=1)
+        started = controller.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            controller.release(controller.acquire())
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(timeout=0.1))
+        controller.release(started)
+        self.assertTrue(acquired.wait(timeout=10))
+        thread.join()
+
+    def test_is_congestion(self):
+        self.assertTrue(is_congestion(ConnectionError()))
+        try:
+            try:
+                raise TimeoutError()
+            except TimeoutError as err:
+                raise OSError("Failed to stat path") from err
+        except OSError as err:
+            self.assertTrue(is_congestion(err))
+        self.assertFalse(is_congestion(FileNotFoundError()))
+        self.assertFalse(is_congestion(OSError("Failed to remove path")))
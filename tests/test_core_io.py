@@ -15,13 +15,20 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import unittest
+import io
 import os
 import stat
 import random
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+import numpy as np
+from ssh2.exceptions import SocketDisconnectError
 from ssh2.sftp import LIBSSH2_SFTP_ATTR_PERMISSIONS
 from deling.authenticators.ssh import SSHAuthenticator
+from deling.io.datastores.cache import BlockCache, MetadataCache
 from deling.io.datastores.core import SFTPStore
-from deling.utils.io import makedirs, exists
+from deling.io.datastores.spec import StoreSpec
+from deling.utils.io import makedirs, exists, hashsum, remove
 from common import CommonDataStoreTests, CommonDataStoreFileHandleTests
 from utils import gen_random_file
 from helpers import (
@@ -37,6 +44,10 @@ IMAGE_TAG = "latest"
 IMAGE = "".join([IMAGE_OWNER, "/", IMAGE_NAME, ":", IMAGE_TAG])
 
 
+def read_with_spec(spec, path):
+    return spec.get_store().read(path)
+
+
 class SFTPStoreTest(CommonDataStoreTests, unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -119,6 +130,230 @@ class SFTPStoreTest(CommonDataStoreTests, unittest.TestCase):
         self.assertNotEqual(new_stats, False)
         self.assertEqual(stat.S_IMODE(new_stats.permissions), new_permissions)
 
+    def test_metadata_cache(self):
+        directory = "metadata_cache_dir_{}".format(self.seed)
+        filename = os.path.join(directory, "file")
+        self.share.metadata_cache = MetadataCache()
+        try:
+            self.assertFalse(self.share.exists(directory))
+            self.assertTrue(self.share.mkdir(directory))
+            # The missing entry is invalidated by the mkdir
+            self.assertTrue(self.share.exists(directory))
+            self.assertNotIn("file", self.share.listdir(directory))
+            self.assertTrue(self.share.write(filename, "content"))
+            self.assertIn("file", self.share.listdir(directory))
+            self.assertEqual(self.share.stat(filename).filesize, len("content"))
+            self.assertEqual(self.share.stat(filename).filesize, len("content"))
+
+            # A lost connection is not cached as a missing path
+            self.share.metadata_cache.clear()
+            sftp_channel = self.share.sftp_channel
+            self.share.sftp_channel = mock.Mock(
+                stat=mock.Mock(side_effect=SocketDisconnectError())
+            )
+            try:
+                self.assertRaises(SocketDisconnectError, self.share.exists, filename)
+                self.assertFalse(self.share.stat(filename))
+            finally:
+                self.share.sftp_channel = sftp_channel
+            self.assertTrue(self.share.exists(filename))
+            self.assertTrue(self.share.remove(filename))
+            self.assertFalse(self.share.exists(filename))
+            self.assertNotIn("file", self.share.listdir(directory))
+            self.assertTrue(self.share.rmdir(directory))
+            self.assertFalse(self.share.exists(directory))
+            self.assertGreater(self.share.metadata_cache.stats()["hits"], 0)
+        finally:
+            self.share.metadata_cache = None
+
+    def test_upload_download_checksum(self):
+        filename = "checksum_file_{}".format(self.seed)
+        tmp_test_dir = os.path.join(os.getcwd(), "tests", "tmp")
+        if not exists(tmp_test_dir):
+            self.assertTrue(makedirs(tmp_test_dir))
+        upload_file = os.path.join(tmp_test_dir, filename)
+
+        size = 1024 * 1024 * 5
+        self.assertTrue(gen_random_file(upload_file, size=size))
+        upload_hash = hashsum(upload_file, algorithm="sha256")
+
+        self.assertEqual(
+            self.share.upload(upload_file, filename, checksum="sha256", verify=True),
+            upload_hash,
+        )
+        self.assertEqual(self.share.remote_hashsum(filename), upload_hash)
+        # An algorithm without a remote command is not reported as a mismatch
+        self.assertRaises(
+            ValueError,
+            self.share.upload,
+            upload_file,
+            filename,
+            checksum="sha3_256",
+            verify=True,
+        )
+        self.assertRaises(ValueError, self.share.remote_hashsum, filename, "sha3_256")
+
+        download_path = os.path.join(tmp_test_dir, "downloaded_{}".format(filename))
+        self.assertEqual(
+            self.share.download(filename, download_path, checksum="sha256"),
+            upload_hash,
+        )
+        self.assertEqual(hashsum(download_path, algorithm="sha256"), upload_hash)
+        self.assertTrue(self.share.remove(filename))
+        self.assertTrue(remove(upload_file))
+        self.assertTrue(remove(download_path))
+
+    def test_find_glob(self):
+        directory = "find_directory_{}".format(self.seed)
+        sub_directory = os.path.join(directory, "sub")
+        files = {
+            os.path.join(directory, "small.tif"): "1",
+            os.path.join(sub_directory, "large.tif"): "1" * 10,
+            os.path.join(sub_directory, "other.txt"): "1",
+        }
+        hidden_file = os.path.join(directory, ".hidden.tif")
+        self.assertTrue(self.share.mkdir(sub_directory, recursive=True))
+        for path, content in files.items():
+            self.assertTrue(self.share.write(path, content))
+        self.assertTrue(self.share.write(hidden_file, "1"))
+
+        # Both on the remote end and by walking the tree
+        for allow_exec in (True, False):
+            self.share.allow_exec = allow_exec
+            # Like glob.glob, '*' does not match names that start with '.'
+            self.assertEqual(
+                sorted(self.share.glob(os.path.join(directory, "**", "*.tif"))),
+                sorted(path for path in files if path.endswith(".tif")),
+            )
+            self.assertEqual(
+                list(self.share.glob(os.path.join(directory, ".*"))), [hidden_file]
+            )
+            self.assertEqual(
+                list(self.share.glob(os.path.join(directory, "*", "*.txt"))),
+                [os.path.join(sub_directory, "other.txt")],
+            )
+            found = list(self.share.find(directory, name="*.tif", size=(2, None)))
+            self.assertEqual(
+                [entry.path for entry in found],
+                [os.path.join(sub_directory, "large.tif")],
+            )
+            self.assertEqual(found[0].size, 10)
+            self.assertTrue(found[0].is_file())
+            self.assertEqual(
+                [entry.path for entry in self.share.find(directory, file_type="d")],
+                [sub_directory],
+            )
+        self.share.allow_exec = True
+
+        for path in list(files) + [hidden_file]:
+            self.assertTrue(self.share.remove(path))
+        self.assertTrue(self.share.rmdir(sub_directory))
+        self.assertTrue(self.share.rmdir(directory))
+
+    def test_remove_recursive_directory_exec(self):
+        directory = "remove_exec_directory_{}".format(self.seed)
+        sub_directory = os.path.join(directory, "sub")
+        self.assertTrue(self.share.mkdir(sub_directory, recursive=True))
+        self.assertTrue(self.share.write(os.path.join(sub_directory, "file"), "1"))
+        self.assertTrue(self.share.rmdir(directory, recursive=True, use_exec=True))
+        self.assertFalse(self.share.exists(directory))
+        # Files are not removed as directories
+        self.assertTrue(self.share.write(directory, "1"))
+        self.assertFalse(self.share.rmdir(directory, recursive=True, use_exec=True))
+        self.assertTrue(self.share.remove(directory))
+
+        # A symlink to a directory is not a directory either
+        link = "remove_exec_link_{}".format(self.seed)
+        self.assertTrue(self.share.mkdir(sub_directory, recursive=True))
+        self.share.ssh_client.exec_command(
+            "ln -s {} {}".format(
+                self.share.realpath(directory),
+                os.path.join(self.share.realpath("."), link),
+            )
+        )
+        for path in (link, link + os.sep):
+            self.assertFalse(self.share.rmdir(path, recursive=True, use_exec=True))
+            self.assertFalse(self.share.rmdir(path, recursive=True))
+        self.assertTrue(self.share.exists(sub_directory))
+        self.assertTrue(self.share.remove(link))
+        self.assertTrue(self.share.rmdir(directory, recursive=True, use_exec=True))
+
+    def test_du_exec(self):
+        directory = "du_exec_directory_{}".format(self.seed)
+        sub_directory = os.path.join(directory, "sub")
+        self.assertTrue(self.share.mkdir(sub_directory, recursive=True))
+        self.assertTrue(self.share.write(os.path.join(sub_directory, "content"), "1"))
+        # The remote du agrees with the usage calculated from the directory states
+        self.assertEqual(
+            self.share.du(directory, depth=1, use_exec=True),
+            self.share.du(directory, depth=1),
+        )
+        self.assertTrue(self.share.rmdir(directory, recursive=True))
+
+    def test_store_spec_process_pool(self):
+        filename = "spec_file_{}".format(self.seed)
+        self.assertTrue(self.share.write(filename, "content"))
+
+        spec = StoreSpec.from_store(self.share)
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            contents = list(executor.map(read_with_spec, [spec] * 4, [filename] * 4))
+        self.assertEqual(contents, ["content"] * 4)
+        # The store of the parent process is unaffected by the workers
+        self.assertEqual(self.share.read(filename), "content")
+        self.assertTrue(self.share.remove(filename))
+
+    def test_open_array(self):
+        filename = "array_file_{}".format(self.seed)
+        header = b"HEADER"
+        array = np.arange(20 * 8 * 8, dtype=np.uint16).reshape(20, 8, 8)
+        self.assertTrue(self.share.write(filename, header + array.tobytes()))
+
+        with self.share.open_array(
+            filename, np.uint16, array.shape, offset=len(header)
+        ) as remote_array:
+            self.assertEqual(remote_array.shape, array.shape)
+            self.assertTrue(np.array_equal(remote_array[13], array[13]))
+            self.assertTrue(np.array_equal(remote_array[2:5, :, 3], array[2:5, :, 3]))
+            self.assertTrue(np.array_equal(remote_array[..., ::3], array[..., ::3]))
+            self.assertTrue(np.array_equal(remote_array[[0, 19]], array[[0, 19]]))
+            mask = array[:, 0, 0] % 3 == 0
+            self.assertTrue(np.array_equal(remote_array[mask], array[mask]))
+            self.assertTrue(
+                np.array_equal(remote_array[:, mask[:8]], array[:, mask[:8]])
+            )
+            with self.assertRaises(IndexError):
+                remote_array[mask[:8]]
+            self.assertTrue(np.array_equal(np.asarray(remote_array), array))
+
+        # The slices are read through the shared cache of the store, also
+        # while it is empty
+        self.share.block_cache = BlockCache()
+        try:
+            with self.share.open_array(
+                filename, np.uint16, array.shape, offset=len(header)
+            ) as remote_array:
+                self.assertTrue(np.array_equal(remote_array[13], array[13]))
+            self.assertGreater(len(self.share.block_cache), 0)
+        finally:
+            self.share.block_cache = None
+
+        self.assertTrue(self.share.remove(filename))
+
+    def test_open_npy(self):
+        filename = "array_file_{}.npy".format(self.seed)
+        array = np.asfortranarray(np.random.random((10, 4, 3)))
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        self.assertTrue(self.share.write(filename, buffer.getvalue()))
+
+        with self.share.open_npy(filename) as remote_array:
+            self.assertEqual(remote_array.shape, array.shape)
+            self.assertEqual(remote_array.dtype, array.dtype)
+            self.assertTrue(np.array_equal(remote_array[7], array[7]))
+            self.assertTrue(np.array_equal(remote_array[..., 1], array[..., 1]))
+
+        self.assertTrue(self.share.remove(filename))
+
 
 class SFTPStoreFileHandleTest(CommonDataStoreFileHandleTests, unittest.TestCase):
     @classmethod
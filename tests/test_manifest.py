@@ -0,0 +1,151 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sqlite3
+import stat
+import tempfile
+import time
+import unittest
+from unittest import mock
+from deling.io.datastores.manifest import RemoteManifest, make_attributes
+from deling.io.datastores.tree import DirectoryState, ServerClock
+
+FILE_MODE = stat.S_IFREG | 0o644
+DIRECTORY_MODE = stat.S_IFDIR | 0o755
+
+
+def directory_state(mtime, files, directories=()):
+    return DirectoryState(
+        make_attributes(4096, mtime, DIRECTORY_MODE),
+        {name: make_attributes(size, 1, FILE_MODE) for name, size in files.items()},
+        {name: make_attributes(4096, 1, DIRECTORY_MODE) for name in directories},
+    )
+
+
+class RemoteManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.manifest = RemoteManifest(":memory:", "/root")
+        self.tree = self.manifest.tree
+
+    def tearDown(self):
+        self.manifest.close()
+
+    def test_put_get(self):
+        self.tree.put("/root", directory_state(10, {"a": 1}, ["sub"]))
+        self.tree.put("/root/sub", directory_state(11, {"b": 2}))
+        state = self.tree.get("/root")
+        self.assertEqual(state.mtime, 10)
+        self.assertEqual(list(state.files), ["a"])
+        self.assertEqual(list(state.directories), ["sub"])
+        self.assertIsNone(self.tree.get("/missing"))
+        self.assertEqual(sorted(self.tree.paths("/root")), ["/root", "/root/sub"])
+        self.assertEqual(
+            [entry.path for entry in self.manifest.entries()],
+            ["/root/a", "/root/sub", "/root/sub/b"],
+        )
+        self.assertEqual(self.manifest.entry("/root/sub/b").size, 2)
+
+    def test_read_time(self):
+        state = directory_state(10, {"a": 1})
+        state.read_time = 10.5
+        self.tree.put("/root", state)
+        # Read within the second that the directory was last modified in
+        self.assertEqual(self.tree.get("/root").read_time, 10.5)
+        self.assertFalse(self.tree.get("/root").is_settled())
+        state.read_time = 11
+        self.tree.put("/root", state)
+        self.assertTrue(self.tree.get("/root").is_settled())
+
+    def test_read_time_column(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database_path = os.path.join(directory, "manifest.db")
+            connection = sqlite3.connect(database_path)
+            connection.execute(
+                "CREATE TABLE directories (path TEXT PRIMARY KEY, size INTEGER, "
+                "mtime INTEGER, mode INTEGER)"
+            )
+            connection.execute(
+                "INSERT INTO directories VALUES (?, ?, ?, ?)",
+                ("/root", 4096, 10, DIRECTORY_MODE),
+            )
+            connection.commit()
+            connection.close()
+            with RemoteManifest(database_path, "/root") as manifest:
+                # The directories without a read time are read again
+                self.assertFalse(manifest.tree.get("/root").is_settled())
+
+    def test_changes(self):
+        self.tree.put("/root", directory_state(10, {"a": 1, "b": 2}))
+        since = time.time()
+        self.assertEqual(self.manifest.changes(since), [])
+
+        self.tree.put("/root", directory_state(11, {"a": 5, "c": 3}))
+        changes = {entry.path: entry for entry in self.manifest.changes(since)}
+        self.assertEqual(set(changes), {"/root/a", "/root/b", "/root/c"})
+        self.assertEqual(changes["/root/a"].size, 5)
+        self.assertIsNotNone(changes["/root/b"].deleted)
+        self.assertIsNone(changes["/root/c"].deleted)
+        self.assertEqual(len(self.manifest), 2)
+
+        self.manifest.purge_deleted()
+        self.assertIsNone(self.manifest.entry("/root/b"))
+
+    def test_hashes(self):
+        self.tree.put("/root", directory_state(10, {"a": 1}))
+        self.assertEqual(self.manifest.missing_hashes("sha256"), ["/root/a"])
+        self.manifest.set_hash("/root/a", "digest", "sha256")
+        self.assertEqual(self.manifest.missing_hashes("sha256"), [])
+        self.assertEqual(self.manifest.missing_hashes("md5"), ["/root/a"])
+        # A modified file has to be hashed again
+        self.tree.put("/root", directory_state(11, {"a": 2}))
+        self.assertEqual(self.manifest.missing_hashes("sha256"), ["/root/a"])
+
+    def test_discard_expire(self):
+        self.tree.put("/root", directory_state(10, {}, ["sub"]))
+        self.tree.put("/root/sub", directory_state(11, {"b": 2}))
+        self.manifest.expire("/root")
+        self.assertIsNone(self.tree.get("/root/sub"))
+        self.tree.discard("/root/sub")
+        self.assertNotIn("/root/sub", self.tree)
+        self.assertEqual(
+            [entry.path for entry in self.manifest.entries()], ["/root/sub"]
+        )
+
+
+class ServerClockTests(unittest.TestCase):
+    def test_skewed_clock(self):
+        # The server clock is an hour ahead of or behind the local clock
+        for server_time in (time.time() + 3600, time.time() - 3600):
+            clock = ServerClock()
+            self.assertIsNone(clock.now())
+            monotonic = time.monotonic()
+            with mock.patch(
+                "deling.io.datastores.tree.time.monotonic", return_value=monotonic
+            ) as local_time:
+                clock.observe(server_time)
+                state = directory_state(server_time, {})
+                state.read_time = clock.now()
+                # Changes within the same second would not change the mtime
+                self.assertFalse(state.is_settled())
+                local_time.return_value = monotonic + 1
+                state.read_time = clock.now()
+                self.assertTrue(state.is_settled())
+                # A directory that was modified before a later observation
+                clock.observe(server_time + 10)
+                state = directory_state(server_time + 5, {})
+                state.read_time = clock.now()
+                self.assertTrue(state.is_settled())
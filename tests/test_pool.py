@@ -0,0 +1,82 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import unittest
+from ssh2.exceptions import SFTPProtocolError, SocketDisconnectError
+from deling.io.datastores.core import SFTPStore
+from deling.io.datastores.pool import SFTPConnectionPool, is_request_error
+
+
+class Connection:
+    def __init__(self):
+        self.disconnected = False
+
+    def is_connected(self):
+        return not self.disconnected
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+class SFTPConnectionPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = SFTPConnectionPool("localhost", 22, None, max_size=1)
+        self.connection = Connection()
+        # Hand out a connection without connecting to a server
+        self.pool._idle.append(self.connection)
+        self.pool._size = 1
+
+    def use(self, error):
+        with self.assertRaises(type(error)):
+            with self.pool.connection() as connection:
+                self.assertIs(connection, self.connection)
+                raise error
+
+    def test_is_request_error(self):
+        self.assertTrue(is_request_error(SFTPProtocolError()))
+        wrapped = OSError("failed")
+        wrapped.__cause__ = SFTPProtocolError()
+        self.assertTrue(is_request_error(wrapped))
+        self.assertFalse(is_request_error(SocketDisconnectError()))
+        self.assertFalse(is_request_error(KeyboardInterrupt()))
+
+    def test_request_error_reuses_connection(self):
+        self.use(SFTPProtocolError())
+        self.assertFalse(self.connection.disconnected)
+        self.assertEqual(self.pool.idle, 1)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_other_error_discards_connection(self):
+        self.use(ValueError("failed"))
+        self.assertTrue(self.connection.disconnected)
+        self.assertEqual(self.pool.idle, 0)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_empty_pool(self):
+        pool = SFTPConnectionPool("localhost", 22, None, max_size=0)
+        # Fails right away instead of waiting for a connection to be released
+        with self.assertRaises(ConnectionError):
+            pool.acquire(timeout=None)
+        self.assertEqual(len(pool), 0)
+
+    def test_store_pool_size(self):
+        # Rejected before the store connects to the host
+        with self.assertRaises(ValueError):
+            SFTPStore("localhost", 22, None, pool_size=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
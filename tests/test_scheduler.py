@@ -0,0 +1,134 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import threading
+import time
+import unittest
+from concurrent.futures import CancelledError, wait
+from deling.io.scheduler import (
+    TransferScheduler,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_BULK,
+)
+
+
+class PoolStub:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.idle = max_size
+
+
+class StoreStub:
+    def __init__(self, host, pool_size=8):
+        """Stands in for a connected SFTPStore"""
+        self.host = host
+        self.pool = PoolStub(pool_size)
+
+    def _hold_connection(self):
+        return lambda: None
+
+
+class TransferSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.store = StoreStub("host")
+        self.order = []
+        self.started = threading.Event()
+        self.blocked = threading.Event()
+
+    def block(self, store):
+        self.started.set()
+        self.blocked.wait(timeout=10)
+
+    def record(self, store, name):
+        self.order.append(name)
+        return name
+
+    def test_submit(self):
+        with TransferScheduler() as scheduler:
+            future = scheduler.submit(self.store, self.record, "job")
+            self.assertEqual(future.result(timeout=10), "job")
+            failed = scheduler.submit(self.store, lambda store: 1 / 0)
+            self.assertRaises(ZeroDivisionError, failed.result, 10)
+
+    def test_priority(self):
+        with TransferScheduler(max_workers=1) as scheduler:
+            scheduler.submit(self.store, self.block)
+            futures = [
+                scheduler.submit(
+                    self.store, self.record, "bulk", priority=PRIORITY_BULK
+                ),
+                scheduler.submit(self.store, self.record, "normal"),
+                scheduler.submit(
+                    self.store,
+                    self.record,
+                    "interactive",
+                    priority=PRIORITY_INTERACTIVE,
+                ),
+            ]
+            self.blocked.set()
+            wait(futures, timeout=10)
+        self.assertEqual(self.order, ["interactive", "normal", "bulk"])
+
+    def test_host_limit(self):
+        running = {"host": 0, "other": 0}
+        peak = {"host": 0, "other": 0}
+        lock = threading.Lock()
+
+        def transfer(store):
+            with lock:
+                running[store.host] += 1
+                peak[store.host] = max(peak[store.host], running[store.host])
+            time.sleep(0.05)
+            with lock:
+                running[store.host] -= 1
+
+        other_store = StoreStub("other")
+        with TransferScheduler(max_workers=8, host_limits={"host": 2}) as scheduler:
+            futures = [scheduler.submit(self.store, transfer) for _ in range(6)]
+            futures += [scheduler.submit(other_store, transfer) for _ in range(6)]
+            wait(futures, timeout=10)
+        self.assertEqual(peak["host"], 2)
+        self.assertGreater(peak["other"], 2)
+
+    def test_fair_share(self):
+        with TransferScheduler(max_workers=1) as scheduler:
+            scheduler.submit(self.store, self.block)
+            futures = [
+                scheduler.submit(self.store, self.record, "a", tenant="a")
+                for _ in range(4)
+            ]
+            futures += [
+                scheduler.submit(self.store, self.record, "b", tenant="b")
+                for _ in range(2)
+            ]
+            self.blocked.set()
+            wait(futures, timeout=10)
+        self.assertEqual(self.order, ["a", "b", "a", "b", "a", "a"])
+
+    def test_cancel(self):
+        scheduler = TransferScheduler(max_workers=1)
+        blocker = scheduler.submit(self.store, self.block)
+        cancelled = scheduler.submit(self.store, self.record, "cancelled")
+        queued = scheduler.submit(self.store, self.record, "queued")
+        self.assertTrue(cancelled.cancel())
+        self.assertTrue(self.started.wait(timeout=10))
+        scheduler.shutdown(wait=False, cancel_futures=True)
+        self.assertRaises(RuntimeError, scheduler.submit, self.store, self.record, "")
+        self.blocked.set()
+        self.assertIsNone(blocker.result(timeout=10))
+        self.assertRaises(CancelledError, queued.result, 10)
+        scheduler.shutdown(wait=True)
+        self.assertEqual(self.order, [])
@@ -0,0 +1,115 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import pickle
+import unittest
+from deling.authenticators.ssh import SSHAuthenticator
+from deling.io.datastores.cache import MetadataCache
+from deling.io.datastores.core import SFTPStore
+from deling.io.datastores.spec import StoreSpec, close_stores
+
+
+class PreparingStore:
+    def __init__(self, host, port, authenticator, **kwargs):
+        # Like SFTPStore, the authenticator is prepared when the store is connected
+        authenticator._is_prepared = True
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    def disconnect(self):
+        self.connected = False
+
+
+class StoreSpecTests(unittest.TestCase):
+    def setUp(self):
+        self.spec = StoreSpec(
+            "127.0.0.1",
+            "2222",
+            SSHAuthenticator(username="mountuser", password="Passw0rd!"),
+            allow_exec=False,
+        )
+
+    def test_pickle(self):
+        spec = pickle.loads(pickle.dumps(self.spec))
+        self.assertEqual(spec.host, "127.0.0.1")
+        self.assertEqual(spec.port, "2222")
+        self.assertIs(spec.store_class, SFTPStore)
+        self.assertEqual(spec.kwargs, {"allow_exec": False})
+        self.assertEqual(spec.authenticator.credentials.username, "mountuser")
+        # Specs that are unpickled separately share their process store
+        self.assertEqual(spec, pickle.loads(pickle.dumps(self.spec)))
+        self.assertEqual(hash(spec), hash(self.spec))
+
+    def test_not_equal(self):
+        other_authenticator = StoreSpec(
+            "127.0.0.1",
+            "2222",
+            SSHAuthenticator(username="otheruser", password="Passw0rd!"),
+            allow_exec=False,
+        )
+        other_options = StoreSpec(
+            "127.0.0.1",
+            "2222",
+            SSHAuthenticator(username="mountuser", password="Passw0rd!"),
+        )
+        self.assertNotEqual(self.spec, other_authenticator)
+        self.assertNotEqual(self.spec, other_options)
+
+    def test_equal_options(self):
+        specs = [
+            StoreSpec(
+                "127.0.0.1",
+                "2222",
+                SSHAuthenticator(username="mountuser", password="Passw0rd!"),
+                pool_size=pool_size,
+                rate_limits=rate_limits,
+            )
+            for pool_size, rate_limits in (
+                (2, {"bulk": 1024, "interactive": 512}),
+                (2.0, {"interactive": 512.0, "bulk": 1024}),
+            )
+        ]
+        self.assertEqual(specs[0], specs[1])
+        self.assertEqual(hash(specs[0]), hash(specs[1]))
+
+    def test_unpicklable_option(self):
+        with self.assertRaisesRegex(ValueError, "metadata_cache"):
+            StoreSpec(
+                "127.0.0.1",
+                "2222",
+                SSHAuthenticator(username="mountuser", password="Passw0rd!"),
+                metadata_cache=MetadataCache(),
+            )
+
+    def test_get_store(self):
+        spec = StoreSpec(
+            "127.0.0.1",
+            "2222",
+            SSHAuthenticator(username="mountuser", password="Passw0rd!"),
+            store_class=PreparingStore,
+        )
+        key = spec.key
+        try:
+            store = spec.get_store()
+            self.assertTrue(spec.authenticator.is_prepared)
+            self.assertEqual(spec.key, key)
+            self.assertIs(spec.get_store(), store)
+            store.disconnect()
+            self.assertIsNot(spec.get_store(), store)
+        finally:
+            close_stores()
@@ -0,0 +1,74 @@
+# Copyright (C) 2024  rasmunk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import time
+import unittest
+from unittest import mock
+from deling.io.datastores.throttle import (
+    TokenBucket,
+    Throttle,
+    TRAFFIC_BULK,
+    TRAFFIC_INTERACTIVE,
+    host_throttle,
+    throttle_transfer,
+)
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_unlimited(self):
+        bucket = TokenBucket()
+        self.assertEqual(bucket.consume(1024**3), 0.0)
+
+    def test_consume(self):
+        bucket = TokenBucket(rate=1000, burst=100)
+        self.assertEqual(bucket.consume(100), 0.0)
+        self.assertAlmostEqual(bucket.consume(100), 0.1, places=2)
+        # The debt is kept when the rate is changed
+        bucket.set_rate(2000, burst=100)
+        self.assertAlmostEqual(bucket.consume(0), 0.05, places=2)
+        bucket.set_rate(None)
+        self.assertEqual(bucket.consume(100), 0.0)
+        self.assertRaises(ValueError, bucket.set_rate, 0)
+
+
+class ThrottleTests(unittest.TestCase):
+    def test_traffic_classes(self):
+        throttle = Throttle({TRAFFIC_BULK: 1000})
+        self.assertEqual(throttle.rate(TRAFFIC_BULK), 1000)
+        self.assertIsNone(throttle.rate(TRAFFIC_INTERACTIVE))
+        self.assertGreater(throttle.consume(10000, traffic=TRAFFIC_BULK), 0.0)
+        self.assertEqual(throttle.consume(10000, traffic=TRAFFIC_INTERACTIVE), 0.0)
+        self.assertRaises(ValueError, throttle.consume, 1, traffic="unknown")
+
+    def test_host_throttle(self):
+        self.assertIs(host_throttle("throttle-host"), host_throttle("throttle-host"))
+        self.assertIsNot(host_throttle("throttle-host"), host_throttle("other-host"))
+
+    def test_throttle_transfer(self):
+        store_throttle = Throttle({TRAFFIC_BULK: 100000})
+        process_throttle = Throttle({TRAFFIC_BULK: 50000})
+        for throttle in (store_throttle, process_throttle):
+            throttle.set_rate(throttle.rate(TRAFFIC_BULK), burst=1)
+
+        sleep = mock.Mock(side_effect=time.sleep)
+        started = time.monotonic()
+        with mock.patch("deling.io.datastores.throttle.time.sleep", sleep):
+            for _ in range(500):
+                throttle_transfer(10, TRAFFIC_BULK, [store_throttle, process_throttle])
+        # The slowest throttle limits 5000 bytes to 0.1 seconds
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        # The small transfers are not each followed by a sleep
+        self.assertLess(sleep.call_count, 10)